@@ -33,7 +33,8 @@ setup(
     entry_points={
         "console_scripts": [
             "note-retitler=src.note_retitler:main",
-            "retitle=src.tasks:retitle_cli",
+            "retitle=src.cli:retitle_cli",
+            "retitle-client=src.client:client_cli",
         ],
     },
     classifiers=[
@@ -4,14 +4,43 @@ Note Retitler Package
 A Python package for standardizing date formats in note filenames.
 """
 
-from .note_retitler import parse_date_from_filename, generate_new_filename, process_directory, setup_logging
-
 __version__ = "1.0.0"
 __author__ = "Travis Bounds"
 
 __all__ = [
     "parse_date_from_filename",
-    "generate_new_filename", 
+    "generate_new_filename",
     "process_directory",
-    "setup_logging"
-]
\ No newline at end of file
+    "setup_logging",
+    "parse_many",
+    "iter_parse_many",
+    "ParseResults",
+    "RunStats"
+]
+
+# Public names and the submodule defining them; a submodule is imported the
+# first time one of its names is used, so `import src` stays cheap
+_EXPORTS = {
+    "parse_date_from_filename": "note_retitler",
+    "generate_new_filename": "note_retitler",
+    "process_directory": "note_retitler",
+    "setup_logging": "note_retitler",
+    "parse_many": "batch",
+    "iter_parse_many": "batch",
+    "ParseResults": "batch",
+    "RunStats": "metrics",
+}
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    value = getattr(import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
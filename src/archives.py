@@ -0,0 +1,638 @@
+"""
+Archive Mode
+
+Retitles the members of zip and tar archives in place of extracting them,
+running the filesystem retitler, and packing them again. Member names go
+through the same name filter, parse_date_from_filename/generate_new_filename
+and plan_renames as files on disk (directory components are kept), and the
+archive is written to a temporary file next to it that then replaces it.
+
+- zip: members are copied in archive order as raw bytes. Only the local
+  headers and the central directory are written anew, with the new names
+  and shifted offsets; compressed payloads, CRCs and data descriptors are
+  copied unchanged (with copy_file_range where the OS has it, so
+  filesystems with reflinks copy no data at all). Info-ZIP Unicode Path
+  fields are updated with the name.
+- tar: the archive is streamed through tarfile ('r|*' into 'w|'); besides
+  the table of member names only one member's header and a copy buffer are
+  held in memory. Every member name is needed before the first rename can
+  be decided, so names are collected in a first read pass (for an
+  uncompressed tar it seeks over the payloads); the second pass writes. Hard links and symlinks pointing at
+  renamed members are updated too. A compressed tar is one compressed
+  stream, so it is recompressed with the same codec (gzip at level 6).
+"""
+
+import os
+import stat
+import time
+import struct
+import logging
+import posixpath
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from .note_retitler import parse_date_from_filename, generate_new_filename
+from .planner import plan_renames, log_plan_issues
+
+if TYPE_CHECKING:
+    from .metrics import RunStats
+    from .filters import NameFilter
+
+
+# Suffixes recognized as archives when a directory is searched for them
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Bytes copied at a time where copy_file_range is not available
+COPY_SIZE = 1 << 20
+
+# gzip level used when a .tar.gz is recompressed (tarfile's own default is 9)
+GZIP_LEVEL = 6
+
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+_END_RECORD = struct.Struct('<4s4H2LH')
+_ZIP64_END_RECORD = struct.Struct('<4sQ2H2L4Q')
+_ZIP64_LOCATOR = struct.Struct('<4sLQL')
+
+_LOCAL_SIGNATURE = b'PK\x03\x04'
+_CENTRAL_SIGNATURE = b'PK\x01\x02'
+_END_SIGNATURE = b'PK\x05\x06'
+_ZIP64_END_SIGNATURE = b'PK\x06\x06'
+_ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+
+# General purpose flag: names are UTF-8 instead of code page 437
+_UTF8_FLAG = 0x800
+_ZIP64_EXTRA = 0x0001
+_UNICODE_PATH_EXTRA = 0x7075
+_MAX_32 = 0xFFFFFFFF
+_MAX_16 = 0xFFFF
+
+# Leading bytes of the compressed streams tarfile reads
+_TAR_CODECS = ((b'\x1f\x8b', 'gz'), (b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'xz'))
+
+
+class ArchiveError(ValueError):
+    """
+    Raised for archives that cannot be rewritten safely.
+    """
+
+
+def archive_kind(path: str) -> Optional[str]:
+    """
+    Detect the kind of an archive from its contents.
+
+    Args:
+        path: Path of the file
+
+    Returns:
+        'zip', 'tar' or None for anything else
+    """
+    import tarfile
+    import zipfile
+
+    if zipfile.is_zipfile(path):
+        return 'zip'
+    try:
+        if tarfile.is_tarfile(path):
+            return 'tar'
+    except OSError:
+        pass
+    return None
+
+
+def plan_member_renames(archive: str, members: Iterable[Tuple[str, bool]], logger: logging.Logger,
+                        name_filter: 'Optional[NameFilter]' = None) -> Dict[str, str]:
+    """
+    Decide the new names of an archive's members.
+
+    Args:
+        archive: Archive path, for log messages
+        members: (name, is_file) for every member in archive order
+        logger: Logger instance for output
+        name_filter: Names to consider (default: default_name_filter())
+
+    Returns:
+        Dict of old member name -> new member name, collisions and
+        duplicate targets left out as in plan_renames
+    """
+    from .filters import default_name_filter
+
+    accepts = (name_filter or default_name_filter()).match
+    names = set()
+    candidates = []
+    for name, is_file in members:
+        names.add(name)
+        if not is_file or accepts(name.rpartition('/')[2]) is None:
+            continue
+        new_name = retitled_member_name(name)
+        if new_name != name:
+            candidates.append((name, new_name, 0))
+
+    # Members are renamed all at once, so the plan's chains and cycles are
+    # irrelevant; only which renames survive collision checks matters
+    plan = plan_renames(names, candidates)
+    plan.directory = archive
+    log_plan_issues(plan, logger)
+    return dict(plan.renames)
+
+
+def _temporary_path(path: str) -> str:
+    # Same naming as the planner's temporary files, which runs never rename
+    directory, filename = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{filename}.retitle-{os.getpid()}.tmp")
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _copy_range(source_fd: int, target_fd: int, offset: int, length: int) -> None:
+    """
+    Append length bytes from offset of source_fd to target_fd.
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while length > 0:
+                copied = os.copy_file_range(source_fd, target_fd, length, offset)
+                if copied == 0:
+                    break
+                offset += copied
+                length -= copied
+        except OSError:
+            # Unsupported between these filesystems; copy the rest by hand
+            pass
+    while length > 0:
+        data = os.pread(source_fd, min(length, COPY_SIZE), offset)
+        if not data:
+            raise ArchiveError("Archive ends inside a member")
+        _write_all(target_fd, data)
+        offset += len(data)
+        length -= len(data)
+
+
+def _split_extra(extra: bytes) -> List[Tuple[int, bytes]]:
+    fields = []
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, size = struct.unpack_from('<2H', extra, position)
+        fields.append((header_id, extra[position + 4:position + 4 + size]))
+        position += 4 + size
+    return fields
+
+
+def _join_extra(fields: List[Tuple[int, bytes]]) -> bytes:
+    return b''.join(struct.pack('<2H', header_id, len(data)) + data for header_id, data in fields)
+
+
+def retitled_member_name(name: str) -> str:
+    """
+    Apply the filename conversion to the last component of a member name.
+
+    Args:
+        name: Member name with '/' separators
+
+    Returns:
+        The new name, or the name itself when it holds no date
+    """
+    folder, slash, filename = name.rpartition('/')
+    date_result = parse_date_from_filename(filename) if filename else None
+    if date_result is None:
+        return name
+    return folder + slash + generate_new_filename(filename, *date_result)
+
+
+def _renamed_extra(extra: bytes, raw_name: bytes) -> bytes:
+    """
+    Update an Info-ZIP Unicode Path field for a new raw name, if there is one.
+    """
+    import zlib
+
+    fields = _split_extra(extra)
+    if not any(header_id == _UNICODE_PATH_EXTRA for header_id, _ in fields):
+        return extra
+    renamed = []
+    for header_id, data in fields:
+        if header_id == _UNICODE_PATH_EXTRA and data[:1] == b'\x01':
+            # The field holds the name in UTF-8 where the header holds code page 437
+            unicode_name = retitled_member_name(data[5:].decode('utf-8', 'surrogateescape'))
+            data = (b'\x01' + struct.pack('<L', zlib.crc32(raw_name))
+                    + unicode_name.encode('utf-8', 'surrogateescape'))
+        renamed.append((header_id, data))
+    return _join_extra(renamed)
+
+
+def _encode_name(name: str, flags: int) -> bytes:
+    return name.encode('utf-8' if flags & _UTF8_FLAG else 'cp437')
+
+
+def _decode_name(raw: bytes, flags: int) -> str:
+    return raw.decode('utf-8' if flags & _UTF8_FLAG else 'cp437')
+
+
+class _CentralEntry:
+    """
+    One central directory record of a zip archive.
+    """
+
+    __slots__ = ('fields', 'name', 'extra', 'comment', 'offset', 'zip64_offset_at')
+
+    def __init__(self, fields: tuple, name: str, extra: bytes, comment: bytes):
+        self.fields = list(fields)
+        self.name = name
+        self.extra = extra
+        self.comment = comment
+        self.offset = fields[16]
+        # Position of the offset inside the zip64 extra field, if it lives there
+        self.zip64_offset_at = None
+        if self.offset == _MAX_32:
+            self._find_zip64_offset()
+
+    def _find_zip64_offset(self) -> None:
+        position = 0
+        while position + 4 <= len(self.extra):
+            header_id, size = struct.unpack_from('<2H', self.extra, position)
+            if header_id == _ZIP64_EXTRA:
+                # Only the fields saturated in the fixed record are present, in this order
+                at = position + 4
+                if self.fields[9] == _MAX_32:
+                    at += 8
+                if self.fields[8] == _MAX_32:
+                    at += 8
+                self.zip64_offset_at = at
+                self.offset = struct.unpack_from('<Q', self.extra, at)[0]
+                return
+            position += 4 + size
+        raise ArchiveError(f"Missing zip64 offset of member {self.name}")
+
+    def record(self, offset: int, new_name: Optional[str] = None) -> bytes:
+        """
+        The record for the member at a new offset, optionally under a new name.
+        """
+        fields = list(self.fields)
+        extra = self.extra
+        if self.zip64_offset_at is not None:
+            extra = bytearray(extra)
+            struct.pack_into('<Q', extra, self.zip64_offset_at, offset)
+            extra = bytes(extra)
+        elif offset >= _MAX_32:
+            raise ArchiveError("Archive would need zip64 offsets it does not have")
+        else:
+            fields[16] = offset
+        name = _encode_name(new_name or self.name, fields[3])
+        if new_name is not None:
+            extra = _renamed_extra(extra, name)
+        fields[10] = len(name)
+        fields[11] = len(extra)
+        return _CENTRAL_HEADER.pack(*fields) + name + extra + self.comment
+
+
+def _read_zip_directory(fd: int, size: int) -> Tuple[List[_CentralEntry], int, bytes, bytes, bool]:
+    """
+    Read the central directory of a zip archive.
+
+    Returns:
+        Tuple of (entries, central directory offset, end record, archive
+        comment, whether the archive has zip64 end records)
+    """
+    tail_size = min(size, _END_RECORD.size + _MAX_16)
+    tail = os.pread(fd, tail_size, size - tail_size)
+    end_at = tail.rfind(_END_SIGNATURE)
+    if end_at < 0 or end_at + _END_RECORD.size > len(tail):
+        raise ArchiveError("No end of central directory record")
+    end = _END_RECORD.unpack_from(tail, end_at)
+    comment = tail[end_at + _END_RECORD.size:end_at + _END_RECORD.size + end[7]]
+    if end[1] or end[2]:
+        raise ArchiveError("Multi-disk archives are not supported")
+    count, directory_size, directory_offset = end[4], end[5], end[6]
+    end_position = size - tail_size + end_at
+
+    zip64 = False
+    locator_at = end_position - _ZIP64_LOCATOR.size
+    if locator_at >= 0:
+        locator = _ZIP64_LOCATOR.unpack(os.pread(fd, _ZIP64_LOCATOR.size, locator_at))
+        if locator[0] == _ZIP64_LOCATOR_SIGNATURE:
+            record = _ZIP64_END_RECORD.unpack(os.pread(fd, _ZIP64_END_RECORD.size, locator[2]))
+            if record[0] != _ZIP64_END_SIGNATURE:
+                raise ArchiveError("Broken zip64 end of central directory record")
+            zip64 = True
+            count, directory_size, directory_offset = record[7], record[8], record[9]
+            end_position = locator[2]
+
+    if directory_offset + directory_size != end_position:
+        # Data before the archive (self-extractors) shifts every offset
+        raise ArchiveError("Archives with leading data are not supported")
+
+    directory = os.pread(fd, directory_size, directory_offset)
+    entries = []
+    position = 0
+    for _ in range(count):
+        fields = _CENTRAL_HEADER.unpack_from(directory, position)
+        if fields[0] != _CENTRAL_SIGNATURE:
+            raise ArchiveError("Broken central directory")
+        position += _CENTRAL_HEADER.size
+        name_length, extra_length, comment_length = fields[10], fields[11], fields[12]
+        raw_name = directory[position:position + name_length]
+        position += name_length
+        extra = directory[position:position + extra_length]
+        position += extra_length
+        entry_comment = directory[position:position + comment_length]
+        position += comment_length
+        entries.append(_CentralEntry(fields, _decode_name(raw_name, fields[3]), extra, entry_comment))
+    return entries, directory_offset, tail[end_at:end_at + _END_RECORD.size], comment, zip64
+
+
+def _rewrite_zip(path: str, temp_path: str, entries: List[_CentralEntry], directory_offset: int,
+                 end_record: bytes, comment: bytes, zip64: bool, renames: Dict[str, str]) -> None:
+    source_fd = os.open(path, os.O_RDONLY)
+    target_fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        by_offset = sorted(entries, key=lambda entry: entry.offset)
+        ends = [entry.offset for entry in by_offset[1:]] + [directory_offset]
+        new_offsets = {}
+        position = 0
+        if by_offset and by_offset[0].offset:
+            # Bytes between the start and the first member are kept as they are
+            _copy_range(source_fd, target_fd, 0, by_offset[0].offset)
+            position = by_offset[0].offset
+        for entry, end in zip(by_offset, ends):
+            header = _LOCAL_HEADER.unpack(os.pread(source_fd, _LOCAL_HEADER.size, entry.offset))
+            if header[0] != _LOCAL_SIGNATURE:
+                raise ArchiveError(f"Broken local header of member {entry.name}")
+            name_length, extra_length = header[9], header[10]
+            data_start = entry.offset + _LOCAL_HEADER.size + name_length + extra_length
+            raw_name = os.pread(source_fd, name_length, entry.offset + _LOCAL_HEADER.size)
+            extra = os.pread(source_fd, extra_length, data_start - extra_length)
+            new_name = renames.get(entry.name)
+            if new_name is not None:
+                raw_name_new = _encode_name(new_name, header[2])
+                extra = _renamed_extra(extra, raw_name_new)
+                raw_name = raw_name_new
+            new_offsets[id(entry)] = position
+            local = (_LOCAL_HEADER.pack(*header[:9], len(raw_name), len(extra)) + raw_name + extra)
+            _write_all(target_fd, local)
+            _copy_range(source_fd, target_fd, data_start, end - data_start)
+            position += len(local) + end - data_start
+
+        new_directory_offset = position
+        for entry in entries:
+            record = entry.record(new_offsets[id(entry)], renames.get(entry.name))
+            _write_all(target_fd, record)
+            position += len(record)
+        directory_size = position - new_directory_offset
+
+        end = list(_END_RECORD.unpack(end_record))
+        if zip64:
+            zip64_end = _ZIP64_END_RECORD.pack(_ZIP64_END_SIGNATURE, _ZIP64_END_RECORD.size - 12,
+                                               45, 45, 0, 0, len(entries), len(entries),
+                                               directory_size, new_directory_offset)
+            _write_all(target_fd, zip64_end + _ZIP64_LOCATOR.pack(_ZIP64_LOCATOR_SIGNATURE, 0, position, 1))
+            end[5] = min(directory_size, _MAX_32)
+            end[6] = min(new_directory_offset, _MAX_32)
+        elif new_directory_offset >= _MAX_32 or directory_size >= _MAX_32:
+            raise ArchiveError("Archive would need zip64 offsets it does not have")
+        else:
+            end[5] = directory_size
+            end[6] = new_directory_offset
+        _write_all(target_fd, _END_RECORD.pack(*end) + comment)
+        os.fsync(target_fd)
+    finally:
+        os.close(source_fd)
+        os.close(target_fd)
+
+
+def retitle_zip(path: str, logger: logging.Logger, name_filter: 'Optional[NameFilter]' = None,
+                dry_run: bool = False) -> List[Tuple[str, str]]:
+    """
+    Rename the members of a zip archive without recompressing them.
+
+    Args:
+        path: Path of the archive
+        logger: Logger instance for output
+        name_filter: Names to consider (default: default_name_filter())
+        dry_run: Only report the renames
+
+    Returns:
+        List of (old_name, new_name) member names, in central directory order
+
+    Raises:
+        ArchiveError: For layouts that cannot be rewritten (multi-disk,
+            leading data, offsets needing zip64 the archive lacks)
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        entries, directory_offset, end_record, comment, zip64 = _read_zip_directory(fd, os.fstat(fd).st_size)
+    finally:
+        os.close(fd)
+
+    renames = plan_member_renames(path, ((entry.name, not entry.name.endswith('/')) for entry in entries),
+                                  logger, name_filter)
+    renamed = [(entry.name, renames[entry.name]) for entry in entries if entry.name in renames]
+    if not renamed or dry_run:
+        return renamed
+
+    temp_path = _temporary_path(path)
+    try:
+        _rewrite_zip(path, temp_path, entries, directory_offset, end_record, comment, zip64, renames)
+        _replace(path, temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return renamed
+
+
+def _tar_codec(path: str) -> str:
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    for prefix, codec in _TAR_CODECS:
+        if magic.startswith(prefix):
+            return codec
+    return ''
+
+
+def _open_compressed(fileobj, codec: str):
+    """
+    Wrap an output file in the compressor of a codec ('' for none).
+    """
+    if codec == 'gz':
+        import gzip
+        return gzip.GzipFile(filename='', mode='wb', compresslevel=GZIP_LEVEL, fileobj=fileobj, mtime=0)
+    if codec == 'bz2':
+        import bz2
+        return bz2.BZ2File(fileobj, 'wb')
+    if codec == 'xz':
+        import lzma
+        return lzma.LZMAFile(fileobj, 'wb')
+    return None
+
+
+def _stream_members(path: str, codec: str):
+    """
+    Iterate over the members of a tar archive in one streaming pass.
+
+    Yields:
+        Tuples of (TarFile, TarInfo); a member's data can be read from the
+        TarFile until the next member is requested
+    """
+    import tarfile
+
+    with open(path, 'rb') as f:
+        # Uncompressed archives are read with seeks over the member data
+        mode = 'r:' if not codec else 'r|*'
+        with tarfile.open(fileobj=f, mode=mode) as archive:
+            while True:
+                member = archive.next()
+                if member is None:
+                    break
+                yield archive, member
+                # TarFile keeps every member it has read; forget them
+                archive.members = []
+
+
+def _new_link(member, renames: Dict[str, str]) -> Optional[str]:
+    """
+    New link target of a hard link or symlink whose target was renamed.
+    """
+    if member.islnk():
+        return renames.get(member.linkname)
+    if member.issym() and not member.linkname.startswith('/'):
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(member.name), member.linkname))
+        new_target = renames.get(target)
+        if new_target is not None:
+            return posixpath.join(posixpath.dirname(member.linkname), posixpath.basename(new_target))
+    return None
+
+
+def retitle_tar(path: str, logger: logging.Logger, name_filter: 'Optional[NameFilter]' = None,
+                dry_run: bool = False) -> List[Tuple[str, str]]:
+    """
+    Rename the members of a tar archive by streaming it into a new one.
+
+    Args:
+        path: Path of the archive (plain, gzip, bzip2 or xz)
+        logger: Logger instance for output
+        name_filter: Names to consider (default: default_name_filter())
+        dry_run: Only report the renames
+
+    Returns:
+        List of (old_name, new_name) member names, in archive order
+    """
+    import tarfile
+
+    codec = _tar_codec(path)
+    renames = plan_member_renames(path, ((member.name, member.isreg() or member.islnk())
+                                         for _, member in _stream_members(path, codec)),
+                                  logger, name_filter)
+    if not renames or dry_run:
+        return [(old_name, new_name) for old_name, new_name in renames.items()]
+
+    renamed = []
+    temp_path = _temporary_path(path)
+    try:
+        with open(temp_path, 'wb') as raw:
+            compressed = _open_compressed(raw, codec)
+            try:
+                with tarfile.open(fileobj=compressed or raw, mode='w|', format=tarfile.PAX_FORMAT) as output:
+                    for archive, member in _stream_members(path, codec):
+                        new_name = renames.get(member.name)
+                        if new_name is not None:
+                            renamed.append((member.name, new_name))
+                            member.name = new_name
+                            # A pax path record would override the header name
+                            member.pax_headers.pop('path', None)
+                        new_link = _new_link(member, renames)
+                        if new_link is not None:
+                            member.linkname = new_link
+                            member.pax_headers.pop('linkpath', None)
+                        output.addfile(member, archive.extractfile(member) if member.isreg() else None)
+                        output.members = []
+            finally:
+                if compressed is not None:
+                    compressed.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        _replace(path, temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return renamed
+
+
+def _replace(path: str, temp_path: str) -> None:
+    """
+    Move a rewritten archive over the original, keeping its permissions.
+    """
+    original = os.stat(path)
+    os.chmod(temp_path, stat.S_IMODE(original.st_mode))
+    os.replace(temp_path, path)
+
+
+def find_archives(directory: str, recursive: bool = False) -> List[str]:
+    """
+    List the archives in a directory by their suffixes.
+
+    Args:
+        directory: Directory to search
+        recursive: Search subdirectories too (version-control directories are skipped)
+
+    Returns:
+        Sorted paths of files ending in one of ARCHIVE_SUFFIXES
+    """
+    from .filters import VCS_DIRECTORIES
+
+    archives = []
+    for current, subdirectories, filenames in os.walk(directory):
+        if recursive:
+            subdirectories[:] = [name for name in subdirectories if name not in VCS_DIRECTORIES]
+        else:
+            subdirectories.clear()
+        archives.extend(os.path.join(current, filename) for filename in filenames
+                        if filename.lower().endswith(ARCHIVE_SUFFIXES))
+    return sorted(archives)
+
+
+def retitle_archive(path: str, logger: logging.Logger, name_filter: 'Optional[NameFilter]' = None,
+                    dry_run: bool = False, stats: 'Optional[RunStats]' = None) -> List[Tuple[str, str]]:
+    """
+    Rename the members of a zip or tar archive.
+
+    Args:
+        path: Path of the archive
+        logger: Logger instance for output
+        name_filter: Names to consider (default: default_name_filter())
+        dry_run: Only report the renames
+        stats: Optional RunStats collecting timers and counters
+
+    Returns:
+        List of (old_name, new_name) member names; empty for files that are
+        not archives or cannot be rewritten (logged as errors)
+    """
+    import tarfile
+    import zlib
+    import lzma
+
+    started = time.perf_counter()
+    kind = archive_kind(path)
+    if kind is None:
+        logger.error("Not a zip or tar archive: %s", path)
+        return []
+
+    logger.info("Processing %s archive: %s", kind, path)
+    try:
+        if kind == 'zip':
+            renamed = retitle_zip(path, logger, name_filter, dry_run)
+        else:
+            renamed = retitle_tar(path, logger, name_filter, dry_run)
+    except (OSError, EOFError, ArchiveError, tarfile.TarError, zlib.error, lzma.LZMAError) as e:
+        # Corrupt or truncated data; the original archive is left as it was
+        logger.error("Failed to process archive %s: %s", path, e)
+        return []
+
+    for old_name, new_name in renamed:
+        logger.info("%s: %s -> %s", "Would rename" if dry_run else "Renamed", old_name, new_name)
+    if stats is not None:
+        stats.add_time('archives', time.perf_counter() - started)
+        stats.add(archives=1, archive_renames=0 if dry_run else len(renamed))
+    return renamed
@@ -0,0 +1,163 @@
+"""
+Batch Parsing
+
+Date parsing for large collections of filenames that never touch a
+filesystem, such as database exports or object-store listings. Names are
+parsed in chunks with the lookup table, regex and helpers bound once per
+chunk, and very large inputs can be spread over a pool of processes.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from .note_retitler import _digit_run_pattern, _filename_stem, _get_date_table, _parse_numeric_date
+
+
+# Names handed to a worker process at a time
+DEFAULT_CHUNK_SIZE = 50000
+
+
+class ParseResults(NamedTuple):
+    """
+    Parallel result lists of parse_many; index i belongs to the i-th name.
+
+    Attributes:
+        date_parts: Digit run that was recognised as a date, or None
+        dates: Formatted YYYY-MM-DD date, or None
+    """
+    date_parts: List[Optional[str]]
+    dates: List[Optional[str]]
+
+
+def _parse_chunk(names: List[str]) -> ParseResults:
+    """
+    Parse a chunk of filenames, same rules as parse_date_from_filename.
+
+    Args:
+        names: Filenames to parse
+
+    Returns:
+        ParseResults for the chunk
+    """
+    table_get = _get_date_table().get
+    find_runs = _digit_run_pattern().findall
+    separators = {'/', os.sep, os.altsep} - {None}
+    date_parts = []
+    dates = []
+    append_part = date_parts.append
+    append_date = dates.append
+
+    for filename in names:
+        result = None
+        # For a plain name, a numeric stem is also the first digit run, so the
+        # stem check of parse_date_from_filename is only needed for paths
+        if not separators.isdisjoint(filename):
+            stem = _filename_stem(filename)
+            if stem.isdigit():
+                result = table_get(stem) or (None if stem.isascii() else _parse_numeric_date(stem))
+        if result is None:
+            for date_str in find_runs(filename):
+                # The table only holds ASCII digit runs
+                result = table_get(date_str) or (None if date_str.isascii() else _parse_numeric_date(date_str))
+                if result:
+                    break
+        if result:
+            append_part(result[0])
+            append_date(result[1])
+        else:
+            append_part(None)
+            append_date(None)
+
+    return ParseResults(date_parts, dates)
+
+
+def _chunks(names: Iterable[str], chunk_size: int) -> Iterator[List[str]]:
+    """
+    Split names into lists of at most chunk_size names.
+    """
+    if isinstance(names, list) and len(names) <= chunk_size:
+        yield names
+        return
+    iterator = iter(names)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_chunk_results(names: Iterable[str], workers: Optional[int],
+                        chunk_size: int) -> Iterator[Tuple[List[str], ParseResults]]:
+    """
+    Parse names chunk by chunk, in input order.
+
+    With several workers, at most two chunks per worker are in flight, so an
+    unbounded input is never read far ahead of the consumer.
+
+    Yields:
+        Tuples of (chunk, results of the chunk)
+    """
+    if not workers or workers <= 1:
+        for chunk in _chunks(names, chunk_size):
+            yield chunk, _parse_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for chunk in _chunks(names, chunk_size):
+            in_flight.append((chunk, executor.submit(_parse_chunk, chunk)))
+            if len(in_flight) >= workers * 2:
+                chunk, future = in_flight.popleft()
+                yield chunk, future.result()
+        while in_flight:
+            chunk, future = in_flight.popleft()
+            yield chunk, future.result()
+
+
+def parse_many(names: Iterable[str], workers: Optional[int] = None,
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> ParseResults:
+    """
+    Parse the dates of many filenames at once.
+
+    Args:
+        names: Filenames (any iterable or sequence of str)
+        workers: Number of worker processes; None or 1 parses in this
+            process, -1 uses one per CPU
+        chunk_size: Names parsed per chunk
+
+    Returns:
+        ParseResults with one entry per name, None where no date was found
+    """
+    if workers is not None and workers < 0:
+        workers = os.cpu_count() or 1
+    date_parts = []
+    dates = []
+    for _, results in _iter_chunk_results(names, workers, chunk_size):
+        date_parts.extend(results.date_parts)
+        dates.extend(results.dates)
+    return ParseResults(date_parts, dates)
+
+
+def iter_parse_many(names: Iterable[str], workers: Optional[int] = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[str, Optional[Tuple[str, str]]]]:
+    """
+    Stream the dates of many filenames, in input order.
+
+    Args:
+        names: Filenames (any iterable, may be unbounded)
+        workers: Number of worker processes; None or 1 parses in this
+            process, -1 uses one per CPU
+        chunk_size: Names parsed per chunk
+
+    Yields:
+        Tuples of (filename, result) where result is what
+        parse_date_from_filename returns for the name
+    """
+    if workers is not None and workers < 0:
+        workers = os.cpu_count() or 1
+    for chunk, results in _iter_chunk_results(names, workers, chunk_size):
+        for filename, date_part, date in zip(chunk, results.date_parts, results.dates):
+            yield filename, (date_part, date) if date_part is not None else None
@@ -0,0 +1,477 @@
+"""
+Benchmarks for Note Retitler
+
+Timing helpers behind the invoke bench tasks. Each benchmark prints a small
+table and returns its measurements so they can also be used from scripts.
+
+The benchmark suite (run_suite) times the parse, scan, plan and rename stages
+on a synthetic note corpus. Every scenario runs in a fresh process so its
+peak memory can be measured, and results are written as JSON that later runs
+are compared against with a regression tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import platform
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from logging.handlers import QueueListener
+from typing import Dict, Iterator, List, Optional
+
+from .note_retitler import parse_date_from_filename, setup_logging, shutdown_logging
+from .note_retitler import scan_directory, plan_directory, _is_file, _get_date_table
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+RESULTS_VERSION = 1
+
+# Fraction of the corpus that is dated, undated and already normalized
+DEFAULT_MIX = (0.6, 0.25, 0.15)
+
+# Files per directory of a generated corpus
+DEFAULT_FILES_PER_DIRECTORY = 1000
+
+# Slowdown (or memory growth) over the baseline reported as a regression
+DEFAULT_TOLERANCE = 0.25
+
+# Milliseconds the `retitle` command may add to bare interpreter startup
+# for a run over an empty directory (measured about 60 ms)
+STARTUP_BUDGET_MS = 100.0
+
+# Modules the `retitle` command must not load for a plain directory run
+STARTUP_FORBIDDEN_MODULES = ('invoke', 'src.walker', 'src.journal', 'src.state_cache',
+                             'src.metrics', 'src.batch', 'src.server', 'src.jobs', 'src.bounded',
+                             'src.pathlist', 'src.links', 'src.archives', 'src.distributed',
+                             'concurrent.futures.process', 'ctypes')
+
+BENCH_SCENARIOS = ('parse', 'parse-many', 'scan', 'plan', 'rename')
+
+_DATED_PATTERNS = ("meeting_{date} {tag}.docx", "notes {date} {tag}.md", "{date} {tag}.txt",
+                   "standup-{date}-{tag}.md", "{tag} {date}.md")
+_UNDATED_PATTERNS = ("project_{tag}.md", "ideas {tag}.txt", "{tag}-todo.md", "README {tag}.md")
+_NORMALIZED_PATTERN = "2025-{month:02d}-{day:02d} {tag}.md"
+
+
+def _sample_filenames(count: int) -> List[str]:
+    """
+    Build a repeatable mix of dated, undated and already normalized names.
+
+    Args:
+        count: Number of names to build
+
+    Returns:
+        List of filenames
+    """
+    patterns = ["meeting_{n}.docx", "notes {n}.md", "{n}.txt", "project_x.md", "2025-07-{d:02d}.md"]
+    names = []
+    for i in range(count):
+        pattern = patterns[i % len(patterns)]
+        names.append(pattern.format(n=100 + i % 1200, d=1 + i % 28))
+    return names
+
+
+def _time_loop(names: List[str], log_call) -> float:
+    """
+    Time a processing-like loop over names.
+
+    Args:
+        names: Filenames to process
+        log_call: Function called with (filename, result) for every name
+
+    Returns:
+        Elapsed seconds
+    """
+    start = time.perf_counter()
+    for filename in names:
+        result = parse_date_from_filename(filename)
+        log_call(filename, result)
+    return time.perf_counter() - start
+
+
+def bench_logging(files: int = 200000) -> Dict[str, float]:
+    """
+    Measure the per-file cost of logging in the processing loop.
+
+    Compares the old synchronous f-string logging at INFO with the queued
+    writer at each verbosity. Output goes to a temporary log file so terminal
+    speed does not skew the numbers.
+
+    Args:
+        files: Number of synthetic filenames to process
+
+    Returns:
+        Dictionary of scenario name -> logging overhead in nanoseconds per file
+    """
+    names = _sample_filenames(files)
+    _get_date_table()  # build the lookup table outside the timings
+
+    baseline = _time_loop(names, lambda filename, result: None)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_file = os.path.join(temp_dir, "bench.log")
+
+        # Old behaviour: formatted in the loop and written synchronously
+        sync_logger = logging.getLogger('note_retitler.bench.sync')
+        sync_logger.propagate = False
+        sync_logger.setLevel(logging.INFO)
+        sync_handler = logging.FileHandler(log_file)
+        sync_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        sync_logger.addHandler(sync_handler)
+
+        def sync_call(filename, result):
+            sync_logger.info(f"Processing file: {filename}")
+
+        results["sync f-string INFO"] = _time_loop(names, sync_call)
+        sync_logger.removeHandler(sync_handler)
+        sync_handler.close()
+
+        # New behaviour at each verbosity, as used by plan_directory
+        for verbosity in ('summary', 'info', 'debug'):
+            logger = setup_logging(log_file, verbosity=verbosity)
+            # Benchmark the file writer only
+            listener = _current_listener()
+            listener.handlers = tuple(h for h in listener.handlers if isinstance(h, logging.FileHandler))
+            debug = logger.isEnabledFor(logging.DEBUG)
+
+            def queued_call(filename, result, logger=logger, debug=debug):
+                if debug:
+                    logger.debug("Processing file: %s", filename)
+
+            results[f"queued {verbosity}"] = _time_loop(names, queued_call)
+            shutdown_logging()
+
+    overhead = {}
+    print(f"Logging overhead over {files} files (baseline {baseline / files * 1e9:.0f} ns/file):")
+    for scenario, elapsed in results.items():
+        overhead[scenario] = max(0.0, (elapsed - baseline) / files * 1e9)
+        print(f"  {scenario:<20} {overhead[scenario]:8.0f} ns/file")
+    return overhead
+
+
+def _tag(index: int) -> str:
+    """
+    Letters-only unique tag for a name index, so it adds no digit runs.
+    """
+    letters = []
+    while True:
+        index, remainder = divmod(index, 26)
+        letters.append(chr(ord('a') + remainder))
+        if not index:
+            return ''.join(reversed(letters))
+
+
+def corpus_names(count: int, seed: int = 0, mix=DEFAULT_MIX) -> Iterator[str]:
+    """
+    Generate a repeatable stream of unique, realistic note filenames.
+
+    Dated names use the 2-5 digit forms the parser handles, undated names
+    contain no digits, and normalized names already carry a YYYY-MM-DD date.
+
+    Args:
+        count: Number of names
+        seed: Random seed
+        mix: Fractions of (dated, undated, normalized) names
+
+    Yields:
+        Filenames, unique within the stream
+    """
+    rng = random.Random(seed)
+    dated, undated, _ = mix
+    for index in range(count):
+        tag = _tag(index)
+        kind = rng.random()
+        month = rng.randint(1, 12)
+        day = rng.randint(1, 28)
+        if kind < dated:
+            date = rng.choice((f"{month}{day}", f"{month}{day:02d}", f"{month:02d}{day:02d}",
+                               f"{month}{day:02d}25"))
+            yield rng.choice(_DATED_PATTERNS).format(date=date, tag=tag)
+        elif kind < dated + undated:
+            yield rng.choice(_UNDATED_PATTERNS).format(tag=tag)
+        else:
+            yield _NORMALIZED_PATTERN.format(month=month, day=day, tag=tag)
+
+
+def default_corpus_root() -> str:
+    """
+    Directory corpora are generated in: /dev/shm (tmpfs) where available.
+    """
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def generate_corpus(root: str, files: int, files_per_directory: int = DEFAULT_FILES_PER_DIRECTORY,
+                    seed: int = 0, mix=DEFAULT_MIX) -> List[str]:
+    """
+    Create a synthetic note tree of empty files.
+
+    Directories are nested two levels deep (root/dNNN/dNNN) so a recursive
+    walk has work to distribute.
+
+    Args:
+        root: Directory to create the tree in (created if missing)
+        files: Total number of files
+        files_per_directory: Files per leaf directory
+        seed: Random seed for the names
+        mix: Fractions of (dated, undated, normalized) names
+
+    Returns:
+        List of the leaf directories created
+    """
+    directories = []
+    names = corpus_names(files, seed, mix)
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY
+    for index in range((files + files_per_directory - 1) // files_per_directory):
+        directory = os.path.join(root, f"d{index // 100:03d}", f"d{index % 100:03d}")
+        os.makedirs(directory, exist_ok=True)
+        directories.append(directory)
+        for _ in range(min(files_per_directory, files - index * files_per_directory)):
+            os.close(os.open(os.path.join(directory, next(names)), flags, 0o644))
+    return directories
+
+
+def _peak_rss_kb() -> Optional[int]:
+    """
+    Peak resident set size of this process in KiB, None where unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _quiet_logger() -> logging.Logger:
+    logger = logging.getLogger('note_retitler.bench.suite')
+    logger.propagate = False
+    logger.setLevel(logging.WARNING)
+    return logger
+
+
+def _run_scenario(scenario: str, files: int, files_per_directory: int, repeat: int,
+                  corpus_root: str) -> Dict[str, float]:
+    """
+    Run one scenario and measure it; called in a fresh process.
+
+    Setup (building names or generating a corpus) is not timed. The best of
+    repeat runs is reported.
+    """
+    logger = _quiet_logger()
+    best = None
+    items = files
+
+    for _ in range(repeat):
+        if scenario in ('parse', 'parse-many'):
+            names = list(corpus_names(files))
+            _get_date_table()  # build the lookup table outside the timing
+            start = time.perf_counter()
+            if scenario == 'parse':
+                for filename in names:
+                    parse_date_from_filename(filename)
+            else:
+                from .batch import parse_many
+                parse_many(names)
+            elapsed = time.perf_counter() - start
+        else:
+            with tempfile.TemporaryDirectory(prefix='retitle-bench-', dir=corpus_root) as temp_dir:
+                directories = generate_corpus(temp_dir, files, files_per_directory)
+                _get_date_table()
+                start = time.perf_counter()
+                if scenario == 'scan':
+                    items = 0
+                    for directory in directories:
+                        items += sum(1 for entry in scan_directory(directory) if _is_file(entry))
+                elif scenario == 'plan':
+                    for directory in directories:
+                        plan_directory(Path(directory), logger)
+                else:
+                    from .walker import process_tree
+                    process_tree(Path(temp_dir), logger)
+                elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return {
+        'seconds': best,
+        'items': items,
+        'ns_per_item': best / max(items, 1) * 1e9,
+        'items_per_second': items / best if best else 0.0,
+        'peak_rss_kb': _peak_rss_kb(),
+    }
+
+
+def run_suite(files: int = 100000, scenarios=BENCH_SCENARIOS,
+              files_per_directory: int = DEFAULT_FILES_PER_DIRECTORY, repeat: int = 3,
+              corpus_root: Optional[str] = None) -> dict:
+    """
+    Run the benchmark scenarios, each in its own process.
+
+    Args:
+        files: Corpus size (names parsed, files scanned, planned or renamed)
+        scenarios: Scenario names from BENCH_SCENARIOS
+        files_per_directory: Files per directory of the generated corpus
+        repeat: Runs per scenario; the fastest is reported
+        corpus_root: Where corpora are generated (default: tmpfs if available)
+
+    Returns:
+        Results dictionary, as written by save_results
+    """
+    corpus_root = corpus_root or default_corpus_root()
+    unknown = set(scenarios) - set(BENCH_SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown benchmark scenario: {', '.join(sorted(unknown))}")
+
+    # A new process per scenario keeps peak memory measurements separate
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+    results = {}
+    for scenario in scenarios:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[scenario] = executor.submit(_run_scenario, scenario, files, files_per_directory,
+                                                repeat, corpus_root).result()
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'files': files,
+        'files_per_directory': files_per_directory,
+        'corpus_root': corpus_root,
+        'scenarios': results,
+    }
+
+
+def save_results(results: dict, results_file: str) -> None:
+    """
+    Write benchmark results as JSON.
+    """
+    with open(results_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+
+
+def load_results(results_file: str) -> dict:
+    """
+    Read benchmark results written by save_results.
+    """
+    with open(results_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_results(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Find scenarios that got slower or bigger than a baseline allows.
+
+    Args:
+        results: Current results
+        baseline: Earlier results to compare against
+        tolerance: Allowed relative growth of time per item and peak memory
+
+    Returns:
+        List of regression descriptions, empty if none
+    """
+    regressions = []
+    for scenario, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if previous is None:
+            continue
+        for metric in ('ns_per_item', 'peak_rss_kb'):
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append(f"{scenario}: {metric} {old:.0f} -> {new:.0f} "
+                                   f"(+{(new / old - 1) * 100:.0f}%, limit +{tolerance * 100:.0f}%)")
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    """
+    Print benchmark results as a table.
+    """
+    print(f"Benchmark over {results['files']} files (Python {results['python']}, "
+          f"corpus in {results['corpus_root']}):")
+    print(f"  {'scenario':<12} {'seconds':>9} {'ns/item':>9} {'items/s':>12} {'peak RSS':>10}")
+    for scenario, measured in results['scenarios'].items():
+        rss = f"{measured['peak_rss_kb'] / 1024:.0f} MiB" if measured['peak_rss_kb'] else "n/a"
+        print(f"  {scenario:<12} {measured['seconds']:9.3f} {measured['ns_per_item']:9.0f} "
+              f"{measured['items_per_second']:12.0f} {rss:>10}")
+
+
+def bench_startup(runs: int = 20, budget_ms: float = STARTUP_BUDGET_MS) -> Dict[str, float]:
+    """
+    Measure how long the `retitle` command takes to start and finish a run.
+
+    Each run is a fresh interpreter executing the installed entry point
+    (src.cli.retitle_cli) on an empty directory, the shape of an editor save
+    hook. The median is compared with an interpreter that does nothing, and
+    the modules the command loaded are checked for ones it should not need.
+
+    Args:
+        runs: Number of timed runs of each command
+        budget_ms: Allowed overhead over bare interpreter startup
+
+    Returns:
+        Dictionary with 'baseline_ms', 'retitle_ms', 'overhead_ms' and 'budget_ms'
+    """
+    import compileall
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    package_root = os.path.dirname(package_dir)
+    # Measure with bytecode in place, as an installed package has it
+    compileall.compile_dir(package_dir, quiet=1)
+    env = dict(os.environ, PYTHONPATH=package_root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    forbidden = repr(STARTUP_FORBIDDEN_MODULES)
+    command = ("import sys; sys.argv = ['retitle', 'notes', '--yes', '--verbosity', 'summary']; "
+               "from src.cli import retitle_cli; retitle_cli(); "
+               f"sys.stderr.write(','.join(m for m in {forbidden} if m in sys.modules))")
+
+    def timed(args, cwd):
+        start = time.perf_counter()
+        completed = subprocess.run(args, cwd=cwd, env=env, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE, text=True, check=True)
+        return time.perf_counter() - start, completed.stderr.strip()
+
+    baseline, command_times, loaded = [], [], ''
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix='retitle-startup-') as temp_dir:
+            os.mkdir(os.path.join(temp_dir, 'notes'))
+            baseline.append(timed([sys.executable, '-c', 'pass'], temp_dir)[0])
+            elapsed, loaded = timed([sys.executable, '-c', command], temp_dir)
+            command_times.append(elapsed)
+
+    result = {
+        'baseline_ms': statistics.median(baseline) * 1000,
+        'retitle_ms': statistics.median(command_times) * 1000,
+        'budget_ms': budget_ms,
+    }
+    result['overhead_ms'] = result['retitle_ms'] - result['baseline_ms']
+    print(f"Startup over {runs} runs (median):")
+    print(f"  python -c pass      {result['baseline_ms']:7.1f} ms")
+    print(f"  retitle (empty dir) {result['retitle_ms']:7.1f} ms")
+    print(f"  overhead            {result['overhead_ms']:7.1f} ms (budget {budget_ms:.0f} ms)")
+    if loaded:
+        print(f"  unexpected modules loaded: {loaded}")
+        result['unexpected_modules'] = loaded.split(',')
+    return result
+
+
+def _current_listener() -> QueueListener:
+    """
+    Return the background log writer started by setup_logging.
+    """
+    from . import note_retitler
+    return note_retitler._log_listener
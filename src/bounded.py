@@ -0,0 +1,320 @@
+"""
+Bounded-Memory Mode
+
+Processing for directories too large to index in memory. The default mode
+keeps every name of a directory in a set and every rename in a list; here a
+directory is handled in two streaming passes instead:
+
+1. The scan is parsed entry by entry and only rename candidates are kept,
+   in a SpillList that moves to a temporary file once it grows past a
+   threshold.
+2. The candidates are planned and renamed in fixed-size chunks. A chunk's
+   name index holds its own sources plus whichever targets already exist
+   on disk (as in plan_names), so no directory-wide index is needed.
+
+Completed renames go to another SpillList, from which the summary is
+printed. Memory therefore depends on the chunk size, the spill threshold
+and the number of directory workers, not on the size of the directory:
+with the defaults and one directory at a time, peak RSS of a whole
+`retitle --bounded-memory` run is about 30 MiB (measured 28-29 MiB for
+20 thousand, 200 thousand and one million files; the default mode needed
+700 MiB for one million). Each extra directory worker adds at most one
+chunk and one spill buffer, about 5 MiB.
+
+Because the index is per chunk, a rename whose target is a file renamed
+away in a later chunk is reported as a collision instead of being chained;
+the next run picks it up.
+"""
+
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional
+
+from .note_retitler import scan_directory, _is_file, parse_date_from_filename, generate_new_filename
+
+if TYPE_CHECKING:
+    from .fs import LocalFilesystem
+    from .metrics import RunStats
+    from .filters import NameFilter
+    from .planner import RenamePlan
+
+
+# Number of candidates planned and renamed together
+DEFAULT_CHUNK_SIZE = 10000
+
+# Number of items a SpillList keeps in memory before moving them to disk
+DEFAULT_SPILL_THRESHOLD = 10000
+
+
+class SpillList:
+    """
+    Append-only list of tuples that moves to a temporary file when it grows.
+
+    Up to ``threshold`` items are kept in memory; beyond that they are
+    written out as JSON lines. Iteration yields the items in the order they
+    were appended. Appends may come from several threads; iterate only
+    once appending is finished.
+    """
+
+    def __init__(self, threshold: int = DEFAULT_SPILL_THRESHOLD, directory: Optional[str] = None):
+        """
+        Args:
+            threshold: Maximum number of items held in memory
+            directory: Directory of the temporary file (default: the system's)
+        """
+        self.threshold = threshold
+        self.directory = directory
+        self._items = []
+        self._file = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __bool__(self) -> bool:
+        return self._count > 0
+
+    @property
+    def spilled(self) -> bool:
+        """True once items have been written to the temporary file."""
+        return self._file is not None
+
+    def extend(self, items: Iterable[tuple]) -> None:
+        """
+        Append items.
+
+        Args:
+            items: Tuples of JSON-serializable values
+        """
+        with self._lock:
+            before = len(self._items)
+            self._items.extend(items)
+            self._count += len(self._items) - before
+            if len(self._items) > self.threshold:
+                self._spill()
+
+    def append(self, item: tuple) -> None:
+        """
+        Append one item.
+
+        Args:
+            item: Tuple of JSON-serializable values
+        """
+        self.extend((item,))
+
+    def _spill(self) -> None:
+        if self._file is None:
+            self._file = tempfile.TemporaryFile('w+', encoding='utf-8', errors='surrogateescape',
+                                                prefix='note_retitler_', suffix='.spill',
+                                                dir=self.directory)
+        else:
+            # Iteration may have left the position elsewhere
+            self._file.seek(0, os.SEEK_END)
+        dumps = json.dumps
+        self._file.writelines(dumps(item, separators=(',', ':')) + '\n' for item in self._items)
+        self._items.clear()
+
+    def __iter__(self) -> Iterator[tuple]:
+        # Not meant to run while items are still being appended
+        if self._file is not None:
+            with self._lock:
+                self._file.flush()
+            self._file.seek(0)
+            for line in self._file:
+                yield tuple(json.loads(line))
+        yield from list(self._items)
+
+    def close(self) -> None:
+        """
+        Delete the temporary file and drop the items.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._items.clear()
+            self._count = 0
+
+    def __enter__(self) -> 'SpillList':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _chunks(items: Iterable[tuple], size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _plan_chunk(directory: str, chunk: list, logger: logging.Logger) -> 'RenamePlan':
+    """
+    Plan one chunk of candidates against its sources and the existing targets.
+    """
+    from .planner import plan_renames, log_plan_issues
+
+    index = {filename for filename, _, _ in chunk}
+    for _, new_filename, _ in chunk:
+        if new_filename not in index and os.path.lexists(os.path.join(directory, new_filename)):
+            index.add(new_filename)
+
+    plan = plan_renames(index, [tuple(candidate) for candidate in chunk], directory)
+    plan.directory = directory
+    log_plan_issues(plan, logger)
+    return plan
+
+
+def process_directory_bounded(directory_path: Path, logger: logging.Logger,
+                              entries: Optional[Iterable[os.DirEntry]] = None,
+                              filesystem: 'Optional[LocalFilesystem]' = None,
+                              rename_workers: int = 1, journal=None,
+                              stats: 'Optional[RunStats]' = None,
+                              name_filter: 'Optional[NameFilter]' = None,
+                              chunk_size: int = DEFAULT_CHUNK_SIZE,
+                              spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+                              record: Optional[SpillList] = None,
+                              root: Optional[str] = None) -> SpillList:
+    """
+    Rename the files of a directory using memory independent of its size.
+
+    Args:
+        directory_path: Path to the directory to process
+        logger: Logger instance for output
+        entries: Optional entries from an ongoing scan_directory pass;
+            the directory is scanned here when omitted
+        filesystem: Filesystem the renames go through (default: local)
+        rename_workers: Number of independent renames run concurrently
+        journal: Optional RenameJournal recording intended and completed renames
+        stats: Optional RunStats collecting timers and counters
+        name_filter: Names to consider (default: default_name_filter())
+        chunk_size: Number of candidates planned and renamed together
+        spill_threshold: Items kept in memory by each SpillList
+        record: SpillList the renames are appended to (a new one by default)
+        root: Record paths relative to this tree root instead of bare filenames
+
+    Returns:
+        SpillList of (old_name, new_name) tuples for renamed files, in rename order
+    """
+    from .planner import execute_plan
+    from .filters import default_name_filter
+    from .walker import relative_renames
+
+    if record is None:
+        record = SpillList(spill_threshold)
+
+    if not directory_path.exists():
+        logger.error("Directory does not exist: %s", directory_path)
+        return record
+
+    if not directory_path.is_dir():
+        logger.error("Path is not a directory: %s", directory_path)
+        return record
+
+    directory = os.path.abspath(directory_path)
+    logger.info("Processing directory: %s", directory_path)
+    if entries is None:
+        entries = scan_directory(directory_path)
+
+    debug = logger.isEnabledFor(logging.DEBUG)
+    accepts = (name_filter or default_name_filter()).match
+    started = time.perf_counter()
+    entry_count = 0
+    filtered = 0
+    file_count = 0
+    parse_misses = 0
+    unchanged = 0
+
+    with SpillList(spill_threshold) as candidates:
+        # Pass 1: keep only the candidates of the scan
+        batch = []
+        for entry in entries:
+            entry_count += 1
+            filename = entry.name
+            if accepts(filename) is None:
+                filtered += 1
+                continue
+            if not _is_file(entry):
+                continue
+            file_count += 1
+            if debug:
+                logger.debug("Processing file: %s", filename)
+            date_result = parse_date_from_filename(filename)
+            if date_result is None:
+                parse_misses += 1
+                continue
+            new_filename = generate_new_filename(filename, *date_result)
+            if new_filename == filename:
+                unchanged += 1
+                continue
+            batch.append((filename, new_filename, entry.inode()))
+            if len(batch) >= chunk_size:
+                candidates.extend(batch)
+                batch.clear()
+        candidates.extend(batch)
+        del batch
+
+        logger.info("Processed %d files", file_count)
+        if candidates.spilled:
+            logger.info("Spilled %d rename candidates to a temporary file", len(candidates))
+        if stats is not None:
+            stats.add_time('parse', time.perf_counter() - started)
+            stats.add(directories=1, entries_scanned=entry_count, entries_filtered=filtered,
+                      files_scanned=file_count, parse_hits=file_count - parse_misses,
+                      parse_misses=parse_misses, unchanged=unchanged, candidates=len(candidates))
+
+        # Pass 2: plan and rename chunk by chunk
+        for chunk in _chunks(candidates, chunk_size):
+            started = time.perf_counter()
+            plan = _plan_chunk(directory, chunk, logger)
+            if stats is not None:
+                stats.add_time('plan', time.perf_counter() - started)
+                stats.add(duplicates=sum(len(sources) - 1 for sources in plan.duplicates.values()),
+                          collisions=len(plan.collisions))
+            renamed = execute_plan(plan, logger, filesystem=filesystem,
+                                   rename_workers=rename_workers, journal=journal, stats=stats)
+            record.extend(relative_renames(root, directory, renamed) if root is not None else renamed)
+
+    return record
+
+
+def process_tree_bounded(root_path: Path, logger: logging.Logger, max_depth: Optional[int] = None,
+                         follow_symlinks: bool = False, workers: Optional[int] = None,
+                         spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+                         **process_options) -> SpillList:
+    """
+    Process a directory tree in bounded-memory mode.
+
+    Args:
+        root_path: Root of the directory tree to process
+        logger: Logger instance for output
+        max_depth: Maximum depth to descend below the root (None for unlimited)
+        follow_symlinks: Descend into symlinked directories
+        workers: Maximum number of directories processed at the same time;
+            each one holds its own chunk in memory
+        spill_threshold: Items kept in memory by each SpillList
+        **process_options: Extra keyword arguments for process_directory_bounded
+
+    Returns:
+        SpillList of (old_path, new_path) tuples relative to the root, in
+        completion order (not sorted, which would need them all in memory)
+    """
+    from .walker import walk_tree
+
+    record = SpillList(spill_threshold)
+    for _ in walk_tree(root_path, logger, process_directory_bounded, max_depth=max_depth,
+                       follow_symlinks=follow_symlinks, workers=workers,
+                       spill_threshold=spill_threshold, record=record, root=str(root_path),
+                       **process_options):
+        pass
+    return record
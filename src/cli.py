@@ -0,0 +1,1175 @@
+"""
+Command-line entry point for Note Retitler
+
+The installed `retitle` command. Kept free of invoke and of every module a
+given run does not need: the rename machinery for plans, journals, state
+caches, watch mode and statistics is imported only on the path that uses it,
+so a hook-triggered single-directory run starts quickly.
+"""
+
+import os
+from pathlib import Path
+from contextlib import nullcontext
+
+from .note_retitler import setup_logging, flush_logging, shutdown_logging, SUMMARY
+from .note_retitler import VERBOSITY_LEVELS, LOG_FORMATS, LOG_QUEUE_LIMIT
+from .note_retitler import process_directory, plan_directory, scan_directory, count_ahead
+from .watcher import WATCH_BACKENDS, DEFAULT_DEBOUNCE
+
+
+def retitle_cli():
+    """
+    CLI entry point for system-wide installation.
+    This allows the script to be called as 'retitle' from anywhere.
+    """
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        description="Retitle note files by converting date formats to YYYY-MM-DD"
+    )
+    parser.add_argument(
+        "path", 
+        nargs="?", 
+        default=".", 
+        help="Target directory path (default: current directory)"
+    )
+    parser.add_argument(
+        "-y", "--yes", 
+        action="store_true", 
+        help="Skip all confirmations and proceed automatically"
+    )
+    parser.add_argument(
+        "-f", "--force", 
+        action="store_true", 
+        help="Alias for --yes, skip all confirmations"
+    )
+    parser.add_argument(
+        "--log", 
+        action="store_true", 
+        help="Save log file"
+    )
+    parser.add_argument(
+        "-r", "--recursive",
+        action="store_true",
+        help="Process all subdirectories as well"
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=None,
+        help="Maximum subdirectory depth in recursive mode (default: unlimited)"
+    )
+    parser.add_argument(
+        "--follow-symlinks",
+        action="store_true",
+        help="Descend into symlinked directories in recursive mode"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of directories processed concurrently in recursive mode"
+    )
+    
+    parser.add_argument(
+        "--plan",
+        metavar="FILE",
+        default=None,
+        help="Write a rename plan to FILE without renaming anything (.gz to compress)"
+    )
+    parser.add_argument(
+        "--apply",
+        metavar="FILE",
+        default=None,
+        help="Apply a rename plan written earlier with --plan"
+    )
+    parser.add_argument(
+        "--rename-workers",
+        type=int,
+        default=None,
+        help="Number of renames run concurrently (for network filesystems, default: 1)"
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=None,
+        help="Worker processes parsing directories with more than 50000 files (-1: one per CPU)"
+    )
+    parser.add_argument(
+        "--max-ops-per-second",
+        type=float,
+        default=None,
+        help="Throttle stat and rename calls to this rate (for shared storage)"
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=None,
+        help="Maximum stat and rename calls running at the same time"
+    )
+    parser.add_argument(
+        "--target-latency",
+        type=float,
+        metavar="MS",
+        default=None,
+        help="Back off the throttle limits while rename latency is above this many milliseconds"
+    )
+    parser.add_argument(
+        "--rename-backend",
+        choices=["auto", "renameat2", "rename"],
+        default="auto",
+        help="How files are renamed: renameat2 refuses to overwrite a target created since "
+             "planning, rename is a plain os.rename (default: auto, renameat2 on Linux)"
+    )
+    parser.add_argument(
+        "--journal",
+        metavar="FILE",
+        default=None,
+        help="Record every rename in a write-ahead journal (enables --resume and --undo)"
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="FILE",
+        default=None,
+        help="Finish an interrupted run from its journal"
+    )
+    parser.add_argument(
+        "--undo",
+        metavar="FILE",
+        default=None,
+        help="Revert the renames recorded in a journal"
+    )
+    parser.add_argument(
+        "--verbosity",
+        choices=sorted(VERBOSITY_LEVELS),
+        default="info",
+        help="Log detail: 'debug' logs every file, 'info' every rename, 'summary' only the summary (default: info)"
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=LOG_FORMATS,
+        default="text",
+        help="Log file format (default: text)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Skip directories unchanged since the last incremental run"
+    )
+    parser.add_argument(
+        "--state-cache",
+        metavar="FILE",
+        default=None,
+        help="State cache file for incremental runs (implies --incremental)"
+    )
+    parser.add_argument(
+        "--update-links",
+        action="store_true",
+        help="Rewrite Markdown and wiki links to renamed notes"
+    )
+    parser.add_argument(
+        "--link-root",
+        metavar="DIR",
+        default=None,
+        help="Vault whose links are rewritten (implies --update-links; default: the target directory)"
+    )
+    parser.add_argument(
+        "--link-index",
+        metavar="FILE",
+        default=None,
+        help="Link index file kept between runs (implies --update-links)"
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and retitle new notes as they arrive (stop with Ctrl+C)"
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=None,
+        help=f"Seconds a directory must be quiet before new notes are retitled (default: {DEFAULT_DEBOUNCE})"
+    )
+    parser.add_argument(
+        "--watch-backend",
+        choices=WATCH_BACKENDS,
+        default="auto",
+        help="Change notification: inotify where available, otherwise polling (default: auto)"
+    )
+    parser.add_argument(
+        "--stats",
+        metavar="FILE",
+        default=None,
+        help="Write run statistics (phase timers, counters, rename latencies) as JSON to FILE"
+    )
+    parser.add_argument(
+        "--prometheus",
+        metavar="FILE",
+        default=None,
+        help="Write run statistics as a Prometheus textfile (e.g. for the node exporter)"
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep running and retitle paths sent by `retitle-client` over a Unix socket"
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        default=None,
+        help="Socket of the server started with --serve (default: $XDG_RUNTIME_DIR/note_retitler.sock)"
+    )
+    parser.add_argument(
+        "--batch-window",
+        type=float,
+        default=None,
+        help="Seconds the server collects requests into one batch (default: 0.05)"
+    )
+    parser.add_argument(
+        "--jobs",
+        metavar="MANIFEST",
+        default=None,
+        help="Process every root listed in a JSON/TOML job manifest on one shared worker pool"
+    )
+    parser.add_argument(
+        "--report",
+        metavar="FILE",
+        default=None,
+        help="Write the consolidated JSON report of a --jobs run to FILE (overrides the manifest)"
+    )
+    parser.add_argument(
+        "--include",
+        metavar="GLOB",
+        action="append",
+        help="Only retitle files matching GLOB (repeatable)"
+    )
+    parser.add_argument(
+        "--exclude",
+        metavar="GLOB",
+        action="append",
+        help="Leave files matching GLOB alone and skip such subdirectories (repeatable)"
+    )
+    parser.add_argument(
+        "--ext",
+        metavar="EXT",
+        action="append",
+        help="Only retitle files with these extensions, e.g. --ext md,txt (repeatable)"
+    )
+    parser.add_argument(
+        "--exclude-ext",
+        metavar="EXT",
+        action="append",
+        help="Leave files with these extensions alone, e.g. --exclude-ext png,jpg (repeatable)"
+    )
+    parser.add_argument(
+        "--no-skip-normalized",
+        action="store_true",
+        help="Also parse names that already contain a YYYY-MM-DD date"
+    )
+    parser.add_argument(
+        "--paths-from",
+        metavar="FILE",
+        default=None,
+        help="Retitle the files listed in FILE ('-' for stdin, needs --yes) instead of "
+             "scanning a directory, e.g. find ... | retitle --paths-from - --yes"
+    )
+    parser.add_argument(
+        "--archive",
+        metavar="FILE",
+        action="append",
+        help="Retitle the members of a zip or tar archive without extracting it "
+             "(repeatable; a directory means every archive in it, with -r also below it)"
+    )
+    parser.add_argument(
+        "-0", "--null",
+        action="store_true",
+        help="Paths in --paths-from are NUL-delimited (find -print0, fd -0)"
+    )
+    parser.add_argument(
+        "--bounded-memory",
+        action="store_true",
+        help="Keep memory use constant for huge directories: plan and rename in "
+             "chunks and spill the rename record to a temporary file"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="Renames planned together in bounded-memory mode (default: 10000)"
+    )
+    parser.add_argument(
+        "--spill-threshold",
+        type=int,
+        default=None,
+        help="Records kept in memory before spilling to disk in bounded-memory mode (default: 10000)"
+    )
+    parser.add_argument(
+        "--coordinate",
+        metavar="DIR",
+        default=None,
+        help="Share a recursive run with other nodes through work leases in DIR on the "
+             "shared mount (implies --recursive; use a new DIR for every run)"
+    )
+    parser.add_argument(
+        "--node-id",
+        default=None,
+        help="Name of this node in a --coordinate run (default: hostname-pid)"
+    )
+    parser.add_argument(
+        "--lease-ttl",
+        type=float,
+        default=None,
+        help="Seconds before another node takes over the directory of a node that "
+             "stopped renewing its lease (default: 30)"
+    )
+    
+    args = parser.parse_args()
+    
+    # Call the retitle logic directly without invoke
+    _retitle_direct(path=args.path, log=args.log, yes=args.yes, force=args.force,
+                    recursive=args.recursive, max_depth=args.max_depth,
+                    follow_symlinks=args.follow_symlinks, workers=args.workers,
+                    plan=args.plan, apply=args.apply, rename_workers=args.rename_workers,
+                    journal=args.journal, resume=args.resume, undo=args.undo,
+                    verbosity=args.verbosity, log_format=args.log_format,
+                    incremental=args.incremental, state_cache=args.state_cache,
+                    update_links=args.update_links, link_root=args.link_root,
+                    link_index=args.link_index,
+                    watch=args.watch, debounce=args.debounce, watch_backend=args.watch_backend,
+                    stats=args.stats, prometheus=args.prometheus,
+                    serve=args.serve, socket=args.socket, batch_window=args.batch_window,
+                    jobs=args.jobs, report=args.report, include=args.include,
+                    exclude=args.exclude, ext=args.ext, exclude_ext=args.exclude_ext,
+                    skip_normalized=not args.no_skip_normalized,
+                    bounded_memory=args.bounded_memory, chunk_size=args.chunk_size,
+                    spill_threshold=args.spill_threshold,
+                    max_ops_per_second=args.max_ops_per_second,
+                    max_in_flight=args.max_in_flight, target_latency=args.target_latency,
+                    rename_backend=args.rename_backend, parse_workers=args.parse_workers,
+                    paths_from=args.paths_from, null=args.null, archive=args.archive,
+                    coordinate=args.coordinate, node_id=args.node_id, lease_ttl=args.lease_ttl)
+
+
+def _split_option(values):
+    """
+    Flatten a repeatable option whose values may also be comma-separated.
+    
+    Invoke passes a single string, argparse a list of strings (or None).
+    """
+    if not values:
+        return []
+    if isinstance(values, str):
+        values = [values]
+    return [item.strip() for value in values for item in value.split(',') if item.strip()]
+
+
+def _build_name_filter(include=None, exclude=None, ext=None, exclude_ext=None, skip_normalized=True):
+    """
+    NameFilter for the filter options, or None when they are all at their defaults.
+    """
+    include, exclude = _split_option(include), _split_option(exclude)
+    ext, exclude_ext = _split_option(ext), _split_option(exclude_ext)
+    if not (include or exclude or ext or exclude_ext) and skip_normalized:
+        return None
+    from .filters import NameFilter
+    return NameFilter(include, exclude, ext, exclude_ext, skip_normalized=skip_normalized)
+
+
+def _setup_run_logging(log, skip_confirmations, verbosity='info', log_format='text', max_queued=None):
+    """
+    Decide on a log file (asking the user if needed) and configure logging.
+    
+    Returns:
+        Tuple of (logger, log_filename) where log_filename is None for
+        console-only logging
+    """
+    from datetime import datetime
+    
+    # Handle log file decision
+    log_filename = None
+    extension = "jsonl" if log_format == "jsonl" else "log"
+    if log is None and not skip_confirmations:
+        # Ask user for confirmation
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        suggested_log = f"note_retitler_{timestamp}.{extension}"
+        save_log = input(f"Save log file as '{suggested_log}'? (y/n): ").lower().strip()
+        if save_log in ['y', 'yes']:
+            log_filename = suggested_log
+    elif log or skip_confirmations:
+        # User explicitly requested log file or using force mode
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        log_filename = f"note_retitler_{timestamp}.{extension}"
+    
+    # Setup logging (console-only when no log file is saved)
+    logger = setup_logging(log_filename, verbosity=verbosity, log_format=log_format,
+                           max_queued=max_queued)
+    if log_filename:
+        print(f"Log file will be saved as: {log_filename}")
+    elif not skip_confirmations:
+        print("Proceeding with console output only.")
+    
+    return logger, log_filename
+
+
+def _print_summary(renamed_files, logger, log_filename, verb="Renamed", run_stats=None,
+                   renamed_count=None):
+    """
+    Print the rename summary of a run and record it in the log file.
+    
+    The summary is printed once; the log records are kept off the console
+    so it is not shown twice. Long-lived modes that do not keep their
+    renames pass only renamed_count.
+    """
+    # Let queued log lines reach the console before printing
+    flush_logging()
+    if run_stats is not None and log_filename and os.path.exists(log_filename):
+        run_stats.add(bytes_logged=os.path.getsize(log_filename))
+    file_only = {'console': False}
+    
+    if renamed_count is None:
+        renamed_count = len(renamed_files)
+    print(f"\nProcessing complete. {verb} {renamed_count} files.")
+    logger.log(SUMMARY, "Processing complete. %s %d files.", verb, renamed_count, extra=file_only)
+    
+    if renamed_files:
+        print(f"\nSummary of {verb.lower()} files:")
+        logger.log(SUMMARY, "Summary of %s files:", verb.lower(), extra=file_only)
+        for old_name, new_name in renamed_files:
+            print(f"  {old_name} -> {new_name}")
+            logger.log(SUMMARY, "  %s -> %s", old_name, new_name, extra=file_only)
+    
+    if log_filename:
+        print(f"\nLog saved to: {log_filename}")
+        logger.log(SUMMARY, "Log saved to: %s", log_filename, extra=file_only)
+    
+    # Write everything still queued before the command returns
+    shutdown_logging()
+
+
+def _apply_saved_plan(plan_file, log=None, skip_confirmations=False, rename_workers=1,
+                      journal=None, verbosity='info', log_format='text', run_stats=None,
+                      filesystem=None, link_root=None, link_index=None):
+    """
+    Execute a rename plan written earlier with --plan.
+    """
+    from .planner import execute_plan, load_plans
+    
+    if not Path(plan_file).is_file():
+        print(f"Error: Plan file does not exist: {plan_file}")
+        return
+    
+    print(f"Rename plan: {plan_file}")
+    if not skip_confirmations:
+        proceed = input(f"Apply rename plan '{plan_file}'? (y/n): ").lower().strip()
+        if proceed not in ['y', 'yes']:
+            print("Operation cancelled.")
+            return
+    
+    logger, log_filename = _setup_run_logging(log, skip_confirmations, verbosity, log_format)
+    logger.info("Applying rename plan: %s", plan_file)
+    
+    # Plans are streamed one directory at a time; no parsing happens here
+    renamed_files = []
+    try:
+        with _total_phase(run_stats), _report_throughput(filesystem, logger, run_stats):
+            for plan in load_plans(plan_file):
+                renamed = execute_plan(plan, logger, filesystem=filesystem,
+                                       rename_workers=rename_workers, journal=journal,
+                                       stats=run_stats)
+                renamed_files.extend((os.path.join(plan.directory, old_name),
+                                      os.path.join(plan.directory, new_name))
+                                     for old_name, new_name in renamed)
+    except ValueError as e:
+        logger.error("Invalid plan file %s: %s", plan_file, e)
+    _update_links(link_root, link_index, renamed_files, '', logger, run_stats=run_stats)
+    
+    _print_summary(renamed_files, logger, log_filename, run_stats=run_stats)
+
+
+def _total_phase(run_stats):
+    """
+    Time a block as the run's 'total' phase, if stats are collected.
+    """
+    return run_stats.phase('total') if run_stats is not None else nullcontext()
+
+
+def _build_filesystem(rename_backend):
+    """
+    Create the filesystem renames go through, or None for the default.
+    """
+    if rename_backend in (None, 'auto'):
+        return None
+    from .fs import LocalFilesystem, NoReplaceFilesystem, renameat2_available
+    if rename_backend == 'rename':
+        return LocalFilesystem()
+    if rename_backend == 'renameat2':
+        if not renameat2_available():
+            print("Warning: renameat2 is not available here, "
+                  "falling back to checked os.rename calls")
+        return NoReplaceFilesystem()
+    raise ValueError(f"Unknown rename backend: {rename_backend}")
+
+
+def _build_throttle(max_ops_per_second, max_in_flight, target_latency, rename_workers, inner=None):
+    """
+    Create the throttled filesystem for a run, or None when no limit was given.
+    """
+    if max_ops_per_second is None and max_in_flight is None and target_latency is None:
+        return None
+    from .fs import ThrottledFilesystem
+    max_ops_per_second = float(max_ops_per_second) if max_ops_per_second is not None else None
+    max_in_flight = int(max_in_flight) if max_in_flight is not None else None
+    target_latency = float(target_latency) / 1000 if target_latency is not None else None
+    if target_latency is not None and max_ops_per_second is None and max_in_flight is None:
+        # Adapt the concurrency the run would have had anyway
+        max_in_flight = max(1, rename_workers)
+    return ThrottledFilesystem(inner, rate=max_ops_per_second, max_in_flight=max_in_flight,
+                               target_latency=target_latency)
+
+
+def _report_throughput(filesystem, logger, run_stats):
+    """
+    Log the throughput of a throttled run while it goes, if one is throttled.
+    """
+    if getattr(filesystem, 'snapshot', None) is None:
+        return nullcontext()
+    from contextlib import contextmanager
+    from .fs import ThroughputReporter
+    
+    @contextmanager
+    def reporting():
+        with ThroughputReporter(filesystem, logger, level=SUMMARY):
+            yield
+        if run_stats is not None:
+            snapshot = filesystem.snapshot()
+            run_stats.add(throttle_backoffs=snapshot['backoffs'])
+            run_stats.add_time('throttle_wait', snapshot['waited'])
+    
+    return reporting()
+
+
+def _update_links(link_root, link_index, renamed_files, base, logger, workers=None, run_stats=None):
+    """
+    Rewrite the links to renamed files in a vault, if requested.
+    
+    Args:
+        base: Directory the paths in renamed_files are relative to
+    """
+    if link_root is None:
+        return
+    from .links import update_links
+    from .walker import default_worker_count
+    renames = [(os.path.join(base, old_path), os.path.join(base, new_path))
+               for old_path, new_path in renamed_files]
+    update_links(link_root, renames, logger, index_file=link_index,
+                 workers=workers or default_worker_count(), stats=run_stats)
+
+
+def _write_stats(run_stats, stats_file, prometheus_file):
+    """
+    Write the statistics of a run to the requested files.
+    
+    Returns:
+        The RunStats, or None when no statistics were requested
+    """
+    if run_stats is None:
+        return None
+    if stats_file:
+        run_stats.write_json(stats_file)
+        print(f"Statistics saved to: {stats_file}")
+    if prometheus_file:
+        run_stats.write_prometheus(prometheus_file)
+        print(f"Prometheus metrics saved to: {prometheus_file}")
+    return run_stats
+
+
+def _open_journal(journal_file):
+    """
+    Open the rename journal for a run, if one was requested.
+    """
+    if not journal_file:
+        return None
+    from .journal import RenameJournal
+    return RenameJournal(journal_file)
+
+
+def _replay_journal(journal_file, undo=False, log=None, skip_confirmations=False, rename_workers=1,
+                    verbosity='info', log_format='text', filesystem=None, link_root=None,
+                    link_index=None):
+    """
+    Resume (or undo) the renames recorded in a journal.
+    """
+    from .journal import resume_journal, undo_journal
+    
+    if not Path(journal_file).is_file():
+        print(f"Error: Journal file does not exist: {journal_file}")
+        return
+    
+    action = "Undo" if undo else "Resume"
+    print(f"Rename journal: {journal_file}")
+    if not skip_confirmations:
+        proceed = input(f"{action} the renames recorded in '{journal_file}'? (y/n): ").lower().strip()
+        if proceed not in ['y', 'yes']:
+            print("Operation cancelled.")
+            return
+    
+    logger, log_filename = _setup_run_logging(log, skip_confirmations, verbosity, log_format)
+    if undo:
+        logger.info("Undoing renames from journal: %s", journal_file)
+        restored_files = undo_journal(journal_file, logger, filesystem=filesystem)
+        _update_links(link_root, link_index, restored_files, '', logger)
+        _print_summary(restored_files, logger, log_filename, verb="Restored")
+    else:
+        logger.info("Resuming renames from journal: %s", journal_file)
+        renamed_files = resume_journal(journal_file, logger, filesystem=filesystem,
+                                       rename_workers=rename_workers)
+        _update_links(link_root, link_index, renamed_files, '', logger)
+        _print_summary(renamed_files, logger, log_filename)
+
+
+def _watch_for_notes(target_path, log=None, skip_confirmations=False, recursive=False,
+                     max_depth=None, debounce=DEFAULT_DEBOUNCE, watch_backend='auto',
+                     rename_workers=1, journal_file=None, verbosity='info', log_format='text',
+                     name_filter=None, filesystem=None, link_root=None, link_index=None):
+    """
+    Retitle notes arriving in a directory until interrupted.
+    """
+    from .watcher import watch as watch_directory
+    from .walker import relative_renames
+    
+    scope = " (recursive)" if recursive else ""
+    print(f"Watching directory: {target_path.absolute()}{scope}")
+    if not skip_confirmations:
+        proceed = input("Retitle new notes as they arrive? (y/n): ").lower().strip()
+        if proceed not in ['y', 'yes']:
+            print("Operation cancelled.")
+            return
+    
+    logger, log_filename = _setup_run_logging(log, skip_confirmations, verbosity, log_format)
+    journal = _open_journal(journal_file)
+    if journal is not None:
+        logger.info("Recording renames in journal: %s", journal_file)
+    
+    renamed_files = []
+    
+    def record_batch(directory, renamed):
+        batch = relative_renames(str(target_path), directory, renamed)
+        renamed_files.extend(batch)
+        _update_links(link_root, link_index, batch, str(target_path), logger)
+    
+    print("Press Ctrl+C to stop.")
+    try:
+        watch_directory(target_path, logger, recursive=recursive, max_depth=max_depth,
+                        debounce=debounce, backend=watch_backend, filesystem=filesystem,
+                        rename_workers=rename_workers, journal=journal, on_batch=record_batch,
+                        name_filter=name_filter)
+    finally:
+        if journal is not None:
+            journal.close()
+    
+    _print_summary(renamed_files, logger, log_filename)
+
+
+def _serve_requests(socket_path=None, log=None, skip_confirmations=False, batch_window=None,
+                    rename_workers=1, journal_file=None, cache=None, verbosity='info',
+                    log_format='text', name_filter=None, filesystem=None, link_root=None,
+                    link_index=None):
+    """
+    Serve retitle requests from `retitle-client` until stopped.
+    """
+    from .server import RetitleServer, DEFAULT_BATCH_WINDOW
+    
+    logger, log_filename = _setup_run_logging(log, skip_confirmations, verbosity, log_format)
+    journal = _open_journal(journal_file)
+    if journal is not None:
+        logger.info("Recording renames in journal: %s", journal_file)
+    
+    # A server runs for weeks: renames are logged as they happen and only counted here
+    renamed_count = 0
+    
+    def record_batch(renamed):
+        nonlocal renamed_count
+        renamed_count += len(renamed)
+        _update_links(link_root, link_index, renamed, '', logger)
+    
+    server = RetitleServer(socket_path, logger,
+                           batch_window=batch_window if batch_window is not None else DEFAULT_BATCH_WINDOW,
+                           filesystem=filesystem, rename_workers=rename_workers, journal=journal,
+                           state_cache=cache, name_filter=name_filter, on_batch=record_batch)
+    try:
+        server.start()
+    except OSError as e:
+        print(f"Error: Cannot listen on {server.socket_path}: {e}")
+        if journal is not None:
+            journal.close()
+        return
+    
+    print(f"Serving on: {server.socket_path}")
+    print("Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    finally:
+        if journal is not None:
+            journal.close()
+        if cache is not None:
+            cache.save()
+    
+    _print_summary((), logger, log_filename, renamed_count=renamed_count)
+
+
+def _run_job_manifest(manifest_file, report_file=None, log=None, skip_confirmations=False,
+                      journal_file=None, verbosity='info', log_format='text', run_stats=None,
+                      filesystem=None, parse_workers=None):
+    """
+    Process all roots of a job manifest in one run with one summary.
+    """
+    from .jobs import load_manifest, run_jobs, write_report
+    
+    try:
+        manifest = load_manifest(manifest_file)
+    except (OSError, ValueError) as e:
+        print(f"Error: Cannot read job manifest {manifest_file}: {e}")
+        return
+    
+    print(f"Job manifest: {manifest_file}")
+    for root in manifest.roots:
+        scope = " (recursive)" if root.recursive else ""
+        print(f"  {root.path}{scope}, priority {root.priority:g}")
+    print(f"{len(manifest.roots)} roots, {manifest.workers} workers, I/O limit {manifest.io_limit}")
+    if not skip_confirmations:
+        proceed = input(f"Proceed with processing {len(manifest.roots)} roots? (y/n): ").lower().strip()
+        if proceed not in ['y', 'yes']:
+            print("Operation cancelled.")
+            return
+    
+    logger, log_filename = _setup_run_logging(log, skip_confirmations, verbosity, log_format)
+    logger.info("Running job manifest: %s", manifest.source)
+    journal = _open_journal(journal_file)
+    if journal is not None:
+        logger.info("Recording renames in journal: %s", journal_file)
+    
+    try:
+        with _total_phase(run_stats):
+            report = run_jobs(manifest, logger, journal=journal, stats=run_stats, filesystem=filesystem,
+                              parse_workers=parse_workers)
+    finally:
+        if journal is not None:
+            journal.close()
+    
+    report_file = report_file or manifest.report
+    renamed_files = []
+    flush_logging()
+    print("\nRoots:")
+    for result in report['roots']:
+        errors = f", {len(result['errors'])} errors" if result['errors'] else ""
+        print(f"  {result['path']}: {result['directories']} directories, "
+              f"{len(result['renamed'])} renamed{errors}")
+        renamed_files.extend((os.path.join(result['path'], old_path), os.path.join(result['path'], new_path))
+                             for old_path, new_path in result['renamed'])
+    if report_file:
+        write_report(report, report_file)
+        logger.info("Job report saved to: %s", report_file)
+        print(f"Job report saved to: {report_file}")
+    _print_summary(renamed_files, logger, log_filename, run_stats=run_stats)
+
+
+def _retitle_path_list(paths_from, null=False, log=None, skip_confirmations=False, rename_workers=1,
+                       journal_file=None, verbosity='info', log_format='text', run_stats=None,
+                       name_filter=None, filesystem=None, link_root=None, link_index=None):
+    """
+    Retitle the files named in a path list read from a file or stdin.
+    """
+    import sys
+    from .pathlist import read_paths, process_path_list
+    
+    from_stdin = paths_from == '-'
+    if from_stdin and not skip_confirmations:
+        # Confirmations would be read from the path list itself
+        print("Error: Reading paths from stdin needs --yes")
+        return
+    if not from_stdin and not Path(paths_from).is_file():
+        print(f"Error: Path list does not exist: {paths_from}")
+        return
+    
+    source = "stdin" if from_stdin else f"'{paths_from}'"
+    delimiter = "NUL" if null else "newline"
+    print(f"Path list: {source} ({delimiter}-delimited)")
+    if not skip_confirmations:
+        proceed = input(f"Proceed with processing the files listed in {source}? (y/n): ").lower().strip()
+        if proceed not in ['y', 'yes']:
+            print("Operation cancelled.")
+            return
+    
+    # The list can be arbitrarily long, so log lines must not pile up either
+    logger, log_filename = _setup_run_logging(log, skip_confirmations, verbosity, log_format,
+                                              max_queued=LOG_QUEUE_LIMIT)
+    logger.info("Reading paths from %s", source)
+    journal = _open_journal(journal_file)
+    if journal is not None:
+        logger.info("Recording renames in journal: %s", journal_file)
+    
+    stream = sys.stdin.buffer if from_stdin else open(paths_from, 'rb')
+    try:
+        with _total_phase(run_stats), _report_throughput(filesystem, logger, run_stats):
+            renamed_files = process_path_list(read_paths(stream, b'\0' if null else b'\n'), logger,
+                                              filesystem=filesystem, rename_workers=rename_workers,
+                                              journal=journal, name_filter=name_filter,
+                                              stats=run_stats)
+            _update_links(link_root, link_index, renamed_files, '', logger, run_stats=run_stats)
+    finally:
+        if not from_stdin:
+            stream.close()
+        if journal is not None:
+            journal.close()
+    
+    _print_summary(renamed_files, logger, log_filename, run_stats=run_stats)
+    renamed_files.close()
+
+
+def _retitle_archives(archives, recursive=False, log=None, skip_confirmations=False,
+                      verbosity='info', log_format='text', run_stats=None, name_filter=None):
+    """
+    Retitle the members of zip and tar archives.
+    """
+    from .archives import find_archives, retitle_archive
+    
+    # Invoke passes one path, argparse a list
+    if isinstance(archives, str):
+        archives = [archives]
+    paths = []
+    for archive in archives:
+        if os.path.isdir(archive):
+            paths.extend(find_archives(archive, recursive=recursive))
+        elif os.path.isfile(archive):
+            paths.append(archive)
+        else:
+            print(f"Error: Archive does not exist: {archive}")
+            return
+    
+    print(f"Found {len(paths)} archives to process")
+    if not paths:
+        return
+    if not skip_confirmations:
+        proceed = input(f"Proceed with processing {len(paths)} archives? (y/n): ").lower().strip()
+        if proceed not in ['y', 'yes']:
+            print("Operation cancelled.")
+            return
+    
+    logger, log_filename = _setup_run_logging(log, skip_confirmations, verbosity, log_format)
+    renamed_files = []
+    with _total_phase(run_stats):
+        for path in paths:
+            renamed = retitle_archive(path, logger, name_filter=name_filter, stats=run_stats)
+            renamed_files.extend((os.path.join(path, old_name), os.path.join(path, new_name))
+                                 for old_name, new_name in renamed)
+    
+    _print_summary(renamed_files, logger, log_filename, run_stats=run_stats)
+
+
+def _retitle_direct(path=None, log=None, yes=False, force=False, recursive=False,
+                    max_depth=None, follow_symlinks=False, workers=None,
+                    plan=None, apply=None, rename_workers=None, journal=None,
+                    resume=None, undo=None, verbosity='info', log_format='text',
+                    incremental=False, state_cache=None, update_links=False, link_root=None,
+                    link_index=None, watch=False, debounce=None, watch_backend='auto', stats=None,
+                    prometheus=None, serve=False, socket=None, batch_window=None, jobs=None,
+                    report=None, include=None, exclude=None, ext=None, exclude_ext=None,
+                    skip_normalized=True,
+                    bounded_memory=False, chunk_size=None, spill_threshold=None,
+                    max_ops_per_second=None, max_in_flight=None, target_latency=None,
+                    rename_backend='auto', parse_workers=None, paths_from=None, null=False,
+                    archive=None, coordinate=None, node_id=None, lease_ttl=None):
+    """
+    Direct retitle function without invoke dependency.
+    
+    Returns:
+        RunStats of the run when --stats or --prometheus was given, else None
+    """
+    # Handle force flag (--force is alias for --yes)
+    skip_confirmations = yes or force
+    
+    # Values from invoke arrive as strings
+    max_depth = int(max_depth) if max_depth is not None else None
+    workers = int(workers) if workers is not None else None
+    rename_workers = int(rename_workers) if rename_workers is not None else 1
+    parse_workers = int(parse_workers) if parse_workers is not None else None
+    debounce = float(debounce) if debounce is not None else DEFAULT_DEBOUNCE
+    batch_window = float(batch_window) if batch_window is not None else None
+    chunk_size = int(chunk_size) if chunk_size is not None else None
+    spill_threshold = int(spill_threshold) if spill_threshold is not None else None
+    lease_ttl = float(lease_ttl) if lease_ttl is not None else None
+    # Every node walks its share of the same tree
+    recursive = recursive or bool(coordinate)
+    
+    # Reject options a mode would otherwise silently ignore
+    throttled = max_ops_per_second is not None or max_in_flight is not None or target_latency is not None
+    if (stats or prometheus) and (watch or serve or resume or undo):
+        print("Error: --stats and --prometheus cannot be combined with --watch, --serve, --resume or --undo")
+        return
+    if (update_links or link_root or link_index) and (jobs or archive):
+        print("Error: --update-links cannot be combined with --jobs or --archive")
+        return
+    if jobs and (recursive or max_depth is not None or follow_symlinks or workers is not None
+                 or include or exclude or ext or exclude_ext or not skip_normalized):
+        # Each root of a manifest sets these itself
+        print("Error: --jobs takes --recursive, --max-depth, --follow-symlinks, --workers and "
+              "name filters from the manifest, not the command line")
+        return
+    if archive and (throttled or rename_backend not in (None, 'auto')):
+        # Archives are rewritten, their members are not renamed on disk
+        print("Error: --archive cannot be combined with --rename-backend or throttle options")
+        return
+    
+    try:
+        base_filesystem = _build_filesystem(rename_backend)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    throttle = _build_throttle(max_ops_per_second, max_in_flight, target_latency, rename_workers,
+                               inner=base_filesystem)
+    filesystem = throttle or base_filesystem
+    # Links are rewritten in the target directory unless another vault root is given
+    if update_links or link_root or link_index:
+        link_root = link_root or path or os.getcwd()
+    name_filter = _build_name_filter(include, exclude, ext, exclude_ext, skip_normalized)
+    
+    # Timers and counters are only collected when they will be written
+    run_stats = None
+    if stats or prometheus:
+        from .metrics import RunStats
+        run_stats = RunStats()
+    
+    if resume or undo:
+        _replay_journal(resume or undo, undo=bool(undo), log=log,
+                        skip_confirmations=skip_confirmations, rename_workers=rename_workers,
+                        verbosity=verbosity, log_format=log_format, filesystem=filesystem,
+                        link_root=link_root, link_index=link_index)
+        return
+    
+    # Opened only once the run is confirmed, see _open_journal
+    journal_file = journal
+    journal = None
+    
+    if jobs:
+        _run_job_manifest(jobs, report_file=report, log=log, skip_confirmations=skip_confirmations,
+                          journal_file=journal_file, verbosity=verbosity, log_format=log_format,
+                          run_stats=run_stats, filesystem=filesystem, parse_workers=parse_workers)
+        return _write_stats(run_stats, stats, prometheus)
+    
+    if serve:
+        # The server takes its paths from clients, not from the command line
+        cache = None
+        if incremental or state_cache:
+            from .state_cache import StateCache
+            cache = StateCache(state_cache)
+        _serve_requests(socket, log=log, skip_confirmations=skip_confirmations,
+                        batch_window=batch_window, rename_workers=rename_workers,
+                        journal_file=journal_file, cache=cache, verbosity=verbosity,
+                        log_format=log_format, name_filter=name_filter, filesystem=filesystem,
+                        link_root=link_root, link_index=link_index)
+        return
+    
+    if apply:
+        journal = _open_journal(journal_file)
+        try:
+            _apply_saved_plan(apply, log=log, skip_confirmations=skip_confirmations,
+                              rename_workers=rename_workers, journal=journal, filesystem=filesystem,
+                              verbosity=verbosity, log_format=log_format, run_stats=run_stats,
+                              link_root=link_root, link_index=link_index)
+        finally:
+            if journal is not None:
+                journal.close()
+        return _write_stats(run_stats, stats, prometheus)
+    
+    if paths_from:
+        _retitle_path_list(paths_from, null=null, log=log, skip_confirmations=skip_confirmations,
+                           rename_workers=rename_workers, journal_file=journal_file,
+                           verbosity=verbosity, log_format=log_format, run_stats=run_stats,
+                           name_filter=name_filter, filesystem=filesystem, link_root=link_root,
+                           link_index=link_index)
+        return _write_stats(run_stats, stats, prometheus)
+    
+    if archive:
+        _retitle_archives(archive, recursive=recursive, log=log, skip_confirmations=skip_confirmations,
+                          verbosity=verbosity, log_format=log_format, run_stats=run_stats,
+                          name_filter=name_filter)
+        return _write_stats(run_stats, stats, prometheus)
+    
+    # Determine target path
+    target_path = Path(path) if path else Path.cwd()
+    
+    if not target_path.exists():
+        print(f"Error: Directory does not exist: {target_path}")
+        return
+    
+    if not target_path.is_dir():
+        print(f"Error: Path is not a directory: {target_path}")
+        return
+    
+    if bounded_memory and (plan or incremental or state_cache or link_root):
+        # Plans, the state cache and the link rewriter's rename map hold
+        # whole directories or runs in memory
+        print("Error: --bounded-memory cannot be combined with --plan, --incremental or --update-links")
+        return
+    
+    if coordinate and (plan or bounded_memory or incremental or state_cache or watch
+                       or follow_symlinks or link_root):
+        # Nodes share directories, not plans, caches, link indexes or symlink loops
+        print("Error: --coordinate cannot be combined with --plan, --bounded-memory, --incremental, "
+              "--watch, --follow-symlinks or --update-links")
+        return
+    
+    if coordinate:
+        from .fs import default_filesystem
+        if not (filesystem or default_filesystem()).no_clobber:
+            # A node stalled past its lease could otherwise overwrite files
+            print("Error: --coordinate needs no-clobber renames (renameat2 on Linux), "
+                  "not --rename-backend rename")
+            return
+    
+    if watch:
+        _watch_for_notes(target_path, log=log, skip_confirmations=skip_confirmations,
+                         recursive=recursive, max_depth=max_depth, debounce=debounce,
+                         watch_backend=watch_backend, rename_workers=rename_workers,
+                         journal_file=journal_file, verbosity=verbosity, log_format=log_format,
+                         name_filter=name_filter, filesystem=filesystem, link_root=link_root,
+                         link_index=link_index)
+        return
+    
+    if recursive:
+        # Files are counted while the tree is walked, not up front
+        entries = None
+        count_label = "all"
+        scope_label = f"files under '{target_path}' (recursive)"
+        print(f"Target directory: {target_path.absolute()} (recursive)")
+    else:
+        # Start the single directory scan; only a bounded look-ahead is buffered
+        # for the count and processing continues from the same scan
+        file_count, exact, entries = count_ahead(scan_directory(target_path))
+        count_label = str(file_count) if exact else f"more than {file_count}"
+        scope_label = f"files in '{target_path}'"
+        
+        # Show path and file count, ask for confirmation
+        print(f"Target directory: {target_path.absolute()}")
+        print(f"Found {count_label} files to process")
+    
+    # Planning never touches the files, so it needs no confirmation
+    if not skip_confirmations and not plan:
+        proceed = input(f"Proceed with processing {count_label} {scope_label}? (y/n): ").lower().strip()
+        if proceed not in ['y', 'yes']:
+            print("Operation cancelled.")
+            return
+    
+    # Per-rename log lines must not pile up behind a slow console either
+    logger, log_filename = _setup_run_logging(log, skip_confirmations, verbosity, log_format,
+                                              max_queued=LOG_QUEUE_LIMIT if bounded_memory else None)
+    
+    logger.info("Starting Note Retitler Script")
+    logger.info("Target directory: %s", target_path.absolute())
+    if not recursive:
+        logger.info("Found %s files to process", count_label)
+    
+    if plan:
+        # Plan only: write the rename plan and leave the files alone
+        from .planner import save_plans
+        from .walker import plan_tree, relative_renames
+        with _total_phase(run_stats):
+            if recursive:
+                plans = plan_tree(target_path, logger, max_depth=max_depth,
+                                  follow_symlinks=follow_symlinks, workers=workers,
+                                  stats=run_stats, name_filter=name_filter,
+                                  parse_workers=parse_workers)
+            else:
+                directory_plan = plan_directory(target_path, logger, entries=entries,
+                                                stats=run_stats, name_filter=name_filter,
+                                                parse_workers=parse_workers)
+                plans = [directory_plan] if directory_plan is not None else []
+        save_plans(plans, plan)
+        planned_files = []
+        for directory_plan in plans:
+            planned_files.extend(relative_renames(str(target_path), directory_plan.directory,
+                                                  directory_plan.renames))
+        logger.info("Rename plan saved to: %s", plan)
+        flush_logging()
+        print(f"\nRename plan saved to: {plan}")
+        _print_summary(planned_files, logger, log_filename, verb="Planned", run_stats=run_stats)
+        return _write_stats(run_stats, stats, prometheus)
+    
+    journal = _open_journal(journal_file)
+    if journal is not None:
+        logger.info("Recording renames in journal: %s", journal_file)
+    
+    # Incremental runs remember each directory's state between runs
+    cache = None
+    if incremental or state_cache:
+        from .state_cache import StateCache
+        cache = StateCache(state_cache)
+        logger.info("Using state cache: %s", cache.cache_file)
+    
+    bounded_options = {}
+    if chunk_size:
+        bounded_options['chunk_size'] = chunk_size
+    if spill_threshold:
+        bounded_options['spill_threshold'] = spill_threshold
+    
+    try:
+        with _total_phase(run_stats), _report_throughput(throttle, logger, run_stats):
+            if coordinate:
+                # Claim directories of the shared tree until every node runs out of work
+                from .distributed import process_tree_distributed
+                distributed_options = {'lease_ttl': lease_ttl} if lease_ttl else {}
+                renamed_files = process_tree_distributed(target_path, logger, coordinate,
+                                                         node_id=node_id, max_depth=max_depth,
+                                                         workers=workers, filesystem=filesystem,
+                                                         rename_workers=rename_workers,
+                                                         journal=journal, stats=run_stats,
+                                                         name_filter=name_filter,
+                                                         parse_workers=parse_workers,
+                                                         **distributed_options)
+            elif bounded_memory and recursive:
+                # Stream every directory and keep the rename record on disk
+                from .bounded import process_tree_bounded
+                renamed_files = process_tree_bounded(target_path, logger, max_depth=max_depth,
+                                                     follow_symlinks=follow_symlinks, workers=workers,
+                                                     filesystem=filesystem, rename_workers=rename_workers,
+                                                     journal=journal,
+                                                     stats=run_stats, name_filter=name_filter,
+                                                     **bounded_options)
+            elif bounded_memory:
+                from .bounded import process_directory_bounded
+                renamed_files = process_directory_bounded(target_path, logger, entries=entries,
+                                                          filesystem=filesystem,
+                                                          rename_workers=rename_workers,
+                                                          journal=journal, stats=run_stats,
+                                                          name_filter=name_filter, **bounded_options)
+            elif recursive:
+                # Process the whole tree with a bounded pool of directory workers
+                from .walker import process_tree
+                renamed_files = process_tree(target_path, logger, max_depth=max_depth,
+                                             follow_symlinks=follow_symlinks, workers=workers,
+                                             filesystem=filesystem, rename_workers=rename_workers,
+                                             journal=journal, state_cache=cache, stats=run_stats,
+                                             name_filter=name_filter, parse_workers=parse_workers)
+            else:
+                # Process the directory
+                renamed_files = process_directory(target_path, logger, entries=entries,
+                                                  filesystem=filesystem, rename_workers=rename_workers,
+                                                  journal=journal, state_cache=cache, stats=run_stats,
+                                                  name_filter=name_filter, parse_workers=parse_workers)
+            _update_links(link_root, link_index, renamed_files, str(target_path), logger,
+                          workers=workers, run_stats=run_stats)
+    finally:
+        if journal is not None:
+            journal.close()
+        if cache is not None:
+            cache.save()
+    
+    _print_summary(renamed_files, logger, log_filename, run_stats=run_stats)
+    if bounded_memory:
+        # Removes the spill file
+        renamed_files.close()
+    return _write_stats(run_stats, stats, prometheus)
+
+
+if __name__ == "__main__":
+    retitle_cli()
@@ -0,0 +1,158 @@
+"""
+Retitle Client
+
+Thin client for a running retitle server (see server.py). It only needs the
+socket and json modules, so an editor hook calling `retitle-client` on every
+save pays for a connection instead of a full interpreter warm-up of the
+retitler.
+
+Protocol: one JSON object per line in each direction over a Unix domain
+socket. A request is {"paths": [...], "recursive": false} (or {"op": "ping"}
+/ {"op": "shutdown"}); the reply is {"ok": true, "renamed": [[old, new], ...],
+"errors": [...]} with absolute paths, or {"ok": false, "error": "..."}.
+"""
+
+import os
+import json
+import socket
+from typing import Iterable, Optional
+
+
+# Seconds the client waits for the server's reply
+DEFAULT_TIMEOUT = 30.0
+
+
+def default_socket_path() -> str:
+    """
+    Location of the server socket when none is given.
+
+    Returns:
+        Path under $XDG_RUNTIME_DIR, or under ~/.cache when it is not set
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'note_retitler.sock')
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'note_retitler', 'server.sock')
+
+
+def send_request(request: dict, socket_path: Optional[str] = None,
+                 timeout: Optional[float] = DEFAULT_TIMEOUT) -> dict:
+    """
+    Send one request to the server and wait for its reply.
+
+    Args:
+        request: Request object
+        socket_path: Server socket (default: default_socket_path())
+        timeout: Seconds to wait for the reply (None waits forever)
+
+    Returns:
+        Reply object
+
+    Raises:
+        OSError: If the server cannot be reached (ConnectionRefusedError or
+            FileNotFoundError when it is not running) or does not reply in time
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path or default_socket_path())
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as reply:
+            line = reply.readline()
+    if not line:
+        raise ConnectionResetError("Server closed the connection without replying")
+    return json.loads(line)
+
+
+def request_retitle(paths: Iterable[str], socket_path: Optional[str] = None,
+                    recursive: bool = False, timeout: Optional[float] = DEFAULT_TIMEOUT) -> dict:
+    """
+    Ask the server to retitle files or directories.
+
+    Args:
+        paths: Note files and/or directories; relative paths are resolved
+            against the client's working directory
+        socket_path: Server socket (default: default_socket_path())
+        recursive: Also process subdirectories of the given directories
+        timeout: Seconds to wait for the reply
+
+    Returns:
+        Reply object with 'renamed' (absolute old/new path pairs) and 'errors'
+    """
+    request = {'paths': [os.path.abspath(path) for path in paths], 'recursive': recursive}
+    return send_request(request, socket_path, timeout)
+
+
+def client_cli():
+    """
+    CLI entry point of the `retitle-client` command.
+    """
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Retitle notes through a running `retitle --serve` process"
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=["."],
+        help="Note files or directories (default: current directory)"
+    )
+    parser.add_argument(
+        "-r", "--recursive",
+        action="store_true",
+        help="Process all subdirectories of the given directories as well"
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        default=None,
+        help=f"Server socket (default: {default_socket_path()})"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help=f"Seconds to wait for the server (default: {DEFAULT_TIMEOUT:g})"
+    )
+    parser.add_argument(
+        "--fallback",
+        action="store_true",
+        help="Retitle in this process when no server is running"
+    )
+    parser.add_argument(
+        "-q", "--quiet",
+        action="store_true",
+        help="Only report errors"
+    )
+    args = parser.parse_args()
+
+    try:
+        reply = request_retitle(args.paths, args.socket, recursive=args.recursive,
+                                timeout=args.timeout)
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        if not args.fallback:
+            print(f"Error: No retitle server at {args.socket or default_socket_path()}: {e}",
+                  file=sys.stderr)
+            sys.exit(2)
+        from .server import retitle_paths
+        reply = retitle_paths([os.path.abspath(path) for path in args.paths],
+                              recursive=args.recursive)
+    except OSError as e:
+        print(f"Error: Retitle server did not reply: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    if not reply.get('ok'):
+        print(f"Error: {reply.get('error')}", file=sys.stderr)
+        sys.exit(1)
+    if not args.quiet:
+        for old_path, new_path in reply['renamed']:
+            print(f"{old_path} -> {new_path}")
+    for error in reply['errors']:
+        print(f"Error: {error}", file=sys.stderr)
+    sys.exit(1 if reply['errors'] else 0)
+
+
+if __name__ == "__main__":
+    client_cli()
@@ -0,0 +1,550 @@
+"""
+Distributed Runs
+
+Lets several nodes that mount the same note store share one recursive run.
+The nodes coordinate through files in a shared coordination directory, so
+nothing but the mount is needed:
+
+    items/<key>    a directory waiting to be processed (created with O_EXCL,
+                   holds its path relative to the root and its depth)
+    leases/<key>   the node processing that directory; its mtime is the
+                   last renewal
+    done/<key>     written once the directory is processed
+    nodes/<node>   per-node heartbeat, also used to read the server's clock
+
+A node claims a directory by creating its lease with O_CREAT | O_EXCL,
+which succeeds for exactly one node even over NFS. Subdirectories found
+while scanning are published as new items before the directory is marked
+done, so the run is finished once every item has a done marker. A renewal
+thread touches every held lease each third of the lease TTL; a lease not
+renewed for a whole TTL (as measured by the shared filesystem's clock) is
+taken over by another node through an atomic rename, so a dead node's
+directories are picked up again.
+
+Renames are fenced: right before a planned directory is renamed the node
+checks that it renewed the lease within the TTL by its own monotonic
+clock. A node that stalled longer than that drops the directory instead,
+and because renames never replace existing files (see
+fs.NoReplaceFilesystem, required for distributed runs) even a node that
+stalls after the check can only fail renames, not overwrite anything. SQLite was not used for the
+coordinator because its locking is unreliable on network filesystems.
+
+Start every run with a new (or emptied) coordination directory; a node
+joining a finished run finds nothing to do.
+"""
+
+import os
+import json
+import time
+import errno
+import socket
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional, Set, Tuple
+
+from .walker import _walk_tree_node, default_worker_count, relative_renames
+
+if TYPE_CHECKING:
+    from .metrics import RunStats
+
+
+# Seconds a lease stays valid without renewal
+DEFAULT_LEASE_TTL = 30.0
+
+# Longest pause between looks for new work while other nodes are busy
+MAX_POLL_INTERVAL = 0.5
+
+
+class LeaseLost(Exception):
+    """
+    Raised when a node no longer holds the lease of the directory it is processing.
+    """
+
+
+def default_node_id() -> str:
+    """
+    Identifier of this node when none is given.
+
+    Returns:
+        "<hostname>-<pid>"
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def item_key(relative_path: str) -> str:
+    """
+    File name used for a directory in the coordination directory.
+
+    Args:
+        relative_path: Directory path relative to the root ('.' for the root)
+
+    Returns:
+        32 hex digits
+    """
+    return hashlib.blake2b(relative_path.encode('utf-8', 'surrogateescape'), digest_size=16).hexdigest()
+
+
+def _create_exclusive(path: str, content: str) -> bool:
+    """
+    Create a file only if it does not exist yet.
+
+    Returns:
+        True if this call created it
+    """
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        return False
+    try:
+        os.write(fd, content.encode('utf-8', 'surrogateescape'))
+    finally:
+        os.close(fd)
+    return True
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+class LeaseCoordinator:
+    """
+    File-based work queue of directories with renewable leases.
+    """
+
+    def __init__(self, coordination_dir: str, node_id: Optional[str] = None,
+                 lease_ttl: float = DEFAULT_LEASE_TTL, logger: Optional[logging.Logger] = None):
+        """
+        Args:
+            coordination_dir: Directory on the shared mount used by all nodes
+            node_id: Unique name of this node (default: default_node_id())
+            lease_ttl: Seconds a lease stays valid without renewal
+            logger: Logger instance for output
+        """
+        self.coordination_dir = coordination_dir
+        self.node_id = node_id or default_node_id()
+        self.lease_ttl = lease_ttl
+        self.logger = logger or logging.getLogger(__name__)
+        for name in ('items', 'leases', 'done', 'nodes'):
+            os.makedirs(os.path.join(coordination_dir, name), exist_ok=True)
+        self._heartbeat = os.path.join(coordination_dir, 'nodes', self.node_id)
+        # key -> monotonic time of the last successful renewal
+        self._held: Dict[str, float] = {}
+        self._lost: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._renewer: Optional[threading.Thread] = None
+        self.claimed = 0
+        self.reclaimed = 0
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.coordination_dir, kind, key)
+
+    def server_time_ns(self) -> int:
+        """
+        Current time by the clock of the shared filesystem.
+
+        Touches this node's heartbeat file and reads back its mtime, so lease
+        ages are compared against one clock whatever the node clocks say.
+
+        Returns:
+            Nanoseconds since the epoch
+        """
+        try:
+            os.utime(self._heartbeat)
+        except FileNotFoundError:
+            _create_exclusive(self._heartbeat, self.node_id)
+        return os.stat(self._heartbeat).st_mtime_ns
+
+    def publish(self, relative_path: str, depth: int) -> bool:
+        """
+        Add a directory to the work queue unless it is already there.
+
+        Args:
+            relative_path: Directory path relative to the root
+            depth: Depth below the root
+
+        Returns:
+            True if this call added it
+        """
+        key = item_key(relative_path)
+        content = json.dumps({'path': relative_path, 'depth': depth})
+        path = self._path('items', key)
+        if _create_exclusive(path, content):
+            return True
+        if _read(path):
+            return False
+        # Left empty by a node that died while publishing. Only the holder of
+        # the parent directory's lease publishes its subdirectories, so the
+        # entry can be replaced whatever its age
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return _create_exclusive(path, content)
+
+    def item(self, key: str) -> Optional[Tuple[str, int]]:
+        """
+        Look up a queued directory.
+
+        Returns:
+            Tuple of (relative path, depth), or None if unreadable
+        """
+        content = _read(self._path('items', key))
+        if not content:
+            # Still being written by the publishing node
+            return None
+        try:
+            data = json.loads(content)
+        except ValueError:
+            return None
+        return data['path'], data['depth']
+
+    def discard_abandoned(self, key: str) -> bool:
+        """
+        Remove a queued directory whose entry stayed empty for a whole TTL.
+
+        The directory it was found in is not done yet, so it is processed
+        again and publishes the entry anew.
+
+        Args:
+            key: item_key of the directory
+
+        Returns:
+            True if the entry was abandoned (or is gone)
+        """
+        path = self._path('items', key)
+        try:
+            if _read(path):
+                return False
+            if self.server_time_ns() - os.stat(path).st_mtime_ns < self.lease_ttl * 1e9:
+                return False
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def is_done(self, key: str) -> bool:
+        return os.path.exists(self._path('done', key))
+
+    def _take_over(self, key: str) -> bool:
+        """
+        Remove a lease that has not been renewed for a whole TTL.
+
+        Returns:
+            True if this call removed it
+        """
+        lease = self._path('leases', key)
+        try:
+            age_ns = self.server_time_ns() - os.stat(lease).st_mtime_ns
+        except FileNotFoundError:
+            return True
+        if age_ns < self.lease_ttl * 1e9:
+            return False
+        # Renaming is atomic: of several nodes taking over, one wins
+        parked = f"{lease}.{self.node_id}.stale"
+        try:
+            os.rename(lease, parked)
+        except FileNotFoundError:
+            return False
+        holder = (_read(parked) or 'unknown').strip()
+        try:
+            if self.server_time_ns() - os.stat(parked).st_mtime_ns < self.lease_ttl * 1e9:
+                # Renewed just before the rename: give it back
+                try:
+                    os.link(parked, lease)
+                except FileExistsError:
+                    pass
+                return False
+        finally:
+            os.unlink(parked)
+        self.logger.warning("Taking over expired lease of %s (held by %s)", key, holder)
+        return True
+
+    def claim(self, key: str, take_over: bool = False) -> bool:
+        """
+        Try to take the lease of a queued directory.
+
+        Args:
+            key: item_key of the directory
+            take_over: Also take over an expired lease
+
+        Returns:
+            True if this node now holds the lease and the directory is not done
+        """
+        lease = self._path('leases', key)
+        if not _create_exclusive(lease, self.node_id):
+            if not take_over or not self._take_over(key):
+                return False
+            if not _create_exclusive(lease, self.node_id):
+                return False
+            self.reclaimed += 1
+        if self.is_done(key):
+            # Finished by another node between our look and the claim
+            os.unlink(lease)
+            return False
+        with self._lock:
+            self._held[key] = time.monotonic()
+            self._lost.discard(key)
+        self.claimed += 1
+        return True
+
+    def holds(self, key: str) -> bool:
+        """
+        Check that a lease is still ours and was renewed within the TTL.
+
+        Args:
+            key: item_key of the directory
+
+        Returns:
+            False once the lease was lost or may have expired
+        """
+        with self._lock:
+            renewed = self._held.get(key)
+            if renewed is None or key in self._lost:
+                return False
+            return time.monotonic() - renewed < self.lease_ttl
+
+    def finish(self, key: str, renamed: int) -> None:
+        """
+        Mark a directory done and release its lease.
+
+        Args:
+            key: item_key of the directory
+            renamed: Number of files renamed, recorded in the done marker
+        """
+        _create_exclusive(self._path('done', key), json.dumps({'node': self.node_id, 'renamed': renamed}))
+        self.release(key)
+
+    def release(self, key: str) -> None:
+        """
+        Give up a lease without marking the directory done.
+
+        Args:
+            key: item_key of the directory
+        """
+        with self._lock:
+            self._held.pop(key, None)
+            lost = key in self._lost
+            self._lost.discard(key)
+        lease = self._path('leases', key)
+        if not lost and (_read(lease) or '').strip() == self.node_id:
+            try:
+                os.unlink(lease)
+            except FileNotFoundError:
+                pass
+
+    def renew(self) -> None:
+        """
+        Renew every held lease and the heartbeat once.
+        """
+        with self._lock:
+            keys = list(self._held)
+        for key in keys:
+            lease = self._path('leases', key)
+            started = time.monotonic()
+            try:
+                if (_read(lease) or '').strip() != self.node_id:
+                    raise FileNotFoundError(errno.ENOENT, "lease taken over", lease)
+                os.utime(lease)
+            except FileNotFoundError:
+                self.logger.warning("Lost lease of %s", key)
+                with self._lock:
+                    self._lost.add(key)
+                continue
+            with self._lock:
+                if key in self._held:
+                    self._held[key] = started
+        self.server_time_ns()
+
+    def _renew_loop(self) -> None:
+        while not self._stop.wait(self.lease_ttl / 3):
+            try:
+                self.renew()
+            except OSError as e:
+                self.logger.error("Failed to renew leases: %s", e)
+
+    def start(self) -> None:
+        """
+        Register the node and start renewing leases in the background.
+        """
+        self.server_time_ns()
+        self._renewer = threading.Thread(target=self._renew_loop, name='lease-renewer', daemon=True)
+        self._renewer.start()
+
+    def stop(self) -> None:
+        """
+        Stop renewing and release every lease still held.
+        """
+        self._stop.set()
+        if self._renewer is not None:
+            self._renewer.join()
+        with self._lock:
+            keys = list(self._held)
+        for key in keys:
+            self.release(key)
+
+    def pending(self) -> Tuple[List[str], List[str]]:
+        """
+        List the queued directories that are not done.
+
+        Returns:
+            Tuple of (keys without a lease, keys with a lease)
+        """
+        items = set(os.listdir(os.path.join(self.coordination_dir, 'items')))
+        items.difference_update(os.listdir(os.path.join(self.coordination_dir, 'done')))
+        leased = {name for name in os.listdir(os.path.join(self.coordination_dir, 'leases'))
+                  if name in items}
+        return sorted(items - leased), sorted(leased)
+
+
+def _fenced_process(directory_path: Path, logger: logging.Logger, entries=None,
+                    coordinator: Optional[LeaseCoordinator] = None, key: str = '',
+                    filesystem=None, rename_workers: int = 1, journal=None, stats=None,
+                    **plan_options) -> List[Tuple[str, str]]:
+    """
+    process_directory with a lease check between planning and renaming.
+    """
+    from .note_retitler import plan_directory
+    from .planner import execute_plan
+
+    plan = plan_directory(directory_path, logger, entries=entries, stats=stats, **plan_options)
+    if plan is None:
+        return []
+    if not coordinator.holds(key):
+        raise LeaseLost(str(directory_path))
+    return execute_plan(plan, logger, filesystem=filesystem, rename_workers=rename_workers,
+                        journal=journal, stats=stats)
+
+
+def process_tree_distributed(root_path: Path, logger: logging.Logger, coordination_dir: str,
+                             node_id: Optional[str] = None, lease_ttl: float = DEFAULT_LEASE_TTL,
+                             max_depth: Optional[int] = None, workers: Optional[int] = None,
+                             stats: 'Optional[RunStats]' = None,
+                             **process_options) -> List[Tuple[str, str]]:
+    """
+    Process a directory tree together with other nodes running the same call.
+
+    Args:
+        root_path: Root of the directory tree, the same directory on every node
+        logger: Logger instance for output
+        coordination_dir: Directory on the shared mount holding the work queue
+        node_id: Unique name of this node (default: default_node_id())
+        lease_ttl: Seconds after which a lease that was not renewed is taken over
+        max_depth: Maximum depth to descend below the root (None for unlimited)
+        workers: Directories this node processes at the same time
+        stats: Optional RunStats collecting timers and counters
+        **process_options: Extra keyword arguments for planning and renaming
+            (filesystem, rename_workers, journal, name_filter, parse_workers)
+
+    Returns:
+        List of (old_path, new_path) relative to the root for the files this
+        node renamed, sorted by path
+
+    Raises:
+        ValueError: If the filesystem can replace existing files on rename
+    """
+    if not root_path.is_dir():
+        logger.error("Path is not a directory: %s", root_path)
+        return []
+
+    from .fs import default_filesystem
+    filesystem = process_options.get('filesystem') or default_filesystem()
+    if not filesystem.no_clobber:
+        # Only no-clobber renames keep a node stalled past its lease harmless
+        raise ValueError("Distributed runs need a filesystem with no-clobber renames")
+
+    root = str(root_path)
+    workers = workers or default_worker_count()
+    coordinator = LeaseCoordinator(coordination_dir, node_id, lease_ttl, logger)
+    coordinator.publish(os.curdir, 0)
+    coordinator.start()
+    logger.info("Node %s joined distributed run in %s", coordinator.node_id, coordination_dir)
+
+    renamed_files = []
+    lock = threading.Lock()
+    # Free keys seen in the last listing or published here, tried before
+    # listing the coordination directory again
+    backlog: Deque[str] = deque()
+    directories = 0
+
+    def next_item() -> Optional[Tuple[str, str, int]]:
+        poll = 0.01
+        refilled = False
+        while True:
+            while True:
+                with lock:
+                    if not backlog:
+                        break
+                    key = backlog.popleft()
+                item = coordinator.item(key)
+                if item is None:
+                    coordinator.discard_abandoned(key)
+                elif coordinator.claim(key):
+                    return (key,) + item
+            free, leased = coordinator.pending()
+            if not free and not leased:
+                return None
+            if free and not refilled:
+                with lock:
+                    backlog.extend(free)
+                refilled = True
+                continue
+            refilled = False
+            for key in leased:
+                item = coordinator.item(key)
+                if item is not None and coordinator.claim(key, take_over=True):
+                    return (key,) + item
+            # Everything left is leased by live nodes that may still publish
+            # more, or queued by a node that has not finished writing it yet
+            time.sleep(poll)
+            poll = min(poll * 2, MAX_POLL_INTERVAL, lease_ttl / 4)
+
+    def run_worker() -> None:
+        nonlocal directories
+        while True:
+            item = next_item()
+            if item is None:
+                return
+            key, relative_path, depth = item
+            directory = os.path.normpath(os.path.join(root, relative_path))
+            try:
+                _, _, renamed, subdirs = _walk_tree_node(
+                    directory, depth, _fenced_process, logger, False,
+                    dict(process_options, coordinator=coordinator, key=key, stats=stats))
+            except LeaseLost:
+                logger.warning("Lease of %s expired before renaming, leaving it to another node", directory)
+                coordinator.release(key)
+                continue
+            # Subdirectories are queued before the directory counts as done,
+            # so the run cannot look finished while they are unknown
+            if max_depth is None or depth < max_depth:
+                published = [relative for relative in (os.path.relpath(subdir, root) for subdir in subdirs)
+                             if coordinator.publish(relative, depth + 1)]
+                with lock:
+                    backlog.extend(item_key(relative) for relative in published)
+            coordinator.finish(key, len(renamed or ()))
+            with lock:
+                directories += 1
+                renamed_files.extend(relative_renames(root, directory, renamed or []))
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(run_worker) for _ in range(workers)]:
+                future.result()
+    finally:
+        coordinator.stop()
+
+    logger.info("Node %s processed %d directories (%d taken over from other nodes)",
+                coordinator.node_id, directories, coordinator.reclaimed)
+    if stats is not None:
+        stats.add(shards_claimed=directories, shards_reclaimed=coordinator.reclaimed)
+    renamed_files.sort()
+    return renamed_files
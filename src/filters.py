@@ -0,0 +1,145 @@
+"""
+Name Filters
+
+Include/exclude rules deciding which directory entries are parsed at all.
+Glob patterns, extension lists and the skip rules are compiled into one
+regular expression, so rejecting an entry costs a single match on its name,
+before any stat call or date parsing.
+
+Rejected names still count for collision checks; they are only never
+renamed themselves. Recursive walks also skip subdirectories whose names
+match an exclude glob, and never enter version-control directories.
+"""
+
+import re
+import fnmatch
+import hashlib
+from typing import Iterable, Optional, Sequence
+
+
+# Names that already hold a YYYY-MM-DD date. Jumps from dash to dash and
+# looks back for the year, which is several times faster than trying every
+# position with .*?
+NORMALIZED_DATE = r'(?:[^-]*-)*?(?<=(?<!\d)\d{4}-)(?:0[1-9]|1[0-2])-(?:0[1-9]|[12]\d|3[01])(?!\d)'
+
+# Files written by the retitler itself: its log files and the temporary
+# names used while a rename cycle is in progress (regex sources; written out
+# by hand because fnmatch.translate output is noticeably slower to match)
+OWN_FILES = (r'note_retitler_.*\.(?:log|jsonl)\Z', r'\..*\.retitle-\d+\.tmp\Z')
+
+# Directories recursive walks never descend into
+VCS_DIRECTORIES = ('.git', '.hg', '.svn')
+
+
+def _extension_pattern(extensions: Iterable[str]) -> Optional[str]:
+    """
+    Regex source matching names ending in one of the extensions (any case).
+    """
+    cleaned = sorted({extension.lower().lstrip('.') for extension in extensions if extension.strip('.')})
+    if not cleaned:
+        return None
+    return r'(?i:.*\.(?:%s))\Z' % '|'.join(re.escape(extension) for extension in cleaned)
+
+
+def _alternation(patterns: Sequence[str]) -> str:
+    return '|'.join(f'(?:{pattern})' for pattern in patterns)
+
+
+class NameFilter:
+    """
+    Compiled include/exclude rules for filenames.
+
+    A name is accepted when it matches an include rule (or none are given)
+    and no exclude rule. Globs follow fnmatch syntax and are case-sensitive;
+    extensions are matched case-insensitively and may be given with or
+    without the leading dot.
+    """
+
+    def __init__(self, include: Iterable[str] = (), exclude: Iterable[str] = (),
+                 extensions: Iterable[str] = (), exclude_extensions: Iterable[str] = (),
+                 skip_normalized: bool = True):
+        """
+        Args:
+            include: Globs a name must match (any of them)
+            exclude: Globs of names to leave alone
+            extensions: Extensions a name must have (any of them); combined
+                with include globs, a name matching either is included
+            exclude_extensions: Extensions of names to leave alone
+            skip_normalized: Leave names that already contain a YYYY-MM-DD date
+        """
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.extensions = tuple(extensions)
+        self.exclude_extensions = tuple(exclude_extensions)
+        self.skip_normalized = skip_normalized
+
+        excluded = list(OWN_FILES) + [fnmatch.translate(glob) for glob in self.exclude]
+        extension_pattern = _extension_pattern(self.exclude_extensions)
+        if extension_pattern:
+            excluded.append(extension_pattern)
+        if skip_normalized:
+            excluded.append(NORMALIZED_DATE)
+
+        included = [fnmatch.translate(glob) for glob in self.include]
+        extension_pattern = _extension_pattern(self.extensions)
+        if extension_pattern:
+            included.append(extension_pattern)
+
+        source = f'(?!{_alternation(excluded)})'
+        if included:
+            source += f'(?:{_alternation(included)})'
+        self.pattern = re.compile(source, re.DOTALL)
+        # Identifies these rules in the state cache of incremental runs
+        self.digest = hashlib.blake2b(source.encode('utf-8', 'surrogateescape'), digest_size=8).hexdigest()
+        # Bound once; called for every directory entry
+        self.match = self.pattern.match
+
+        # Only exclude globs prune directories: include rules and extensions describe files
+        pruned = [re.escape(name) + r'\Z' for name in VCS_DIRECTORIES]
+        pruned += [fnmatch.translate(glob) for glob in self.exclude]
+        self._prune = re.compile(_alternation(pruned), re.DOTALL).match
+
+    def accepts(self, name: str) -> bool:
+        """
+        Check whether a filename should be parsed.
+
+        Args:
+            name: Filename without directory components
+
+        Returns:
+            True if the name passes every rule
+        """
+        return self.match(name) is not None
+
+    def prunes(self, directory_name: str) -> bool:
+        """
+        Check whether a recursive walk should skip a subdirectory.
+
+        Args:
+            directory_name: Name of the subdirectory
+
+        Returns:
+            True for version-control directories and names matching an exclude glob
+        """
+        return self._prune(directory_name) is not None
+
+    def __repr__(self) -> str:
+        return (f"NameFilter(include={self.include!r}, exclude={self.exclude!r}, "
+                f"extensions={self.extensions!r}, exclude_extensions={self.exclude_extensions!r}, "
+                f"skip_normalized={self.skip_normalized!r})")
+
+
+_DEFAULT_FILTER = None
+
+
+def default_name_filter() -> NameFilter:
+    """
+    Filter used when none is given: skips normalized names and the retitler's own files.
+
+    Returns:
+        Shared NameFilter instance
+    """
+    global _DEFAULT_FILTER
+    if _DEFAULT_FILTER is None:
+        _DEFAULT_FILTER = NameFilter()
+    return _DEFAULT_FILTER
@@ -0,0 +1,619 @@
+"""
+Filesystem Layer
+
+The small set of filesystem operations used when renames are applied. Plans
+are executed against one of these objects instead of calling os directly, so
+slow or remote storage can be simulated locally and other rename backends can
+be swapped in.
+"""
+
+import os
+import sys
+import time
+import errno
+import logging
+import threading
+from typing import Callable, Optional, Tuple
+
+
+class LocalFilesystem:
+    """
+    Filesystem operations on the local machine.
+
+    os.rename replaces an existing destination, so callers check for it
+    first; ``no_clobber`` is False to tell them so.
+    """
+
+    no_clobber = False
+
+    def rename(self, source: str, destination: str) -> None:
+        """
+        Rename a file.
+
+        Args:
+            source: Current path
+            destination: New path
+        """
+        os.rename(source, destination)
+
+    def lstat(self, path: str) -> os.stat_result:
+        """
+        Stat a path without following symlinks.
+
+        Args:
+            path: Path to stat
+
+        Returns:
+            Stat result
+        """
+        return os.lstat(path)
+
+    def lexists(self, path: str) -> bool:
+        """
+        Check whether a path exists (broken symlinks count as existing).
+
+        Args:
+            path: Path to check
+
+        Returns:
+            True if something exists at the path
+        """
+        return os.path.lexists(path)
+
+
+# renameat2 flag: fail with EEXIST instead of replacing the destination
+RENAME_NOREPLACE = 1
+
+# renameat2 syscall numbers, for C libraries without a renameat2 wrapper
+_SYS_RENAMEAT2 = {'x86_64': 316, 'aarch64': 276, 'armv7l': 382, 'i686': 353, 'ppc64le': 357,
+                  's390x': 347, 'riscv64': 276}
+
+# Directory file descriptors kept open by a NoReplaceFilesystem
+DEFAULT_OPEN_DIRECTORIES = 32
+
+_renameat2 = None
+
+
+def _load_renameat2() -> Optional[Callable]:
+    """
+    Find renameat2 in the C library (Linux only).
+
+    Returns:
+        Callable taking (olddirfd, oldpath, newdirfd, newpath, flags) and
+        returning the C result, or None where the call is not available
+    """
+    global _renameat2
+    if _renameat2 is not None:
+        return _renameat2 or None
+    _renameat2 = False
+    if not sys.platform.startswith('linux'):
+        return None
+    # Loaded here so runs that rename nothing never import ctypes
+    import ctypes
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+    arguments = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    if hasattr(libc, 'renameat2'):
+        function = libc.renameat2
+        function.argtypes = arguments
+        function.restype = ctypes.c_int
+        _renameat2 = function
+    elif os.uname().machine in _SYS_RENAMEAT2:
+        # glibc before 2.28 has the syscall but no wrapper
+        number = _SYS_RENAMEAT2[os.uname().machine]
+        syscall = libc.syscall
+        syscall.restype = ctypes.c_long
+        _renameat2 = lambda *args: syscall(ctypes.c_long(number), *(
+            kind(value) for kind, value in zip(arguments, args)))
+    if _renameat2:
+        _renameat2.get_errno = ctypes.get_errno
+    return _renameat2 or None
+
+
+def renameat2_available() -> bool:
+    """
+    Check whether renameat2 can be called on this system.
+
+    Returns:
+        True on Linux with a C library or kernel exposing renameat2
+    """
+    return _load_renameat2() is not None
+
+
+class NoReplaceFilesystem(LocalFilesystem):
+    """
+    Renames with renameat2(RENAME_NOREPLACE) relative to open directory descriptors.
+
+    Each rename is a single syscall that fails with FileExistsError instead
+    of replacing a file created by someone else since planning, so no
+    separate existence check is needed (``no_clobber`` is True). The
+    descriptors of recently used directories stay open and are reused
+    without a path lookup. Only when a rename fails with ENOENT or ESTALE is
+    a descriptor compared (st_dev, st_ino) with the directory now at its
+    path; a directory moved or replaced since, as long-lived --serve and
+    --watch processes see, is then opened again and the rename retried.
+
+    Where renameat2 is missing (ENOSYS, non-Linux) or a filesystem rejects
+    the flag (EINVAL, as some network and FUSE filesystems do), renames fall
+    back to an lstat check followed by os.rename, still relative to the
+    open directory; ``fallbacks`` counts them.
+    """
+
+    no_clobber = True
+
+    def __init__(self, max_open_directories: int = DEFAULT_OPEN_DIRECTORIES):
+        """
+        Args:
+            max_open_directories: Directory descriptors kept open when idle
+        """
+        self.max_open_directories = max_open_directories
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        # directory -> [fd, users, renameat2 supported]; oldest first
+        self._directories = {}
+        self._unsupported = False
+
+    def _open_directory(self, directory: str) -> list:
+        with self._lock:
+            entry = self._directories.pop(directory, None)
+            if entry is None:
+                fd = os.open(directory or os.curdir, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+                entry = [fd, 0, not self._unsupported]
+                # Close idle descriptors beyond the limit, least recently used first
+                idle = [name for name, (_, users, _) in self._directories.items() if not users]
+                for name in idle[:max(0, len(self._directories) + 1 - self.max_open_directories)]:
+                    os.close(self._directories.pop(name)[0])
+            entry[1] += 1
+            self._directories[directory] = entry
+            return entry
+
+    def _close_directory(self, directory: str, entry: list) -> None:
+        with self._lock:
+            entry[1] -= 1
+            # Replaced while in use: nothing else will close it
+            if not entry[1] and self._directories.get(directory) is not entry:
+                os.close(entry[0])
+
+    def _reopen_if_replaced(self, directory: str, entry: list) -> list:
+        """
+        Swap a descriptor for a fresh one if its directory is no longer at its path.
+
+        Returns:
+            The entry to retry with (the same one if nothing changed)
+        """
+        # Stat outside the lock: on network filesystems it is a round trip
+        try:
+            current = os.stat(directory or os.curdir)
+        except OSError:
+            return entry
+        try:
+            opened = os.fstat(entry[0])
+            if (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+                return entry
+        except OSError:
+            pass  # ESTALE: the directory behind the descriptor is gone
+        with self._lock:
+            if self._directories.get(directory) is entry:
+                del self._directories[directory]
+        fresh = self._open_directory(directory)
+        self._close_directory(directory, entry)
+        return fresh
+
+    def _rename_at(self, source_entry: list, source_name: str, destination_entry: list,
+                   destination_name: str, source: str, destination: str) -> None:
+        renameat2 = _load_renameat2() if source_entry[2] and destination_entry[2] else None
+        if renameat2 is not None:
+            result = renameat2(source_entry[0], os.fsencode(source_name), destination_entry[0],
+                               os.fsencode(destination_name), RENAME_NOREPLACE)
+            if result == 0:
+                return
+            err = renameat2.get_errno()
+            if err == errno.ENOSYS:
+                self._unsupported = True
+            elif err != errno.EINVAL:
+                raise OSError(err, os.strerror(err), source, None, destination)
+            source_entry[2] = destination_entry[2] = False
+        self.fallbacks += 1
+        try:
+            os.lstat(destination_name, dir_fd=destination_entry[0])
+        except FileNotFoundError:
+            os.rename(source_name, destination_name, src_dir_fd=source_entry[0],
+                      dst_dir_fd=destination_entry[0])
+            return
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), source, None, destination)
+
+    def rename(self, source: str, destination: str) -> None:
+        """
+        Rename a file without ever replacing the destination.
+
+        Args:
+            source: Current path
+            destination: New path
+
+        Raises:
+            FileExistsError: If the destination exists
+        """
+        source_directory, source_name = os.path.split(source)
+        destination_directory, destination_name = os.path.split(destination)
+        source_entry = self._open_directory(source_directory)
+        destination_entry = (source_entry if destination_directory == source_directory
+                             else self._open_directory(destination_directory))
+        try:
+            try:
+                self._rename_at(source_entry, source_name, destination_entry, destination_name,
+                                source, destination)
+            except OSError as e:
+                if e.errno not in (errno.ENOENT, errno.ESTALE):
+                    raise
+                # Cached descriptors skip the path lookup, so a directory
+                # replaced since it was opened only shows up as a failure
+                fresh = self._reopen_if_replaced(source_directory, source_entry)
+                replaced = fresh is not source_entry
+                if destination_entry is source_entry:
+                    destination_entry = fresh
+                source_entry = fresh
+                if destination_entry is not source_entry:
+                    fresh = self._reopen_if_replaced(destination_directory, destination_entry)
+                    replaced = replaced or fresh is not destination_entry
+                    destination_entry = fresh
+                if not replaced:
+                    raise
+                self._rename_at(source_entry, source_name, destination_entry, destination_name,
+                                source, destination)
+        finally:
+            self._close_directory(source_directory, source_entry)
+            if destination_entry is not source_entry:
+                self._close_directory(destination_directory, destination_entry)
+
+    def close(self) -> None:
+        """
+        Close every directory descriptor that is not in use.
+        """
+        with self._lock:
+            for directory in [name for name, (_, users, _) in self._directories.items() if not users]:
+                os.close(self._directories.pop(directory)[0])
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+_DEFAULT_FILESYSTEM = None
+
+
+def default_filesystem() -> LocalFilesystem:
+    """
+    Filesystem used when none is given: no-clobber renames on Linux.
+
+    renameat2 is only looked up on the first rename, so runs that rename
+    nothing do not pay for loading it.
+
+    Returns:
+        Shared NoReplaceFilesystem on Linux, else a LocalFilesystem
+    """
+    global _DEFAULT_FILESYSTEM
+    if _DEFAULT_FILESYSTEM is None:
+        _DEFAULT_FILESYSTEM = NoReplaceFilesystem() if sys.platform.startswith('linux') else LocalFilesystem()
+    return _DEFAULT_FILESYSTEM
+
+
+class LatencyFilesystem:
+    """
+    Wraps another filesystem and delays every operation.
+
+    Used to reproduce network-mounted or FUSE-backed note stores on a local
+    disk when testing and benchmarking concurrent renames.
+    """
+
+    def __init__(self, inner: Optional[LocalFilesystem] = None, latency: float = 0.005,
+                 jitter: float = 0.0, seed: Optional[int] = None,
+                 schedule: Optional[Callable[[int], float]] = None):
+        """
+        Args:
+            inner: Filesystem doing the real work (default: default_filesystem())
+            latency: Delay in seconds added to every operation
+            jitter: Maximum extra random delay in seconds
+            seed: Seed for the jitter, for repeatable runs
+            schedule: Optional function mapping the operation number (from 0)
+                to its delay, used instead of ``latency`` to simulate storage
+                slowing down or recovering partway through a run
+        """
+        self.inner = inner or default_filesystem()
+        self.latency = latency
+        self.jitter = jitter
+        self.schedule = schedule
+        self.operations = 0
+        self._count_lock = threading.Lock()
+        import random
+        self._random = random.Random(seed)
+
+    def _delay(self) -> None:
+        if self.schedule is not None:
+            with self._count_lock:
+                operation = self.operations
+                self.operations += 1
+            delay = self.schedule(operation)
+        else:
+            delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def no_clobber(self) -> bool:
+        return self.inner.no_clobber
+
+    def rename(self, source: str, destination: str) -> None:
+        self._delay()
+        self.inner.rename(source, destination)
+
+    def lstat(self, path: str) -> os.stat_result:
+        self._delay()
+        return self.inner.lstat(path)
+
+    def lexists(self, path: str) -> bool:
+        self._delay()
+        return self.inner.lexists(path)
+
+
+class BoundedFilesystem:
+    """
+    Wraps another filesystem and caps the number of operations in flight.
+
+    One instance shared by several concurrent runs (see jobs.py) limits
+    their combined I/O, however many rename workers each of them uses.
+    """
+
+    def __init__(self, max_in_flight: int, inner: Optional[LocalFilesystem] = None):
+        """
+        Args:
+            max_in_flight: Maximum number of operations running at the same time
+            inner: Filesystem doing the real work (default: default_filesystem())
+        """
+        self.inner = inner or default_filesystem()
+        self.max_in_flight = max_in_flight
+        self.slot = threading.BoundedSemaphore(max_in_flight)
+
+    @property
+    def no_clobber(self) -> bool:
+        return self.inner.no_clobber
+
+    def rename(self, source: str, destination: str) -> None:
+        with self.slot:
+            self.inner.rename(source, destination)
+
+    def lstat(self, path: str) -> os.stat_result:
+        with self.slot:
+            return self.inner.lstat(path)
+
+    def lexists(self, path: str) -> bool:
+        with self.slot:
+            return self.inner.lexists(path)
+
+
+class ThrottledFilesystem:
+    """
+    Wraps another filesystem and limits its operation rate and concurrency.
+
+    Operations are admitted by a token bucket (``rate`` per second) and a
+    cap on operations in flight. With a ``target_latency``, both limits
+    adapt to the observed latency, the way TCP adapts to congestion: while
+    the smoothed latency stays under the target they grow additively (by
+    about one slot and 5% of the configured rate per round of operations),
+    and once it rises above they are halved, at most once per latency
+    period. The configured values are ceilings; the limits never exceed them.
+
+    Meant for shared storage (NAS, network mounts) where a large run would
+    otherwise starve other clients. snapshot() reports live throughput.
+    """
+
+    def __init__(self, inner: Optional[LocalFilesystem] = None, rate: Optional[float] = None,
+                 max_in_flight: Optional[int] = None, target_latency: Optional[float] = None,
+                 min_rate: float = 1.0):
+        """
+        Args:
+            inner: Filesystem doing the real work (default: default_filesystem())
+            rate: Maximum operations per second (None for no rate limit)
+            max_in_flight: Maximum operations running at the same time (None
+                for no concurrency limit)
+            target_latency: Latency in seconds above which the limits back
+                off (None keeps them fixed)
+            min_rate: Lowest rate the backoff goes down to
+
+        Raises:
+            ValueError: If a target latency is given without a limit to adapt
+        """
+        if target_latency is not None and rate is None and max_in_flight is None:
+            raise ValueError("target_latency needs a rate or max_in_flight limit to adapt")
+        self.inner = inner or default_filesystem()
+        self.max_rate = rate
+        self.max_in_flight = max_in_flight
+        self.target_latency = target_latency
+        self.min_rate = min(min_rate, rate) if rate else min_rate
+
+        # Current limits, lowered and raised by the latency feedback
+        self.rate = rate
+        self.limit = float(max_in_flight) if max_in_flight else None
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._tokens = 1.0
+        self._refilled = time.monotonic()
+        self._hold_until = 0.0
+        self.latency = None
+        self.operations = 0
+        self.backoffs = 0
+        self.waited = 0.0
+
+        # Throughput of the last completed measurement window
+        self._window_started = self._refilled
+        self._window_operations = 0
+        self.throughput = 0.0
+
+    def _reserve_token(self, now: float) -> float:
+        """
+        Take a token from the bucket; returns the seconds to wait for it.
+        """
+        if self.rate is None:
+            return 0.0
+        # Bursts are limited to one second worth of operations
+        self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        self._tokens -= 1.0
+        return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def _acquire(self) -> Tuple[float, float]:
+        requested = time.monotonic()
+        with self._cond:
+            while self.limit is not None and self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+            delay = self._reserve_token(time.monotonic())
+        if delay > 0:
+            time.sleep(delay)
+        return requested, time.monotonic()
+
+    def _release(self, requested: float, started: float) -> None:
+        now = time.monotonic()
+        latency = now - started
+        with self._cond:
+            self._in_flight -= 1
+            self.operations += 1
+            self.waited += started - requested
+            self._window_operations += 1
+            if now - self._window_started >= 1.0:
+                self.throughput = self._window_operations / (now - self._window_started)
+                self._window_started = now
+                self._window_operations = 0
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            if self.target_latency is not None:
+                self._adapt(now)
+            self._cond.notify_all()
+
+    def _adapt(self, now: float) -> None:
+        """
+        Additive increase while under the target latency, multiplicative decrease above it.
+        """
+        if self.latency > self.target_latency:
+            # Operations started before the last decrease still report the
+            # old latency; wait one latency period before deciding again
+            if now < self._hold_until:
+                return
+            self._hold_until = now + self.latency
+            limits = (self.limit, self.rate)
+            if self.limit is not None:
+                self.limit = max(1.0, self.limit / 2)
+            if self.rate is not None:
+                self.rate = max(self.min_rate, self.rate / 2)
+            if (self.limit, self.rate) != limits:
+                self.backoffs += 1
+            return
+        if self.limit is not None:
+            self.limit = min(float(self.max_in_flight), self.limit + 1.0 / self.limit)
+        if self.rate is not None:
+            self.rate = min(self.max_rate, self.rate + 0.05 * self.max_rate / max(self.rate, 1.0))
+
+    def snapshot(self) -> dict:
+        """
+        Current limits and measurements.
+
+        Returns:
+            Dict with operations, throughput (ops/s over the last second),
+            in_flight, limit, rate, latency (smoothed, seconds), backoffs and
+            waited (total seconds operations spent waiting for admission)
+        """
+        with self._cond:
+            return {'operations': self.operations, 'throughput': self.throughput,
+                    'in_flight': self._in_flight,
+                    'limit': int(self.limit) if self.limit is not None else None,
+                    'rate': self.rate, 'latency': self.latency, 'backoffs': self.backoffs,
+                    'waited': self.waited}
+
+    @property
+    def no_clobber(self) -> bool:
+        return self.inner.no_clobber
+
+    def rename(self, source: str, destination: str) -> None:
+        admitted = self._acquire()
+        try:
+            self.inner.rename(source, destination)
+        finally:
+            self._release(*admitted)
+
+    def lstat(self, path: str) -> os.stat_result:
+        admitted = self._acquire()
+        try:
+            return self.inner.lstat(path)
+        finally:
+            self._release(*admitted)
+
+    def lexists(self, path: str) -> bool:
+        admitted = self._acquire()
+        try:
+            return self.inner.lexists(path)
+        finally:
+            self._release(*admitted)
+
+
+def describe_throughput(snapshot: dict) -> str:
+    """
+    One-line description of a ThrottledFilesystem snapshot for progress logs.
+
+    Args:
+        snapshot: Result of ThrottledFilesystem.snapshot()
+
+    Returns:
+        Human-readable summary
+    """
+    parts = [f"{snapshot['operations']} ops", f"{snapshot['throughput']:.0f} ops/s"]
+    if snapshot['limit'] is not None:
+        parts.append(f"{snapshot['in_flight']}/{snapshot['limit']} in flight")
+    if snapshot['rate'] is not None:
+        parts.append(f"rate limit {snapshot['rate']:.0f}/s")
+    if snapshot['latency'] is not None:
+        parts.append(f"latency {snapshot['latency'] * 1000:.1f} ms")
+    parts.append(f"{snapshot['backoffs']} backoffs")
+    return ", ".join(parts)
+
+
+class ThroughputReporter:
+    """
+    Background thread logging a ThrottledFilesystem's throughput at an interval.
+
+    Use as a context manager around the run; a final line is logged on exit.
+    """
+
+    def __init__(self, filesystem: ThrottledFilesystem, logger: logging.Logger,
+                 interval: float = 2.0, level: int = logging.INFO):
+        """
+        Args:
+            filesystem: Throttled filesystem to report on
+            logger: Logger the progress lines go to
+            interval: Seconds between two lines
+            level: Log level of the progress lines
+        """
+        self.filesystem = filesystem
+        self.logger = logger
+        self.interval = interval
+        self.level = level
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='throughput-reporter', daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.logger.log(self.level, "Throughput: %s", describe_throughput(self.filesystem.snapshot()))
+
+    def __enter__(self) -> 'ThroughputReporter':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.logger.log(self.level, "Throttled I/O: %s", describe_throughput(self.filesystem.snapshot()))
@@ -0,0 +1,485 @@
+"""
+Batch Jobs
+
+Processes many note roots in one run from a manifest file, instead of one
+`retitle -y` per root: logging is set up once, there is one confirmation and
+one consolidated report.
+
+Subdirectories are found in the same scan that feeds a directory's
+entries to process_directory (as in walker.py), so each directory is listed
+once, and are queued with their size estimated from the directory's own
+st_size. All directories share one worker pool: the scheduler picks the root
+with the fewest directories in flight relative to its priority, and within a
+root the largest known directory first, so a huge root gets its share of the
+workers but never all of them. A BoundedFilesystem shared by every root caps
+the scans and renames running at the same time.
+
+Manifest (JSON, or TOML on Python 3.11+ / with tomli installed):
+
+    workers = 8                 # shared directory workers
+    io_limit = 16               # scans and renames in flight, all roots together
+    report = "report.json"      # consolidated report (optional)
+    state_cache = "state.json"  # for roots with incremental = true (optional)
+
+    [defaults]                  # options applied to every root
+    recursive = true
+
+    [[roots]]
+    path = "~/vaults/work"      # relative paths are relative to the manifest
+    priority = 3                # share of the workers while roots compete
+    max_depth = 4
+    exclude = ["*.png", ".git"] # name filters, see filters.py
+"""
+
+import os
+import json
+import time
+import heapq
+import logging
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+from .fs import BoundedFilesystem, LocalFilesystem
+from .filters import NameFilter
+from .note_retitler import process_directory
+from .walker import default_worker_count, relative_renames
+
+if TYPE_CHECKING:
+    from .metrics import RunStats
+
+
+# Scans and renames allowed in flight across all roots
+DEFAULT_IO_LIMIT = 16
+
+# Directory entries read per I/O slot while scanning
+SCAN_BATCH = 1024
+
+# Options a root may set, with their defaults
+ROOT_OPTIONS = {
+    'priority': 1,
+    'recursive': True,
+    'max_depth': None,
+    'follow_symlinks': False,
+    'incremental': False,
+    'rename_workers': 1,
+    'include': (),
+    'exclude': (),
+    'extensions': (),
+    'exclude_extensions': (),
+    'skip_normalized': True,
+}
+
+# Root options holding lists of globs or extensions
+FILTER_LIST_OPTIONS = ('include', 'exclude', 'extensions', 'exclude_extensions')
+
+MANIFEST_KEYS = ('workers', 'io_limit', 'report', 'state_cache', 'defaults', 'roots')
+
+REPORT_VERSION = 1
+
+
+class JobRoot:
+    """
+    One root of a job manifest.
+
+    Attributes:
+        path: Absolute path of the root directory
+        priority: Relative share of the workers while several roots have work
+        recursive: Process subdirectories as well
+        max_depth: Maximum subdirectory depth in recursive mode (None for unlimited)
+        follow_symlinks: Descend into symlinked directories
+        incremental: Skip directories unchanged since the last incremental run
+        rename_workers: Number of renames run concurrently per directory
+        name_filter: NameFilter built from the include, exclude, extensions,
+            exclude_extensions and skip_normalized options
+    """
+
+    __slots__ = ('path', 'priority', 'recursive', 'max_depth', 'follow_symlinks',
+                 'incremental', 'rename_workers', 'name_filter')
+
+    def __init__(self, path: str, priority: float = 1, recursive: bool = True,
+                 max_depth: Optional[int] = None, follow_symlinks: bool = False,
+                 incremental: bool = False, rename_workers: int = 1,
+                 include: Iterable[str] = (), exclude: Iterable[str] = (),
+                 extensions: Iterable[str] = (), exclude_extensions: Iterable[str] = (),
+                 skip_normalized: bool = True):
+        self.path = path
+        self.priority = priority
+        self.recursive = recursive
+        self.max_depth = max_depth
+        self.follow_symlinks = follow_symlinks
+        self.incremental = incremental
+        self.rename_workers = rename_workers
+        self.name_filter = NameFilter(include, exclude, extensions, exclude_extensions,
+                                      skip_normalized=skip_normalized)
+
+
+class JobManifest:
+    """
+    A parsed job manifest.
+
+    Attributes:
+        roots: Roots to process, in manifest order
+        workers: Size of the shared directory worker pool
+        io_limit: Scans and renames allowed in flight across all roots
+        report: Path of the consolidated report, or None
+        state_cache: State cache file for incremental roots, or None for the default
+        source: Manifest file the job was read from
+    """
+
+    __slots__ = ('roots', 'workers', 'io_limit', 'report', 'state_cache', 'source')
+
+    def __init__(self, roots: List[JobRoot], workers: Optional[int] = None,
+                 io_limit: int = DEFAULT_IO_LIMIT, report: Optional[str] = None,
+                 state_cache: Optional[str] = None, source: str = ''):
+        self.roots = roots
+        self.workers = workers or default_worker_count()
+        self.io_limit = io_limit
+        self.report = report
+        self.state_cache = state_cache
+        self.source = source
+
+
+def _read_manifest_data(manifest_file: str) -> dict:
+    """
+    Read a JSON or TOML manifest into a dictionary.
+    """
+    if manifest_file.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("TOML manifests need Python 3.11+ or the tomli package; "
+                                 "use a JSON manifest instead") from None
+        with open(manifest_file, 'rb') as f:
+            try:
+                return tomllib.load(f)
+            except tomllib.TOMLDecodeError as e:
+                raise ValueError(f"Invalid TOML: {e}") from None
+    with open(manifest_file, encoding='utf-8') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e}") from None
+
+
+def _check_root_options(options: dict, where: str) -> None:
+    """
+    Reject unknown root options and values of the wrong kind.
+    """
+    unknown = set(options) - set(ROOT_OPTIONS) - {'path'}
+    if unknown:
+        raise ValueError(f"{where}: unknown option(s) {', '.join(sorted(unknown))}")
+    priority = options.get('priority', 1)
+    if isinstance(priority, bool) or not isinstance(priority, (int, float)) or priority <= 0:
+        raise ValueError(f"{where}: priority must be a positive number")
+    for name in ('max_depth', 'rename_workers'):
+        value = options.get(name)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 0):
+            raise ValueError(f"{where}: {name} must be a non-negative integer")
+    for name in FILTER_LIST_OPTIONS:
+        value = options.get(name, ())
+        if not isinstance(value, (list, tuple)) or not all(isinstance(item, str) for item in value):
+            raise ValueError(f"{where}: {name} must be a list of strings")
+
+
+def load_manifest(manifest_file: str) -> JobManifest:
+    """
+    Read a job manifest.
+
+    Args:
+        manifest_file: JSON manifest, or TOML when the name ends in .toml
+
+    Returns:
+        JobManifest with absolute root paths
+
+    Raises:
+        ValueError: If the manifest is malformed
+    """
+    data = _read_manifest_data(manifest_file)
+    if not isinstance(data, dict):
+        raise ValueError("Manifest must be an object/table")
+    unknown = set(data) - set(MANIFEST_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown manifest key(s): {', '.join(sorted(unknown))}")
+
+    base = os.path.dirname(os.path.abspath(manifest_file))
+
+    def resolve(path: str) -> str:
+        return os.path.normpath(os.path.join(base, os.path.expanduser(path)))
+
+    defaults = data.get('defaults', {})
+    if not isinstance(defaults, dict):
+        raise ValueError("'defaults' must be an object/table")
+    _check_root_options(defaults, "defaults")
+
+    entries = data.get('roots')
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("Manifest needs a non-empty 'roots' list")
+    roots = []
+    for number, entry in enumerate(entries, 1):
+        if isinstance(entry, str):
+            entry = {'path': entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get('path'), str):
+            raise ValueError(f"Root {number}: needs a 'path'")
+        _check_root_options(entry, f"Root {number}")
+        options = dict(ROOT_OPTIONS, **defaults)
+        options.update(entry)
+        options['path'] = resolve(options['path'])
+        roots.append(JobRoot(**options))
+
+    workers = data.get('workers')
+    io_limit = data.get('io_limit', DEFAULT_IO_LIMIT)
+    for name, value in (('workers', workers), ('io_limit', io_limit)):
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 1):
+            raise ValueError(f"'{name}' must be a positive integer")
+
+    report = data.get('report')
+    state_cache = data.get('state_cache')
+    return JobManifest(roots, workers=workers, io_limit=io_limit,
+                       report=resolve(report) if report else None,
+                       state_cache=resolve(state_cache) if state_cache else None,
+                       source=os.path.abspath(manifest_file))
+
+
+def _bounded_scan(directory: str, filesystem: BoundedFilesystem) -> Iterator[os.DirEntry]:
+    """
+    Scan a directory, holding one of the shared I/O slots only while reading.
+
+    Entries are read SCAN_BATCH at a time, so the slot is not kept while
+    the caller parses or renames, and a directory skipped through the
+    state cache before its entries are read costs no slot.
+    """
+    with filesystem.slot:
+        entries = os.scandir(directory)
+    with entries:
+        while True:
+            with filesystem.slot:
+                batch = list(islice(entries, SCAN_BATCH))
+            if not batch:
+                return
+            yield from batch
+
+
+class _Scheduler:
+    """
+    Hands out directories of several roots to the shared worker pool.
+    """
+
+    def __init__(self, roots: List[JobRoot]):
+        self.roots = roots
+        self.pending = {}  # root index -> heap of (-size, directory), largest first
+        self.in_flight = [0] * len(roots)
+
+    def add(self, index: int, directories: List[Tuple[str, int]]) -> None:
+        """
+        Queue (directory, size) pairs of a root as they are discovered.
+        """
+        if directories:
+            queue = self.pending.setdefault(index, [])
+            for directory, size in directories:
+                heapq.heappush(queue, (-size, directory))
+
+    def next(self) -> Optional[Tuple[int, str]]:
+        """
+        Take the next directory to process, or None when nothing is queued.
+
+        Returns:
+            (root index, directory)
+        """
+        if not self.pending:
+            return None
+        index = min(self.pending, key=lambda i: ((self.in_flight[i] + 1) / self.roots[i].priority,
+                                                  self.pending[i][0][0], i))
+        queue = self.pending[index]
+        _, directory = heapq.heappop(queue)
+        if not queue:
+            del self.pending[index]
+        self.in_flight[index] += 1
+        return index, directory
+
+    def finish(self, index: int) -> None:
+        """
+        Record that a directory of a root has been processed.
+        """
+        self.in_flight[index] -= 1
+
+
+def run_jobs(manifest: JobManifest, logger: logging.Logger, journal=None,
+             stats: 'Optional[RunStats]' = None,
+             filesystem: 'Optional[LocalFilesystem]' = None,
+             parse_workers: Optional[int] = None) -> dict:
+    """
+    Process every root of a manifest on one shared worker pool.
+
+    Args:
+        manifest: Parsed job manifest
+        logger: Logger instance for output
+        journal: Optional RenameJournal recording intended and completed renames
+        stats: Optional RunStats collecting timers and counters of all roots
+        filesystem: Filesystem the renames go through, below the manifest's
+            io_limit (default: default_filesystem())
+        parse_workers: Worker processes for parsing large directories (see plan_directory)
+
+    Returns:
+        Consolidated report (see write_report)
+    """
+    started = time.time()
+    clock = time.perf_counter()
+    filesystem = BoundedFilesystem(manifest.io_limit, inner=filesystem)
+    scheduler = _Scheduler(manifest.roots)
+
+    cache = None
+    if any(root.incremental for root in manifest.roots):
+        from .state_cache import StateCache
+        cache = StateCache(manifest.state_cache)
+        logger.info("Using state cache: %s", cache.cache_file)
+
+    results = [{'path': root.path, 'priority': root.priority, 'directories': 0, 'entries': 0,
+                'renamed': [], 'errors': [], 'busy_seconds': 0.0, 'finished_after': None}
+               for root in manifest.roots]
+    visited = [set() for _ in manifest.roots]  # (st_dev, st_ino) queued per root
+    depths = {}  # (root index, queued directory) -> depth below the root
+    outstanding = [0] * len(manifest.roots)  # directories queued or running per root
+
+    def queue(index: int, directories: List[Tuple[str, Tuple[int, int], int]], depth: int) -> None:
+        fresh = []
+        for directory, key, size in directories:
+            if key in visited[index]:
+                continue
+            visited[index].add(key)
+            depths[index, directory] = depth
+            fresh.append((directory, size))
+        outstanding[index] += len(fresh)
+        scheduler.add(index, fresh)
+
+    def process(index: int, directory: str, depth: int) -> Tuple[list, float, int, list]:
+        root = manifest.roots[index]
+        start = time.perf_counter()
+        max_depth = root.max_depth if root.recursive else 0
+        descend = max_depth is None or depth < max_depth
+        found = []
+        entry_count = 0
+
+        def split_entries() -> Iterator[os.DirEntry]:
+            # Every entry goes to process_directory, directories are also kept here
+            nonlocal entry_count
+            for entry in _bounded_scan(directory, filesystem):
+                entry_count += 1
+                try:
+                    if (descend and entry.is_dir(follow_symlinks=root.follow_symlinks)
+                            and not root.name_filter.prunes(entry.name)):
+                        found.append(entry.path)
+                except OSError:
+                    pass
+                yield entry
+
+        entries = split_entries()
+        renamed = process_directory(Path(directory), logger, entries=entries,
+                                    filesystem=filesystem, rename_workers=root.rename_workers,
+                                    journal=journal, state_cache=cache if root.incremental else None,
+                                    stats=stats, name_filter=root.name_filter,
+                                    parse_workers=parse_workers)
+        if descend:
+            # Skipped through the state cache: the subdirectories are still needed
+            for _ in entries:
+                pass
+        subdirectories = []
+        for path in found:
+            try:
+                with filesystem.slot:
+                    st = os.stat(path)
+            except OSError as e:
+                logger.error("Cannot read directory %s: %s", path, e)
+                continue
+            subdirectories.append((path, (st.st_dev, st.st_ino), st.st_size))
+        return renamed, time.perf_counter() - start, entry_count, subdirectories
+
+    def root_finished(index: int) -> None:
+        results[index]['finished_after'] = round(time.perf_counter() - clock, 3)
+        logger.info("Finished root %s: %d directories, %d entries, %d renamed",
+                    manifest.roots[index].path, results[index]['directories'],
+                    results[index]['entries'], len(results[index]['renamed']))
+
+    for index, root in enumerate(manifest.roots):
+        if not os.path.isdir(root.path):
+            logger.error("Not a directory: %s", root.path)
+            results[index]['errors'].append(f"Not a directory: {root.path}")
+            root_finished(index)
+            continue
+        st = os.stat(root.path)
+        queue(index, [(root.path, (st.st_dev, st.st_ino), st.st_size)], 0)
+
+    try:
+        with ThreadPoolExecutor(max_workers=manifest.workers) as pool:
+            running = {}
+            while True:
+                # Keep the pool busy without queueing work the scheduler could still reorder
+                while len(running) < manifest.workers:
+                    task = scheduler.next()
+                    if task is None:
+                        break
+                    depth = depths.pop(task)
+                    running[pool.submit(process, *task, depth)] = task + (depth,)
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, directory, depth = running.pop(future)
+                    scheduler.finish(index)
+                    result = results[index]
+                    result['directories'] += 1
+                    try:
+                        renamed, seconds, entry_count, subdirectories = future.result()
+                        result['entries'] += entry_count
+                        result['busy_seconds'] += seconds
+                        result['renamed'].extend(relative_renames(manifest.roots[index].path,
+                                                                  directory, renamed))
+                        queue(index, subdirectories, depth + 1)
+                    except OSError as e:
+                        logger.error("Failed to process directory %s: %s", directory, e)
+                        result['errors'].append(f"{directory}: {e}")
+                    outstanding[index] -= 1
+                    if outstanding[index] == 0:
+                        root_finished(index)
+    finally:
+        if cache is not None:
+            cache.save()
+
+    for result in results:
+        result['renamed'].sort()
+        result['busy_seconds'] = round(result['busy_seconds'], 3)
+    return {
+        'version': REPORT_VERSION,
+        'manifest': manifest.source,
+        'started': started,
+        'seconds': round(time.perf_counter() - clock, 3),
+        'workers': manifest.workers,
+        'io_limit': manifest.io_limit,
+        'totals': {
+            'roots': len(results),
+            'directories': sum(result['directories'] for result in results),
+            'entries': sum(result['entries'] for result in results),
+            'renamed': sum(len(result['renamed']) for result in results),
+            'errors': sum(len(result['errors']) for result in results),
+        },
+        'roots': results,
+    }
+
+
+def write_report(report: dict, report_file: str) -> None:
+    """
+    Write a job report as JSON.
+
+    The report holds the job totals and, per root: directories and entries
+    found, renames as [old, new] paths relative to the root, errors, the
+    time workers spent on the root and when it finished relative to the
+    start of the job.
+    """
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
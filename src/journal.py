@@ -0,0 +1,368 @@
+"""
+Rename Journal
+
+Write-ahead journal for rename runs. Every planned rename is appended as an
+intent before any file of its directory is touched, and every completed
+rename is appended as done. Records are fsynced in batches, so a killed run
+loses at most the last batch of done records; those renames are recognised on
+disk when the journal is resumed or undone.
+
+The journal is a JSON Lines file with these records:
+    {"op": "plan", "plan": P, "dir": ..., "temp": {...}}
+    {"op": "intent", "id": N, "plan": P, "chain": C, "src": ..., "dst": ..., "ino": ...}
+    {"op": "done", "id": N}
+    {"op": "undone", "id": N}
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .fs import LocalFilesystem, default_filesystem
+from .planner import RenamePlan, RenameStep, execute_plan
+
+
+# Number of done records written between two fsync calls
+DEFAULT_SYNC_BATCH = 256
+
+
+class RenameJournal:
+    """
+    Append-only rename journal shared by all workers of a run.
+    """
+
+    def __init__(self, journal_file: str, sync_batch: int = DEFAULT_SYNC_BATCH):
+        """
+        Args:
+            journal_file: Path of the journal; an existing journal is appended to
+            sync_batch: Number of done records written between fsync calls
+        """
+        self.journal_file = journal_file
+        self.sync_batch = sync_batch
+        self._lock = threading.Lock()
+        self._file = open(journal_file, 'a', encoding='utf-8')
+        self._unsynced = 0
+        self._step_ids = {}
+
+        # Continue numbering after the records already in the file
+        self._next_plan, self._next_id = 0, 0
+        for record in _read_records(journal_file):
+            if record.get('op') == 'plan':
+                self._next_plan = max(self._next_plan, record['plan'] + 1)
+            elif record.get('op') == 'intent':
+                self._next_id = max(self._next_id, record['id'] + 1)
+
+    def __enter__(self) -> 'RenameJournal':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def _sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def register(self, directory: str, step: RenameStep, step_id: int) -> None:
+        """
+        Associate a step with the id of an intent already in the journal.
+
+        Args:
+            directory: Directory of the step
+            step: Rename step
+            step_id: Id of its intent record
+        """
+        self._step_ids[(directory, step.source, step.destination)] = step_id
+
+    def begin_plan(self, plan: RenamePlan) -> None:
+        """
+        Record the intent of every step of a plan and make it durable.
+
+        Called before any file of the plan's directory is renamed.
+
+        Args:
+            plan: Plan about to be executed
+        """
+        if not plan.chains:
+            return
+        # Plans rebuilt from this journal (on resume) are already recorded
+        if all((plan.directory, step.source, step.destination) in self._step_ids
+               for chain in plan.chains for step in chain):
+            return
+        with self._lock:
+            plan_id = self._next_plan
+            self._next_plan += 1
+            self._write({'op': 'plan', 'plan': plan_id, 'dir': plan.directory,
+                         'temp': plan.temp_names})
+            for chain_index, chain in enumerate(plan.chains):
+                for step in chain:
+                    step_id = self._next_id
+                    self._next_id += 1
+                    self._write({'op': 'intent', 'id': step_id, 'plan': plan_id,
+                                 'chain': chain_index, 'src': step.source,
+                                 'dst': step.destination, 'ino': step.inode})
+                    self.register(plan.directory, step, step_id)
+            self._sync()
+
+    def _mark(self, op: str, directory: str, step: RenameStep) -> None:
+        # Each step is marked once; dropping its id keeps long runs from
+        # holding every step in memory
+        step_id = self._step_ids.pop((directory, step.source, step.destination), None)
+        if step_id is None:
+            return
+        with self._lock:
+            self._write({'op': op, 'id': step_id})
+            self._unsynced += 1
+            if self._unsynced >= self.sync_batch:
+                self._sync()
+
+    def mark_done(self, directory: str, step: RenameStep) -> None:
+        """
+        Record that a step completed.
+
+        Args:
+            directory: Directory of the step
+            step: Completed rename step
+        """
+        self._mark('done', directory, step)
+
+    def mark_undone(self, directory: str, step: RenameStep) -> None:
+        """
+        Record that a completed step was reverted.
+
+        Args:
+            directory: Directory of the step
+            step: Reverted rename step
+        """
+        self._mark('undone', directory, step)
+
+    def close(self) -> None:
+        """
+        Flush, fsync and close the journal.
+        """
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+
+def _read_records(journal_file: str) -> List[dict]:
+    """
+    Read all complete records of a journal.
+
+    A partially written last line (from a killed run) is ignored.
+
+    Args:
+        journal_file: Path of the journal
+
+    Returns:
+        List of record dictionaries
+    """
+    records = []
+    if not os.path.exists(journal_file):
+        return records
+    with open(journal_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def load_journal(journal_file: str) -> Tuple[List[RenamePlan], Dict[Tuple[str, str, str], int], set, set]:
+    """
+    Rebuild the plans recorded in a journal.
+
+    Steps moving a parked file out of its temporary name get the inode of
+    the file parked by the earlier step of their chain.
+
+    Args:
+        journal_file: Path of the journal
+
+    Returns:
+        Tuple of (plans, step_ids, done_ids, undone_ids) where step_ids maps
+        (directory, source, destination) to the intent id
+    """
+    plans = {}
+    step_ids = {}
+    done_ids = set()
+    undone_ids = set()
+
+    for record in _read_records(journal_file):
+        op = record.get('op')
+        if op == 'plan':
+            plans[record['plan']] = RenamePlan([], [], {}, [], record.get('temp', {}),
+                                               directory=record['dir'])
+        elif op == 'intent':
+            plan = plans.get(record['plan'])
+            if plan is None:
+                continue
+            while len(plan.chains) <= record['chain']:
+                plan.chains.append([])
+            chain = plan.chains[record['chain']]
+            inode = record['ino']
+            if not inode and record['src'] in plan.temp_names:
+                # A parked file keeps the inode of the step that parked it
+                inode = next((step.inode for step in chain if step.destination == record['src']), 0)
+            step = RenameStep(record['src'], record['dst'], inode)
+            chain.append(step)
+            step_ids[(plan.directory, step.source, step.destination)] = record['id']
+        elif op == 'done':
+            done_ids.add(record['id'])
+        elif op == 'undone':
+            undone_ids.add(record['id'])
+
+    return list(plans.values()), step_ids, done_ids, undone_ids
+
+
+def _completed_on_disk(filesystem: LocalFilesystem, directory: str, step: RenameStep) -> bool:
+    """
+    Check whether a step whose done record was lost already happened.
+
+    Args:
+        filesystem: Filesystem the journal was applied to
+        directory: Directory of the step
+        step: Rename step
+
+    Returns:
+        True if the planned file sits at the destination
+    """
+    try:
+        st = filesystem.lstat(os.path.join(directory, step.destination))
+    except OSError:
+        return False
+    if step.inode:
+        return st.st_ino == step.inode
+    # Journals without the parked inode: the step happened if its source is gone
+    return not filesystem.lexists(os.path.join(directory, step.source))
+
+
+def resume_journal(journal_file: str, logger: logging.Logger,
+                   filesystem: Optional[LocalFilesystem] = None,
+                   rename_workers: int = 1) -> List[Tuple[str, str]]:
+    """
+    Finish the renames of an interrupted run recorded in a journal.
+
+    Only the journal is read; no directory is rescanned and no filename is
+    parsed again. Steps without a done record are checked on disk, so renames
+    whose done record was lost in the crash are not repeated.
+
+    Args:
+        journal_file: Path of the journal
+        logger: Logger instance for output
+        filesystem: Filesystem to apply the renames to (default: local)
+        rename_workers: Number of chains renamed concurrently
+
+    Returns:
+        List of tuples containing (old_path, new_path) for renamed files
+    """
+    filesystem = filesystem or default_filesystem()
+    plans, step_ids, done_ids, undone_ids = load_journal(journal_file)
+    renamed_files = []
+
+    with RenameJournal(journal_file) as journal:
+        for key, step_id in step_ids.items():
+            journal.register(key[0], RenameStep(key[1], key[2], 0), step_id)
+
+        for plan in plans:
+            remaining = []
+            for chain in plan.chains:
+                pending = []
+                for step in chain:
+                    # Chains run in order: once a step is pending, so is the rest
+                    if not pending:
+                        step_id = step_ids[(plan.directory, step.source, step.destination)]
+                        if step_id in done_ids or step_id in undone_ids:
+                            continue
+                        if _completed_on_disk(filesystem, plan.directory, step):
+                            journal.mark_done(plan.directory, step)
+                            continue
+                    pending.append(step)
+                if pending:
+                    remaining.append(pending)
+            if not remaining:
+                continue
+
+            logger.info("Resuming %d renames in %s", sum(len(chain) for chain in remaining), plan.directory)
+            plan.chains = remaining
+            # Re-check each step on disk, the directory changed since the intents were written
+            renamed = execute_plan(plan, logger, filesystem=filesystem, rename_workers=rename_workers,
+                                   journal=journal, verify=True)
+            renamed_files.extend((os.path.join(plan.directory, old_name),
+                                  os.path.join(plan.directory, new_name))
+                                 for old_name, new_name in renamed)
+
+    return renamed_files
+
+
+def undo_journal(journal_file: str, logger: logging.Logger,
+                 filesystem: Optional[LocalFilesystem] = None) -> List[Tuple[str, str]]:
+    """
+    Revert the completed renames recorded in a journal, newest first.
+
+    Each reverted step is recorded as undone, so an interrupted undo can
+    simply be run again.
+
+    Args:
+        journal_file: Path of the journal
+        logger: Logger instance for output
+        filesystem: Filesystem the renames were applied to (default: local)
+
+    Returns:
+        List of tuples containing (current_path, restored_path) for reverted files
+    """
+    filesystem = filesystem or default_filesystem()
+    plans, step_ids, done_ids, undone_ids = load_journal(journal_file)
+    reverted_files = []
+
+    # Steps in journal order; reversing it undoes chains and cycles safely
+    steps = []
+    temp_targets = {}
+    for plan in plans:
+        for chain in plan.chains:
+            for step in chain:
+                step_id = step_ids[(plan.directory, step.source, step.destination)]
+                steps.append((step_id, plan, step))
+                if step.source in plan.temp_names:
+                    temp_targets[step.source] = step.destination
+    steps.sort(key=lambda item: item[0])
+
+    with RenameJournal(journal_file) as journal:
+        for step_id, plan, step in reversed(steps):
+            if step_id in undone_ids:
+                continue
+            if step_id not in done_ids and not _completed_on_disk(filesystem, plan.directory, step):
+                continue
+
+            journal.register(plan.directory, step, step_id)
+            current = os.path.join(plan.directory, step.destination)
+            restored = os.path.join(plan.directory, step.source)
+            if not filesystem.no_clobber and filesystem.lexists(restored):
+                logger.warning("Cannot undo %s, original name is taken: %s", step.destination, step.source)
+                continue
+            try:
+                filesystem.rename(current, restored)
+            except FileExistsError:
+                logger.warning("Cannot undo %s, original name is taken: %s", step.destination, step.source)
+                continue
+            except OSError as e:
+                logger.error("Failed to undo %s: %s", step.destination, e)
+                continue
+            journal.mark_undone(plan.directory, step)
+
+            # Moving a parked file out of its temporary name is an internal step;
+            # moving it back under its original name completes its restore
+            if step.source in plan.temp_names:
+                continue
+            if step.destination in plan.temp_names:
+                current = os.path.join(plan.directory, temp_targets.get(step.destination, step.destination))
+            logger.info("Restored: %s -> %s", os.path.basename(current), step.source)
+            reverted_files.append((current, restored))
+
+    return reverted_files
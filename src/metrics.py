@@ -0,0 +1,288 @@
+"""
+Run Metrics
+
+Per-run instrumentation: phase timers, counters, parse hits by date format,
+and a rename latency histogram. A RunStats object is passed down to
+process_directory (and everything below it) and filled in as the run goes;
+the hot loops count into local variables and merge them once per directory,
+so collecting stats adds no locking per file.
+
+Stats can be written as JSON or as a Prometheus textfile for the node
+exporter's textfile collector.
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+
+# Upper bounds (seconds) of the rename latency histogram buckets
+DEFAULT_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Order in which phases are reported
+PHASES = ('stat', 'scan', 'parse', 'plan', 'rename', 'total')
+
+# Prefix of every Prometheus metric name
+PROMETHEUS_PREFIX = 'note_retitler'
+
+# Prometheus HELP text of the counters, exported as gauges of the last run
+COUNTER_HELP = {
+    'archive_renames': 'Archive members renamed',
+    'archives': 'Archives processed',
+    'bytes_logged': 'Bytes written to the log file',
+    'candidates': 'Files whose name would change',
+    'collisions': 'Renames skipped because the target is kept by another file',
+    'directories': 'Directories processed',
+    'directories_skipped': 'Directories skipped as unchanged since the last incremental run',
+    'duplicates': 'Files skipped because another file maps to the same name',
+    'entries_filtered': 'Directory entries rejected by the name filter',
+    'entries_scanned': 'Directory entries listed',
+    'files_scanned': 'Files considered for renaming',
+    'links_rewritten': 'Links rewritten to follow renamed notes',
+    'notes_indexed': 'Notes read to refresh the link index',
+    'notes_rewritten': 'Notes whose links were rewritten',
+    'parse_hits': 'Filenames with a date',
+    'parse_misses': 'Filenames without a date',
+    'path_groups': 'Directory groups formed from a path list',
+    'paths_read': 'Paths read from a path list',
+    'rename_errors': 'Rename calls that failed',
+    'renames': 'Rename calls that succeeded',
+    'renames_skipped': 'Renames skipped because the source or target changed since planning',
+    'shards_claimed': 'Work items claimed from the coordination directory',
+    'shards_reclaimed': 'Work items taken over from an expired lease',
+    'throttle_backoffs': 'Times the I/O throttle lowered its rate',
+    'unchanged': 'Dated files already in the target format',
+}
+
+
+def date_format(date_str: str, formatted: str) -> str:
+    """
+    Name the _parse_numeric_date branch that produced a result.
+
+    Args:
+        date_str: Digit run that was parsed
+        formatted: Resulting YYYY-MM-DD date
+
+    Returns:
+        Format name such as 'M/DD' or 'MMDD'
+    """
+    length = len(date_str)
+    if length == 2:
+        return 'MD'
+    if length == 3:
+        return 'M/DD' if formatted[5:7] == '0' + date_str[0] else 'MMD'
+    if length == 4:
+        return 'MMDD' if formatted[5:7] == date_str[:2] else 'MDYY'
+    return 'MMDYY' if formatted[5:7] == date_str[:2] else 'MDDYY'
+
+
+def _finite(value: Optional[float]) -> Optional[float]:
+    """
+    None for values JSON cannot represent (an open-ended top bucket).
+    """
+    return None if value is None or value == float('inf') else value
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket histogram of durations in seconds.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        """
+        Args:
+            buckets: Sorted upper bounds of the buckets; larger values go to +Inf
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """
+        Record one duration.
+
+        Args:
+            seconds: Duration to record
+        """
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        """
+        Yield (upper bound, count of values at or below it), ending with +Inf.
+        """
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield ('+Inf' if bound == float('inf') else repr(bound)), total
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Upper bound of the bucket holding the q-quantile, None if empty.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class RunStats:
+    """
+    Timers and counters of one run, safe to share between worker threads.
+
+    Counters used by the retitler:
+        directories, directories_skipped, entries_scanned, entries_filtered, files_scanned,
+        parse_hits, parse_misses, unchanged, candidates, duplicates,
+        collisions, renames, rename_errors, renames_skipped, bytes_logged,
+        throttle_backoffs, notes_indexed, notes_rewritten, links_rewritten,
+        archives, archive_renames, shards_claimed, shards_reclaimed
+
+    Besides PHASES, throttled runs add a 'throttle_wait' timer: the time
+    operations spent waiting for admission, summed over all threads, and
+    runs with --update-links a 'links' timer, archive runs an 'archives' timer.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.phases = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.format_hits = defaultdict(int)
+        self.rename_latency = LatencyHistogram()
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Add the time spent in the with-block to a phase timer.
+
+        Phase timers are summed over all worker threads, so with concurrent
+        directories they can add up to more than the wall-clock time.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """
+        Add seconds to a phase timer.
+        """
+        with self._lock:
+            self.phases[name] += seconds
+
+    def add(self, counts: Optional[Dict[str, int]] = None, **more: int) -> None:
+        """
+        Add to counters, e.g. stats.add(files_scanned=120, parse_hits=80).
+        """
+        with self._lock:
+            for counter_set in (counts or {}, more):
+                for name, value in counter_set.items():
+                    self.counters[name] += value
+
+    def add_formats(self, format_hits: Dict[str, int]) -> None:
+        """
+        Add parse hits counted per date format.
+        """
+        with self._lock:
+            for name, value in format_hits.items():
+                self.format_hits[name] += value
+
+    def observe_rename(self, seconds: float, ok: bool = True) -> None:
+        """
+        Record the latency of one rename call.
+        """
+        with self._lock:
+            self.rename_latency.observe(seconds)
+            self.counters['renames' if ok else 'rename_errors'] += 1
+
+    def to_dict(self) -> dict:
+        """
+        Stats as a JSON-serialisable dictionary.
+        """
+        with self._lock:
+            ordered = [phase for phase in PHASES if phase in self.phases]
+            ordered += sorted(set(self.phases) - set(PHASES))
+            latency = self.rename_latency
+            files = self.counters.get('files_scanned', 0)
+            total = self.phases.get('total', 0.0)
+            return {
+                'started': self.started,
+                'phases_seconds': {phase: round(self.phases[phase], 6) for phase in ordered},
+                'counters': dict(sorted(self.counters.items())),
+                'parse_hits_by_format': dict(sorted(self.format_hits.items())),
+                'files_per_second': round(files / total, 1) if total else None,
+                'rename_latency_seconds': {
+                    'count': latency.count,
+                    'sum': round(latency.sum, 6),
+                    'p50': _finite(latency.quantile(0.5)),
+                    'p99': _finite(latency.quantile(0.99)),
+                    'buckets': dict(latency.cumulative()),
+                },
+            }
+
+    def write_json(self, stats_file: str) -> None:
+        """
+        Write the stats as JSON.
+        """
+        with open(stats_file, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write('\n')
+
+    def prometheus_text(self) -> str:
+        """
+        Stats in the Prometheus text exposition format.
+
+        Values describe the last run, so counters are exported as gauges.
+        """
+        stats = self.to_dict()
+        prefix = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {prefix}_last_run_timestamp_seconds Start time of the last run.",
+            f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+            f"{prefix}_last_run_timestamp_seconds {stats['started']:.3f}",
+            f"# HELP {prefix}_phase_seconds Time spent per phase in the last run.",
+            f"# TYPE {prefix}_phase_seconds gauge",
+        ]
+        for phase, seconds in stats['phases_seconds'].items():
+            lines.append(f'{prefix}_phase_seconds{{phase="{phase}"}} {seconds}')
+        for name, value in stats['counters'].items():
+            description = COUNTER_HELP.get(name, name.replace('_', ' ').capitalize())
+            lines.append(f"# HELP {prefix}_{name} {description} in the last run.")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+        lines.append(f"# HELP {prefix}_parse_hits_by_format Dates found per format in the last run.")
+        lines.append(f"# TYPE {prefix}_parse_hits_by_format gauge")
+        for name, value in stats['parse_hits_by_format'].items():
+            lines.append(f'{prefix}_parse_hits_by_format{{format="{name}"}} {value}')
+
+        latency = stats['rename_latency_seconds']
+        lines.append(f"# HELP {prefix}_rename_latency_seconds Rename call latency in the last run.")
+        lines.append(f"# TYPE {prefix}_rename_latency_seconds histogram")
+        for bound, count in latency['buckets'].items():
+            lines.append(f'{prefix}_rename_latency_seconds_bucket{{le="{bound}"}} {count}')
+        lines.append(f"{prefix}_rename_latency_seconds_sum {latency['sum']}")
+        lines.append(f"{prefix}_rename_latency_seconds_count {latency['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, prom_file: str) -> None:
+        """
+        Write a Prometheus textfile atomically, so the collector never reads half a file.
+        """
+        temp_file = f"{prom_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_file, prom_file)
@@ -10,47 +10,186 @@ All dates are assumed to be from 2025.
 
 import os
 import re
+import stat
+import time
+import atexit
 import logging
 from pathlib import Path
-from typing import List, Optional, Tuple
-from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+from itertools import chain, islice
 
+# Imported where they are used, so the command line only loads what a run needs
+if TYPE_CHECKING:
+    from .fs import LocalFilesystem
+    from .state_cache import StateCache
+    from .planner import RenamePlan
+    from .metrics import RunStats
+    from .filters import NameFilter
 
-def setup_logging(log_file: str) -> logging.Logger:
+
+# Number of directory entries buffered ahead of processing so the CLI can show
+# a file count before renaming starts. Larger directories report an estimate.
+FILE_COUNT_LOOKAHEAD = 10000
+
+# Log records allowed to wait for the writer thread when logging is bounded
+LOG_QUEUE_LIMIT = 10000
+
+# Files per shard when a directory is parsed on a process pool; directories
+# with fewer files are parsed in-process without starting the pool
+SHARD_SIZE = 50000
+
+
+# Log level for run summaries, between INFO and WARNING so that the
+# "summary" verbosity keeps them while dropping per-rename lines
+SUMMARY = 25
+logging.addLevelName(SUMMARY, 'SUMMARY')
+
+VERBOSITY_LEVELS = {
+    'debug': logging.DEBUG,      # every file, including skipped ones
+    'info': logging.INFO,        # renames, warnings and the summary
+    'summary': SUMMARY,          # warnings, errors and the summary only
+}
+
+LOG_FORMATS = ('text', 'jsonl')
+
+# Background thread writing queued log records to the real handlers
+_log_listener = None
+
+
+class JsonLineFormatter(logging.Formatter):
+    """
+    Format log records as one JSON object per line.
+    """
+    
+    def format(self, record: logging.LogRecord) -> str:
+        import json
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class _ConsoleFilter(logging.Filter):
+    """
+    Drop records marked with ``extra={'console': False}`` from console output.
     """
-    Configure logging to both file and console.
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        return getattr(record, 'console', True)
+
+
+def _deferred_queue_handler(log_queue) -> logging.Handler:
+    """
+    Create a queue handler that leaves message formatting to the listener thread.
+    
+    The standard QueueHandler merges the message and its arguments in the
+    calling thread; here the record is queued as-is, so the hot loop only
+    pays for creating the record.
+    """
+    from logging.handlers import QueueHandler
+    
+    class _DeferredQueueHandler(QueueHandler):
+        def enqueue(self, record: logging.LogRecord) -> None:
+            # Blocks while a bounded queue is full instead of dropping the record
+            self.queue.put(record)
+        
+        def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+            if record.exc_info:
+                # Tracebacks cannot be formatted once the frame is gone
+                return super().prepare(record)
+            return record
+    
+    return _DeferredQueueHandler(log_queue)
+
+
+def setup_logging(log_file: Optional[str] = None, verbosity: str = 'info',
+                  log_format: str = 'text', max_queued: Optional[int] = None) -> logging.Logger:
+    """
+    Configure logging to the console and optionally to a file.
+    
+    Records are handed to a queue and formatted and written by a background
+    thread, so the processing loop never waits for terminal or disk I/O.
+    Call flush_logging before printing directly to the console and
+    shutdown_logging when the run is finished.
     
     Args:
-        log_file: Path to the log file
+        log_file: Path to the log file, or None for console output only
+        verbosity: One of VERBOSITY_LEVELS ('debug', 'info', 'summary')
+        log_format: Log file format, 'text' or 'jsonl' (console output is
+            always text)
+        max_queued: Maximum number of records waiting for the writer; the
+            logging call blocks while the queue is full (default: unbounded)
         
     Returns:
         Configured logger instance
     """
+    global _log_listener
+    import queue
+    from logging.handlers import QueueListener
+    shutdown_logging()
+    
+    level = VERBOSITY_LEVELS.get(verbosity, logging.INFO)
     logger = logging.getLogger('note_retitler')
-    logger.setLevel(logging.INFO)
+    logger.setLevel(level)
     
     # Clear any existing handlers
     logger.handlers.clear()
     
-    # File handler
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(logging.INFO)
+    # Formatter
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     
     # Console handler
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    
-    # Formatter
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
+    console_handler.setLevel(level)
     console_handler.setFormatter(formatter)
+    console_handler.addFilter(_ConsoleFilter())
+    handlers = [console_handler]
+    
+    # File handler
+    if log_file:
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setLevel(level)
+        file_handler.setFormatter(JsonLineFormatter() if log_format == 'jsonl' else formatter)
+        handlers.append(file_handler)
     
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    # Hand records to the background writer
+    log_queue = queue.Queue(max_queued) if max_queued else queue.SimpleQueue()
+    logger.addHandler(_deferred_queue_handler(log_queue))
+    _log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
     
     return logger
 
 
+def flush_logging() -> None:
+    """
+    Wait until every queued log record has been written.
+    """
+    if _log_listener is not None and _log_listener._thread is not None:
+        _log_listener.stop()
+        _log_listener.start()
+
+
+def shutdown_logging() -> None:
+    """
+    Write all queued log records and stop the background writer.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        if _log_listener._thread is not None:
+            _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+
+atexit.register(shutdown_logging)
+
+
 def _parse_numeric_date(date_str: str) -> Optional[Tuple[str, str]]:
     """
     Helper function to parse a numeric date string.
@@ -124,6 +263,144 @@ def _parse_numeric_date(date_str: str) -> Optional[Tuple[str, str]]:
     return None
 
 
+# Lookup table mapping every 2-5 digit string that forms a valid date to its
+# (original_date_part, formatted_date) result. There are only 111,100 such
+# strings, so the table is built once on first use from _parse_numeric_date,
+# which stays the reference implementation for the date rules.
+_DATE_TABLE: Optional[Dict[str, Tuple[str, str]]] = None
+
+# Results for the digit runs seen so far, used until the full table is built.
+# Short runs (editor hooks renaming a file or two) only parse what they see
+# instead of paying for the whole table at startup.
+_DATE_MEMO: Dict[str, Optional[Tuple[str, str]]] = {}
+
+
+def _iter_digit_strings() -> Iterator[str]:
+    """
+    Yield every possible 2-5 digit string, including leading zeros.
+    
+    Returns:
+        Iterator over all candidate digit strings
+    """
+    for length in range(2, 6):
+        for value in range(10 ** length):
+            yield f"{value:0{length}d}"
+
+
+def _build_date_table() -> Dict[str, Tuple[str, str]]:
+    """
+    Build the digit string -> parsed date lookup table.
+    
+    Only strings that parse to a valid date are stored; a missing key
+    means the reference parser returns None for that string.
+    
+    Returns:
+        Dictionary of digit string to (original_date_part, formatted_date)
+    """
+    table = {}
+    for date_str in _iter_digit_strings():
+        result = _parse_numeric_date(date_str)
+        if result is not None:
+            table[date_str] = result
+    return table
+
+
+def _get_date_table() -> Dict[str, Tuple[str, str]]:
+    """
+    Return the date lookup table, building it on first use.
+    
+    Returns:
+        The shared lookup table
+    """
+    global _DATE_TABLE
+    if _DATE_TABLE is None:
+        _DATE_TABLE = _build_date_table()
+    return _DATE_TABLE
+
+
+def _lookup_numeric_date(date_str: str) -> Optional[Tuple[str, str]]:
+    """
+    Resolve a numeric date string with a single dictionary lookup.
+    
+    Uses the full lookup table once something built it (batch parsing,
+    benchmarks), and otherwise memoizes the reference parser per digit run.
+    Non-ASCII digit runs (``\\d`` also matches other Unicode digits) are
+    not in the table and go through the memo as well.
+    
+    Args:
+        date_str: Numeric string to parse as date
+        
+    Returns:
+        Tuple of (original_date_part, formatted_date) or None if invalid
+    """
+    table = _DATE_TABLE
+    if table is not None and date_str.isascii():
+        return table.get(date_str)
+    try:
+        return _DATE_MEMO[date_str]
+    except KeyError:
+        result = _DATE_MEMO[date_str] = _parse_numeric_date(date_str)
+        return result
+
+
+def verify_date_table() -> int:
+    """
+    Check the lookup table against _parse_numeric_date for every possible input.
+    
+    Builds the table if nothing has yet, so the table used by batch parsing,
+    the server and the benchmarks is what gets checked, not the memo.
+    
+    Returns:
+        Number of digit strings checked
+        
+    Raises:
+        AssertionError: If the table disagrees with the reference parser
+    """
+    table = _get_date_table()
+    checked = 0
+    for date_str in _iter_digit_strings():
+        expected = _parse_numeric_date(date_str)
+        actual = table.get(date_str)
+        if actual != expected:
+            raise AssertionError(
+                f"Date table mismatch for {date_str!r}: expected {expected}, got {actual}"
+            )
+        checked += 1
+    return checked
+
+
+# Numeric sequences that could be dates, compiled on first use
+_DIGIT_RUN = None
+
+
+def _digit_run_pattern() -> 're.Pattern':
+    """
+    Return the digit-run pattern, compiling it on first use.
+    """
+    global _DIGIT_RUN
+    if _DIGIT_RUN is None:
+        _DIGIT_RUN = re.compile(r'(\d{2,5})')
+    return _DIGIT_RUN
+
+
+def _filename_stem(filename: str) -> str:
+    """
+    Same result as Path(filename).stem, without building a Path for plain names.
+    
+    Args:
+        filename: Filename, possibly with directory components
+        
+    Returns:
+        Final path component without its suffix
+    """
+    if filename == '.' or '/' in filename or os.sep in filename or (os.altsep and os.altsep in filename):
+        return Path(filename).stem
+    dot = filename.rfind('.')
+    if 0 < dot < len(filename) - 1:
+        return filename[:dot]
+    return filename
+
+
 def parse_date_from_filename(filename: str) -> Optional[Tuple[str, str]]:
     """
     Extract and parse date from filename, converting to YYYY-MM-DD format.
@@ -140,21 +417,21 @@ def parse_date_from_filename(filename: str) -> Optional[Tuple[str, str]]:
         Tuple of (original_date_part, formatted_date) or None if no date found
     """
     # Get filename without extension for pure numeric check
-    name_without_ext = Path(filename).stem
+    name_without_ext = _filename_stem(filename)
     
     # Check if filename (without extension) is purely numeric - this handles cases like "714.txt" from "7/14"
     if name_without_ext.isdigit():
         date_str = name_without_ext
         # Try to parse this as a date
-        result = _parse_numeric_date(date_str)
+        result = _lookup_numeric_date(date_str)
         if result:
             return result
     
     # Extract numeric sequences that could be dates
-    date_patterns = re.findall(r'(\d{2,5})', filename)
+    date_patterns = (_DIGIT_RUN or _digit_run_pattern()).findall(filename)
     
     for date_str in date_patterns:
-        result = _parse_numeric_date(date_str)
+        result = _lookup_numeric_date(date_str)
         if result:
             return result
     
@@ -178,75 +455,543 @@ def generate_new_filename(original_filename: str, old_date: str, new_date: str)
     return new_filename
 
 
-def process_directory(directory_path: Path, logger: logging.Logger) -> List[Tuple[str, str]]:
+def scan_directory(directory_path: Path) -> Iterator[os.DirEntry]:
     """
-    Process all files in the given directory and rename those with date patterns.
+    Stream the entries of a directory with a single os.scandir pass.
+    
+    All entries are yielded, not only files, because the rename planner
+    needs every name in the directory to detect collisions. Use _is_file to
+    pick out the files; it relies on the cached DirEntry type information,
+    so most filesystems need no extra stat call per entry.
     
     Args:
-        directory_path: Path to the directory to process
+        directory_path: Path to the directory to scan
+        
+    Returns:
+        Iterator of DirEntry objects
+    """
+    with os.scandir(directory_path) as entries:
+        yield from entries
+
+
+def _is_file(entry: os.DirEntry) -> bool:
+    """
+    Check whether a directory entry is a regular file (following symlinks).
+    
+    Args:
+        entry: Entry from scan_directory
+        
+    Returns:
+        True for files, False for anything else or entries that vanished
+    """
+    try:
+        return entry.is_file()
+    except OSError:
+        return False
+
+
+def count_ahead(entries: Iterator[os.DirEntry],
+                limit: int = FILE_COUNT_LOOKAHEAD) -> Tuple[int, bool, Iterator[os.DirEntry]]:
+    """
+    Count the files of a scan by buffering at most ``limit`` entries.
+    
+    The returned iterator replays the buffered entries and then continues
+    the same scan, so the directory is only walked once.
+    
+    Args:
+        entries: Iterator produced by scan_directory
+        limit: Maximum number of entries to buffer
+        
+    Returns:
+        Tuple of (file_count, exact, entries) where ``exact`` is False when
+        the directory holds more than ``limit`` entries and ``file_count`` is
+        a lower bound
+    """
+    buffered = list(islice(entries, limit + 1))
+    exact = len(buffered) <= limit
+    file_count = sum(1 for entry in buffered[:limit] if _is_file(entry))
+    return file_count, exact, chain(buffered, entries)
+
+
+def _parse_shard(filenames: List[str], with_formats: bool = False) -> tuple:
+    """
+    Parse one shard of a directory's files (runs in a worker process).
+    
+    Only the names travel to the worker and only the new names travel back,
+    which keeps the pickling done by the scanning process small.
+    
+    Args:
+        filenames: Filenames in scan order
+        with_formats: Also count parse hits by date format
+        
+    Returns:
+        Tuple of (new names, parse misses, unchanged count, format hits)
+        where new names holds, for each filename, its new name or None when
+        it needs no rename
+    """
+    if with_formats:
+        from .metrics import date_format
+    new_names = []
+    append = new_names.append
+    parse_misses = 0
+    unchanged = 0
+    format_hits = {}
+    for filename in filenames:
+        date_result = parse_date_from_filename(filename)
+        if date_result is None:
+            parse_misses += 1
+            append(None)
+            continue
+        old_date, new_date = date_result
+        if with_formats:
+            branch = date_format(old_date, new_date)
+            format_hits[branch] = format_hits.get(branch, 0) + 1
+        new_filename = generate_new_filename(filename, old_date, new_date)
+        if new_filename == filename:
+            unchanged += 1
+            append(None)
+            continue
+        append(new_filename)
+    return new_names, parse_misses, unchanged, format_hits
+
+
+def _iter_shard_results(shards: Iterator[Tuple[List[str], List[int]]], workers: int,
+                        with_formats: bool) -> Iterator[tuple]:
+    """
+    Parse shards on a process pool, yielding results in shard order.
+    
+    The first shard is parsed in-process if it turns out to be the only
+    one; the pool is started once a second shard shows the directory is
+    large, and at most two shards per worker are in flight so the scan is
+    never read far ahead.
+    
+    Yields:
+        Tuples of (filenames, inodes, _parse_shard result)
+    """
+    first = next(shards, None)
+    if first is None:
+        return
+    second = next(shards, None)
+    if second is None:
+        yield first + (_parse_shard(first[0], with_formats),)
+        return
+    
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque((shard, executor.submit(_parse_shard, shard[0], with_formats))
+                          for shard in (first, second))
+        for shard in shards:
+            in_flight.append((shard, executor.submit(_parse_shard, shard[0], with_formats)))
+            if len(in_flight) >= workers * 2:
+                shard, future = in_flight.popleft()
+                yield shard + (future.result(),)
+        while in_flight:
+            shard, future = in_flight.popleft()
+            yield shard + (future.result(),)
+
+
+class _TimedIterator:
+    """
+    Iterator wrapper adding the time spent in next() to ``elapsed``.
+    """
+
+    __slots__ = ('_iterator', 'elapsed')
+
+    def __init__(self, iterable: Iterable):
+        self._iterator = iter(iterable)
+        self.elapsed = 0.0
+
+    def __iter__(self) -> '_TimedIterator':
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+
+def plan_directory(directory_path: Path, logger: logging.Logger,
+                   entries: Optional[Iterable[os.DirEntry]] = None,
+                   state_cache: 'Optional[StateCache]' = None,
+                   stats: 'Optional[RunStats]' = None,
+                   name_filter: 'Optional[NameFilter]' = None,
+                   parse_workers: Optional[int] = None) -> 'Optional[RenamePlan]':
+    """
+    Scan a directory and plan its renames without touching any file.
+    
+    The directory is scanned once into an in-memory index of its names and
+    all rename targets are resolved against that index.
+    
+    With ``parse_workers`` above 1, a directory of more than SHARD_SIZE files
+    is split into shards of consecutive files that are parsed on a process
+    pool while the scan goes on. Shard results are merged back in scan order
+    and planned in one step against the whole index, so targets shared by
+    names from different shards are still caught and the plan is identical
+    to an in-process run.
+    
+    With a state cache, a directory unchanged since the last run is not
+    scanned at all, and in a changed directory only names the last run did
+    not settle are parsed again.
+    
+    Names rejected by the name filter stay in the index (they can still
+    block a rename) but are never stat'ed, parsed or renamed.
+    
+    Args:
+        directory_path: Path to the directory to plan
         logger: Logger instance for output
+        entries: Optional entries from an ongoing scan_directory pass;
+            the directory is scanned here when omitted
+        state_cache: Optional StateCache for incremental runs
+        stats: Optional RunStats collecting timers and counters
+        name_filter: Names to consider (default: default_name_filter())
+        parse_workers: Worker processes for parsing large directories
+            (None or 1 parses in this process, -1 uses one per CPU)
         
     Returns:
-        List of tuples containing (old_filename, new_filename) for renamed files
+        RenamePlan for the directory, or None if it cannot be processed
     """
-    renamed_files = []
+    from .planner import RenamePlan, plan_renames, log_plan_issues
+    from .filters import default_name_filter
+    if state_cache is not None:
+        from .state_cache import DirectoryState, name_hash
+    if stats is not None:
+        from .metrics import date_format
     
+    started = time.perf_counter()
     if not directory_path.exists():
-        logger.error(f"Directory does not exist: {directory_path}")
-        return renamed_files
+        logger.error("Directory does not exist: %s", directory_path)
+        return None
     
     if not directory_path.is_dir():
-        logger.error(f"Path is not a directory: {directory_path}")
-        return renamed_files
+        logger.error("Path is not a directory: %s", directory_path)
+        return None
+    
+    # Taken before scanning, so any change during or after the scan is seen
+    # as a stale plan when it is applied
+    mtime_ns = directory_path.stat().st_mtime_ns
+    directory = os.path.abspath(directory_path)
+    if stats is not None:
+        stats.add_time('stat', time.perf_counter() - started)
+        stats.add(directories=1)
+    
+    # Incremental mode: skip directories unchanged since the last run with the same filter
+    name_filter = name_filter or default_name_filter()
+    state = state_cache.lookup(directory, name_filter.digest) if state_cache is not None else None
+    if state is not None and state.is_current(mtime_ns):
+        logger.info("Unchanged since last run, skipping: %s", directory_path)
+        if stats is not None:
+            stats.add(directories_skipped=1)
+        return RenamePlan([], [], {}, [], {}, directory=directory, mtime_ns=mtime_ns)
+    settled = state.settled if state is not None else ()
+    
+    logger.info("Processing directory: %s", directory_path)
+    
+    # Stream the directory listing straight into parsing
+    if entries is None:
+        entries = scan_directory(directory_path)
+    if stats is not None:
+        # Time spent waiting for entries is the scan, the rest of the loop is parsing
+        entries = timed_entries = _TimedIterator(entries)
+        started = time.perf_counter()
+    
+    # Index of every name in the directory, used for collision checks
+    names = set()
+    candidates = []
+    file_count = 0
+    filtered = 0
+    parse_misses = 0
+    unchanged = 0
+    format_hits = {}
     
-    logger.info(f"Processing directory: {directory_path}")
+    # Files needing no rename, and the name-set fingerprint, for the state cache
+    new_settled = []
+    fingerprint = 0
     
-    # Get all files in the directory
-    files = [f for f in directory_path.iterdir() if f.is_file()]
-    logger.info(f"Found {len(files)} files to process")
+    # Per-file detail is only logged at debug verbosity; checking the level
+    # once keeps the loop free of logging calls otherwise
+    debug = logger.isEnabledFor(logging.DEBUG)
+    accepts = name_filter.match
+    if parse_workers is not None and parse_workers < 0:
+        parse_workers = os.cpu_count() or 1
     
-    for file_path in files:
-        filename = file_path.name
-        logger.info(f"Processing file: {filename}")
+    if parse_workers is not None and parse_workers > 1:
+        # Scan and filter here, parse the shards in worker processes
+        shard_count = 0
+        
+        def shards() -> Iterator[Tuple[List[str], List[int]]]:
+            nonlocal fingerprint, filtered, file_count, shard_count
+            filenames, inodes = [], []
+            for entry in entries:
+                filename = entry.name
+                names.add(filename)
+                if state_cache is not None:
+                    fingerprint ^= name_hash(filename)
+                if accepts(filename) is None:
+                    filtered += 1
+                    continue
+                if not _is_file(entry):
+                    continue
+                file_count += 1
+                if filename in settled:
+                    new_settled.append(filename)
+                    continue
+                filenames.append(filename)
+                inodes.append(entry.inode())
+                if len(filenames) >= SHARD_SIZE:
+                    shard_count += 1
+                    yield filenames, inodes
+                    filenames, inodes = [], []
+            if filenames:
+                shard_count += 1
+                yield filenames, inodes
+        
+        for filenames, inodes, result in _iter_shard_results(shards(), parse_workers, stats is not None):
+            new_names, misses, same, hits = result
+            for filename, new_filename, inode in zip(filenames, new_names, inodes):
+                if new_filename is None:
+                    new_settled.append(filename)
+                else:
+                    candidates.append((filename, new_filename, inode))
+            parse_misses += misses
+            unchanged += same
+            for branch, count in hits.items():
+                format_hits[branch] = format_hits.get(branch, 0) + count
+        if shard_count > 1:
+            logger.info("Parsed %d shards on %d worker processes", shard_count, parse_workers)
+        entries = ()
+    
+    for entry in entries:
+        filename = entry.name
+        names.add(filename)
+        if state_cache is not None:
+            fingerprint ^= name_hash(filename)
+        # Checked on the bare name, before the entry costs a stat or a parse
+        if accepts(filename) is None:
+            filtered += 1
+            continue
+        if not _is_file(entry):
+            continue
+        file_count += 1
+        
+        # Settled by an earlier run: the name alone decides the outcome
+        if filename in settled:
+            new_settled.append(filename)
+            continue
+        
+        if debug:
+            logger.debug("Processing file: %s", filename)
         
         # Parse date from filename
         date_result = parse_date_from_filename(filename)
         
         if date_result is None:
-            logger.info(f"No date pattern found in: {filename}")
+            if debug:
+                logger.debug("No date pattern found in: %s", filename)
+            parse_misses += 1
+            new_settled.append(filename)
             continue
         
         old_date, new_date = date_result
+        if stats is not None:
+            branch = date_format(old_date, new_date)
+            format_hits[branch] = format_hits.get(branch, 0) + 1
         new_filename = generate_new_filename(filename, old_date, new_date)
         
         if new_filename == filename:
-            logger.info(f"No change needed for: {filename}")
+            if debug:
+                logger.debug("No change needed for: %s", filename)
+            unchanged += 1
+            new_settled.append(filename)
             continue
         
-        # Check if target filename already exists
-        new_file_path = directory_path / new_filename
-        if new_file_path.exists():
-            logger.warning(f"Target filename already exists, skipping: {new_filename}")
-            continue
+        candidates.append((filename, new_filename, entry.inode()))
+    
+    logger.info("Processed %d files", file_count)
+    if stats is not None:
+        stats.add_time('scan', timed_entries.elapsed)
+        stats.add_time('parse', time.perf_counter() - started - timed_entries.elapsed)
+        stats.add(entries_scanned=len(names), entries_filtered=filtered, files_scanned=file_count,
+                  parse_hits=sum(format_hits.values()), parse_misses=parse_misses,
+                  unchanged=unchanged, candidates=len(candidates))
+        stats.add_formats(format_hits)
+        started = time.perf_counter()
+    
+    # Same names as last time: the outcome cannot differ, so nothing to plan
+    if state is not None and fingerprint == state.fingerprint:
+        state_cache.store(directory, mtime_ns, fingerprint, new_settled, name_filter.digest)
+        return RenamePlan([], [], {}, [], {}, directory=directory, mtime_ns=mtime_ns)
+    
+    # Resolve all targets against the name index
+    plan = plan_renames(names, candidates, directory)
+    plan.directory = directory
+    plan.mtime_ns = mtime_ns
+    log_plan_issues(plan, logger)
+    if stats is not None:
+        stats.add_time('plan', time.perf_counter() - started)
+        stats.add(duplicates=sum(len(sources) - 1 for sources in plan.duplicates.values()),
+                  collisions=len(plan.collisions))
+    
+    if state_cache is not None:
+        # Completed by process_directory once the renames have run
+        plan.state = DirectoryState(mtime_ns, fingerprint, new_settled, options=name_filter.digest)
+    
+    return plan
+
+
+def process_directory(directory_path: Path, logger: logging.Logger,
+                      entries: Optional[Iterable[os.DirEntry]] = None,
+                      filesystem: 'Optional[LocalFilesystem]' = None,
+                      rename_workers: int = 1, journal=None,
+                      state_cache: 'Optional[StateCache]' = None,
+                      stats: 'Optional[RunStats]' = None,
+                      name_filter: 'Optional[NameFilter]' = None,
+                      parse_workers: Optional[int] = None) -> List[Tuple[str, str]]:
+    """
+    Process all files in the given directory and rename those with date patterns.
+    
+    Renames are planned against an in-memory index of the directory's names
+    (see plan_directory) and then run in an order where none overwrites a file.
+    
+    Args:
+        directory_path: Path to the directory to process
+        logger: Logger instance for output
+        entries: Optional entries from an ongoing scan_directory pass;
+            the directory is scanned here when omitted
+        filesystem: Filesystem the renames go through (default: local)
+        rename_workers: Number of independent renames run concurrently
+        journal: Optional RenameJournal recording intended and completed renames
+        state_cache: Optional StateCache for incremental runs
+        stats: Optional RunStats collecting timers and counters
+        name_filter: Names to consider (default: default_name_filter())
+        parse_workers: Worker processes for parsing large directories (see plan_directory)
         
-        try:
-            # Rename the file
-            file_path.rename(new_file_path)
-            logger.info(f"Renamed: {filename} -> {new_filename}")
-            renamed_files.append((filename, new_filename))
-            
-        except OSError as e:
-            logger.error(f"Failed to rename {filename}: {e}")
+    Returns:
+        List of tuples containing (old_filename, new_filename) for renamed files
+    """
+    from .planner import execute_plan
+    
+    plan = plan_directory(directory_path, logger, entries=entries, state_cache=state_cache,
+                          stats=stats, name_filter=name_filter, parse_workers=parse_workers)
+    if plan is None:
+        return []
+    
+    renamed_files = execute_plan(plan, logger, filesystem=filesystem,
+                                 rename_workers=rename_workers, journal=journal, stats=stats)
+    
+    if plan.state is not None:
+        from .state_cache import name_hash
+        if len(renamed_files) == len(plan.renames):
+            # Record the directory as it is after the renames
+            fingerprint = plan.state.fingerprint
+            for old_name, new_name in renamed_files:
+                fingerprint ^= name_hash(old_name) ^ name_hash(new_name)
+            state_cache.store(plan.directory, os.stat(plan.directory).st_mtime_ns,
+                              fingerprint, list(plan.state.settled), plan.state.options)
+        else:
+            # Some renames failed; process the whole directory again next time
+            state_cache.forget(plan.directory)
     
     return renamed_files
 
 
+def plan_names(directory_path: Path, names: Iterable[str], logger: logging.Logger,
+               name_filter: 'Optional[NameFilter]' = None) -> 'RenamePlan':
+    """
+    Plan the renames of specific files in a directory without scanning it.
+    
+    Used when the changed names are already known (watch mode, path lists,
+    server requests). The name index holds the given files plus whichever
+    rename targets already exist, which costs one stat per file and one per
+    target instead of a full directory listing.
+    
+    Args:
+        directory_path: Directory containing the files
+        names: Filenames to consider (names that no longer exist are ignored)
+        logger: Logger instance for output
+        name_filter: Names to consider (default: default_name_filter())
+        
+    Returns:
+        RenamePlan for the given files
+    """
+    from .planner import plan_renames, log_plan_issues
+    from .filters import default_name_filter
+    
+    directory = os.path.abspath(directory_path)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    accepts = (name_filter or default_name_filter()).match
+    
+    index = set()
+    candidates = []
+    for filename in dict.fromkeys(names):
+        # Rejected names cannot be renamed, so they need no stat either
+        if accepts(filename) is None:
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        index.add(filename)
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        if debug:
+            logger.debug("Processing file: %s", filename)
+        
+        date_result = parse_date_from_filename(filename)
+        if date_result is None:
+            continue
+        new_filename = generate_new_filename(filename, *date_result)
+        if new_filename == filename:
+            continue
+        candidates.append((filename, new_filename, st.st_ino))
+    
+    # Targets outside the given names still block renames if they exist
+    for _, new_filename, _ in candidates:
+        if new_filename not in index and os.path.lexists(os.path.join(directory, new_filename)):
+            index.add(new_filename)
+    
+    plan = plan_renames(index, candidates, directory)
+    plan.directory = directory
+    log_plan_issues(plan, logger)
+    
+    return plan
+
+
+def process_names(directory_path: Path, names: Iterable[str], logger: logging.Logger,
+                  filesystem: 'Optional[LocalFilesystem]' = None, rename_workers: int = 1,
+                  journal=None, name_filter: 'Optional[NameFilter]' = None) -> List[Tuple[str, str]]:
+    """
+    Rename specific files of a directory without scanning the directory.
+    
+    Args:
+        directory_path: Directory containing the files
+        names: Filenames to consider
+        logger: Logger instance for output
+        filesystem: Filesystem the renames go through (default: local)
+        rename_workers: Number of independent renames run concurrently
+        journal: Optional RenameJournal recording intended and completed renames
+        name_filter: Names to consider (default: default_name_filter())
+        
+    Returns:
+        List of tuples containing (old_filename, new_filename) for renamed files
+    """
+    from .planner import execute_plan
+    
+    plan = plan_names(directory_path, names, logger, name_filter=name_filter)
+    return execute_plan(plan, logger, filesystem=filesystem, rename_workers=rename_workers,
+                        journal=journal)
+
+
 def main():
     """
     Main function to handle command line execution.
     This will be replaced by invoke tasks for CLI interface.
     """
     import sys
+    from datetime import datetime
     
     # Default to current directory if no path provided
     target_path = Path(sys.argv[1]) if len(sys.argv) > 1 else Path.cwd()
@@ -261,37 +1006,30 @@ def main():
         print("Log file will not be saved. Proceeding with console output only.")
         log_filename = None
     
-    # Setup logging
+    # Setup logging (console-only when no log file is saved)
+    logger = setup_logging(log_filename)
     if log_filename:
-        logger = setup_logging(log_filename)
-        logger.info(f"Log file will be saved as: {log_filename}")
-    else:
-        # Console-only logging
-        logger = logging.getLogger('note_retitler')
-        logger.setLevel(logging.INFO)
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        logger.info("Log file will be saved as: %s", log_filename)
     
     logger.info("Starting Note Retitler Script")
-    logger.info(f"Target directory: {target_path.absolute()}")
+    logger.info("Target directory: %s", target_path.absolute())
     
     # Process the directory
     renamed_files = process_directory(target_path, logger)
     
     # Summary
-    logger.info(f"Processing complete. Renamed {len(renamed_files)} files.")
+    logger.log(SUMMARY, "Processing complete. Renamed %d files.", len(renamed_files))
     
     if renamed_files:
-        logger.info("Summary of renamed files:")
+        logger.log(SUMMARY, "Summary of renamed files:")
         for old_name, new_name in renamed_files:
-            logger.info(f"  {old_name} -> {new_name}")
+            logger.log(SUMMARY, "  %s -> %s", old_name, new_name)
     
     if log_filename:
-        logger.info(f"Log saved to: {log_filename}")
+        logger.log(SUMMARY, "Log saved to: %s", log_filename)
+    
+    shutdown_logging()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
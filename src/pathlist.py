@@ -0,0 +1,177 @@
+"""
+Path-List Input
+
+Retitles files named in a list instead of enumerating directories, for
+pipelines such as `find -newer`, `fd` or an indexing database. The list is
+read from stdin or a file as a stream of newline- or NUL-delimited paths,
+grouped by parent directory on the fly, and every group goes through
+plan_names/execute_plan, the same parse, collision and rename logic that
+process_directory uses, with collisions checked against the targets on
+disk instead of a directory listing.
+
+Buffering is bounded: a directory's group is processed once it holds
+GROUP_SIZE names, and the oldest group is processed whenever MAX_BUFFERED
+names are waiting in total. Renames are recorded in a SpillList (see
+bounded.py), so a list of millions of lines runs in constant memory as it
+arrives. A directory that shows up again later in the list simply gets
+another group; a target taken by an earlier group is seen on disk.
+"""
+
+import os
+import time
+import logging
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .bounded import SpillList, DEFAULT_SPILL_THRESHOLD
+
+if TYPE_CHECKING:
+    from .fs import LocalFilesystem
+    from .metrics import RunStats
+    from .filters import NameFilter
+
+
+# Names of one directory processed together
+GROUP_SIZE = 1000
+
+# Names waiting for processing across all directories
+MAX_BUFFERED = 10000
+
+# Bytes read from the input at a time
+READ_SIZE = 1 << 16
+
+
+def read_paths(stream: BinaryIO, delimiter: bytes = b'\n') -> Iterator[str]:
+    """
+    Stream the paths of a newline- or NUL-delimited list.
+
+    Args:
+        stream: Binary stream (sys.stdin.buffer or a file opened 'rb')
+        delimiter: b'\\n' or b'\\0'
+
+    Yields:
+        Paths decoded like os.fsdecode does, empty entries skipped
+    """
+    pending = b''
+    while True:
+        data = stream.read1(READ_SIZE) if hasattr(stream, 'read1') else stream.read(READ_SIZE)
+        if not data:
+            break
+        pending += data
+        *complete, pending = pending.split(delimiter)
+        for raw in complete:
+            if raw:
+                yield os.fsdecode(raw)
+    if pending:
+        yield os.fsdecode(pending)
+
+
+def group_by_directory(paths: Iterable[str], group_size: int = GROUP_SIZE,
+                       max_buffered: int = MAX_BUFFERED) -> Iterator[Tuple[str, List[str]]]:
+    """
+    Group a stream of file paths by parent directory with bounded buffering.
+
+    Args:
+        paths: File paths; relative paths are resolved against the working directory
+        group_size: Names after which a directory's group is released
+        max_buffered: Names waiting in total after which the oldest group is released
+
+    Yields:
+        Tuples of (absolute directory, filenames in input order)
+    """
+    pending: Dict[str, List[str]] = {}
+    buffered = 0
+    for path in paths:
+        directory, name = os.path.split(os.path.abspath(path))
+        if not name:
+            continue
+        names = pending.get(directory)
+        if names is None:
+            names = pending[directory] = []
+        names.append(name)
+        buffered += 1
+        if len(names) >= group_size:
+            del pending[directory]
+            buffered -= len(names)
+            yield directory, names
+        elif buffered >= max_buffered:
+            # Dicts keep insertion order: release the directory waiting longest
+            oldest = next(iter(pending))
+            names = pending.pop(oldest)
+            buffered -= len(names)
+            yield oldest, names
+    for directory, names in pending.items():
+        yield directory, names
+
+
+class _CountedPaths:
+    """
+    Iterator over paths that counts them as they pass.
+    """
+
+    def __init__(self, paths: Iterable[str]):
+        self._paths = iter(paths)
+        self.count = 0
+
+    def __iter__(self) -> '_CountedPaths':
+        return self
+
+    def __next__(self) -> str:
+        path = next(self._paths)
+        self.count += 1
+        return path
+
+
+def process_path_list(paths: Iterable[str], logger: logging.Logger,
+                      filesystem: 'Optional[LocalFilesystem]' = None, rename_workers: int = 1,
+                      journal=None, name_filter: 'Optional[NameFilter]' = None,
+                      stats: 'Optional[RunStats]' = None, group_size: int = GROUP_SIZE,
+                      max_buffered: int = MAX_BUFFERED,
+                      spill_threshold: int = DEFAULT_SPILL_THRESHOLD) -> SpillList:
+    """
+    Retitle the files named in a stream of paths.
+
+    Args:
+        paths: File paths, e.g. from read_paths
+        logger: Logger instance for output
+        filesystem: Filesystem the renames go through (default: local)
+        rename_workers: Number of independent renames run concurrently
+        journal: Optional RenameJournal recording intended and completed renames
+        name_filter: Names to consider (default: default_name_filter())
+        stats: Optional RunStats collecting timers and counters
+        group_size: Names of one directory processed together
+        max_buffered: Names waiting in total before the oldest group is processed
+        spill_threshold: Renames kept in memory before the record spills to disk
+
+    Returns:
+        SpillList of (old_path, new_path) tuples, in rename order
+    """
+    from .note_retitler import plan_names
+    from .planner import execute_plan
+
+    record = SpillList(spill_threshold)
+    counted = _CountedPaths(paths)
+    groups = 0
+
+    for directory, names in group_by_directory(counted, group_size, max_buffered):
+        groups += 1
+        started = time.perf_counter()
+        try:
+            plan = plan_names(directory, names, logger, name_filter=name_filter)
+        except OSError as e:
+            logger.error("Failed to process directory %s: %s", directory, e)
+            continue
+        if stats is not None:
+            duplicates = sum(len(sources) - 1 for sources in plan.duplicates.values())
+            stats.add_time('plan', time.perf_counter() - started)
+            stats.add(candidates=len(plan.renames) + len(plan.collisions) + duplicates,
+                      duplicates=duplicates, collisions=len(plan.collisions))
+        renamed = execute_plan(plan, logger, filesystem=filesystem, rename_workers=rename_workers,
+                               journal=journal, stats=stats)
+        record.extend((os.path.join(directory, old_name), os.path.join(directory, new_name))
+                      for old_name, new_name in renamed)
+
+    logger.info("Read %d paths in %d directory groups", counted.count, groups)
+    if stats is not None:
+        stats.add(paths_read=counted.count, path_groups=groups)
+    return record
+
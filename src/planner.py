@@ -0,0 +1,478 @@
+"""
+Rename Planner
+
+Resolves all rename targets of one directory against an in-memory index of
+the names it contains, instead of checking each target on disk. The planner
+flags targets claimed by more than one file, drops renames whose target is
+taken by a file that stays in place, and orders rename chains (A -> B while
+B -> C) and cycles (A -> B while B -> A) so no rename ever overwrites a file.
+
+Plans can be saved as JSON Lines (gzip-compressed when the file name ends in
+.gz) and applied later; applying a plan does no parsing at all.
+"""
+
+import os
+import time
+import logging
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from .fs import LocalFilesystem, default_filesystem
+
+
+class RenameStep(NamedTuple):
+    """
+    One rename of a plan.
+
+    Attributes:
+        source: Current filename
+        destination: Filename to rename to
+        inode: Inode of the source when planned (0 for temporary names)
+    """
+    source: str
+    destination: str
+    inode: int
+
+
+class RenamePlan:
+    """
+    Ordered rename steps for a single directory.
+
+    Attributes:
+        directory: Directory the plan was made for
+        mtime_ns: Modification time of the directory when planned; if it is
+            unchanged when the plan is applied, the name index is still valid
+        renames: Logical (old_filename, new_filename) renames in scan order
+        chains: Groups of rename steps; steps inside a chain must run in
+            order, separate chains are independent of each other
+        duplicates: Target name -> sources that all map to it; the first
+            source keeps the target and the rest are skipped
+        collisions: (old_filename, new_filename) renames skipped because the
+            target is held by a file that is not renamed away
+        temp_names: Temporary name -> original filename for cycle breaking
+        state: Incremental-mode DirectoryState recorded after the renames run
+            (None unless a state cache is used; never saved with the plan)
+    """
+
+    __slots__ = ('directory', 'mtime_ns', 'renames', 'chains', 'duplicates',
+                 'collisions', 'temp_names', 'state')
+
+    def __init__(self, renames: List[Tuple[str, str]], chains: List[List[RenameStep]],
+                 duplicates: Dict[str, List[str]], collisions: List[Tuple[str, str]],
+                 temp_names: Dict[str, str], directory: str = '', mtime_ns: Optional[int] = None):
+        self.directory = directory
+        self.mtime_ns = mtime_ns
+        self.renames = renames
+        self.chains = chains
+        self.duplicates = duplicates
+        self.collisions = collisions
+        self.temp_names = temp_names
+        self.state = None
+
+
+def _temp_name(filename: str, occupied: Set[str], directory: Optional[str] = None,
+               key: Callable[[str], str] = str) -> str:
+    """
+    Pick a temporary name that is not used in the directory.
+
+    Args:
+        filename: Name of the file that needs to be parked
+        occupied: Index of names in the directory (updated in place)
+        directory: Directory checked on disk as well, since the index may
+            only cover part of it
+        key: Function mapping a name to its index key
+
+    Returns:
+        Unused hidden temporary filename
+    """
+    counter = 0
+    while True:
+        candidate = f".{filename}.retitle-{counter}.tmp"
+        if key(candidate) not in occupied and not (
+                directory is not None and os.path.lexists(os.path.join(directory, candidate))):
+            occupied.add(key(candidate))
+            return candidate
+        counter += 1
+
+
+def _case_insensitive(directory: str, names: Iterable[str]) -> bool:
+    """
+    Check whether a directory ignores case in names, as on macOS and Windows.
+
+    Looks up the first existing name containing letters with their case
+    swapped; on a case-insensitive filesystem that finds the same file.
+
+    Args:
+        directory: Directory to probe
+        names: Names of files in the directory
+
+    Returns:
+        True if the directory matches names case-insensitively
+    """
+    for name in names:
+        swapped = name.swapcase()
+        if swapped == name:
+            continue
+        try:
+            st = os.lstat(os.path.join(directory, name))
+            folded = os.lstat(os.path.join(directory, swapped))
+        except OSError:
+            return False
+        return (st.st_dev, st.st_ino) == (folded.st_dev, folded.st_ino)
+    return False
+
+
+def plan_renames(names: Iterable[str], candidates: Iterable[Tuple[str, str, int]],
+                 directory: Optional[str] = None) -> RenamePlan:
+    """
+    Resolve rename candidates against the names already in a directory.
+
+    With the directory given, temporary names are also checked on disk,
+    and on a case-insensitive filesystem names are compared with their case
+    folded, so a target differing from an existing name only in case
+    counts as taken.
+
+    Args:
+        names: Every name in the directory (files, subdirectories and others)
+        candidates: (old_filename, new_filename, inode) triples in scan order
+        directory: Directory the names are in, if the plan is for files on disk
+
+    Returns:
+        RenamePlan with safely ordered rename steps
+    """
+    candidates = list(candidates)
+    key = str
+    if directory is not None and _case_insensitive(directory, (source for source, _, _ in candidates)):
+        key = str.casefold
+    occupied = set(names) if key is str else {key(name) for name in names}
+
+    # Keep the first source for every target, flag the rest as duplicates
+    moves = {}
+    inodes = {}
+    source_for_target = {}
+    duplicates = {}
+    for source, target, inode in candidates:
+        target_key = key(target)
+        if target_key in source_for_target:
+            duplicates.setdefault(target, [source_for_target[target_key]]).append(source)
+            continue
+        source_for_target[target_key] = source
+        moves[source] = target
+        inodes[source] = inode
+
+    # Source vacating each name, by index key
+    moving = {key(source): source for source in moves}
+
+    def vacated_by(name: str) -> Optional[str]:
+        source = moving.get(key(name))
+        return source if source in moves else None
+
+    # Drop renames whose target is held by a name that stays put. Dropping a
+    # rename keeps its source in place, which can in turn block the rename
+    # that was waiting for that source to become free.
+    collisions = []
+    blocked = [source for source, target in moves.items()
+               if key(target) in occupied and vacated_by(target) is None]
+    while blocked:
+        source = blocked.pop()
+        if source not in moves:
+            continue
+        collisions.append((source, moves.pop(source)))
+        waiting = source_for_target.get(key(source))
+        if waiting is not None and waiting in moves:
+            blocked.append(waiting)
+
+    chains = []
+    temp_names = {}
+    ordered = set()
+
+    # Chains end in a free target: rename the head first, then whatever was
+    # waiting for the head's old name, and so on back along the chain
+    for source, target in moves.items():
+        if vacated_by(target) is not None:
+            continue
+        chain = [RenameStep(source, target, inodes[source])]
+        ordered.add(source)
+        waiting = source_for_target.get(key(source))
+        while waiting is not None and waiting in moves and waiting not in ordered:
+            chain.append(RenameStep(waiting, moves[waiting], inodes[waiting]))
+            ordered.add(waiting)
+            waiting = source_for_target.get(key(waiting))
+        chains.append(chain)
+
+    # Everything left forms cycles: park one file under a temporary name,
+    # rotate the rest of the cycle, then move the parked file into place
+    for source, target in moves.items():
+        if source in ordered:
+            continue
+        temp = _temp_name(source, occupied, directory, key)
+        temp_names[temp] = source
+        chain = [RenameStep(source, temp, inodes[source])]
+        ordered.add(source)
+        waiting = source_for_target[key(source)]
+        while waiting != source:
+            chain.append(RenameStep(waiting, moves[waiting], inodes[waiting]))
+            ordered.add(waiting)
+            waiting = source_for_target[key(waiting)]
+        chain.append(RenameStep(temp, target, 0))
+        chains.append(chain)
+
+    renames = list(moves.items())
+    return RenamePlan(renames, chains, duplicates, collisions, temp_names)
+
+
+def log_plan_issues(plan: RenamePlan, logger: logging.Logger) -> None:
+    """
+    Report duplicate-target groups and collisions found while planning.
+
+    Args:
+        plan: Plan to report on
+        logger: Logger instance for output
+    """
+    for target, sources in plan.duplicates.items():
+        logger.warning("Multiple files map to %s, keeping %s, skipping: %s",
+                       target, sources[0], ', '.join(sources[1:]))
+    for _, target in plan.collisions:
+        logger.warning("Target filename already exists, skipping: %s", target)
+
+
+def _plan_is_current(plan: RenamePlan) -> bool:
+    """
+    Check whether a directory's names are unchanged since it was planned.
+
+    Args:
+        plan: Plan to check
+
+    Returns:
+        True if the directory modification time still matches the plan
+    """
+    if plan.mtime_ns is None:
+        return False
+    try:
+        return os.stat(plan.directory).st_mtime_ns == plan.mtime_ns
+    except OSError:
+        return False
+
+
+def _step_is_safe(filesystem: LocalFilesystem, directory: str, step: RenameStep) -> bool:
+    """
+    Re-check one step of a stale plan against the disk.
+
+    Args:
+        filesystem: Filesystem the plan is applied to
+        directory: Directory the plan was made for
+        step: Step to check
+
+    Returns:
+        True if the source is still the planned file and the target is free
+        (a no-clobber filesystem checks the target in the rename itself)
+    """
+    try:
+        if step.inode and filesystem.lstat(os.path.join(directory, step.source)).st_ino != step.inode:
+            return False
+    except OSError:
+        return False
+    return filesystem.no_clobber or not filesystem.lexists(os.path.join(directory, step.destination))
+
+
+def _execute_chain(plan: RenamePlan, chain: List[RenameStep], filesystem: LocalFilesystem,
+                   verify: bool, logger: logging.Logger, journal=None,
+                   stats=None) -> List[Tuple[str, str]]:
+    """
+    Run the steps of one chain in order.
+
+    A failed step stops the rest of the chain, since later steps depend on
+    the name it would have freed.
+
+    Args:
+        plan: Plan the chain belongs to
+        chain: Steps to run
+        filesystem: Filesystem the plan is applied to
+        verify: Re-check every step on disk before running it
+        logger: Logger instance for output
+        journal: Optional RenameJournal recording completed steps
+        stats: Optional RunStats recording rename latencies
+
+    Returns:
+        List of tuples containing (old_filename, new_filename) for renamed files
+    """
+    renamed_files = []
+    directory = plan.directory
+
+    for step in chain:
+        original = plan.temp_names.get(step.source, step.source)
+        if verify and not _step_is_safe(filesystem, directory, step):
+            logger.warning("Source or target changed since planning, skipping: %s", original)
+            if stats is not None:
+                stats.add(renames_skipped=1)
+            break
+        started = time.perf_counter()
+        try:
+            filesystem.rename(os.path.join(directory, step.source),
+                              os.path.join(directory, step.destination))
+        except FileExistsError:
+            # Only raised by no-clobber filesystems: the target was created
+            # after planning and has been left untouched
+            logger.warning("Target appeared since planning, skipping: %s -> %s", original, step.destination)
+            if stats is not None:
+                stats.add(renames_skipped=1)
+            break
+        except OSError as e:
+            if stats is not None:
+                stats.observe_rename(time.perf_counter() - started, ok=False)
+            logger.error("Failed to rename %s: %s", original, e)
+            break
+        if stats is not None:
+            stats.observe_rename(time.perf_counter() - started)
+        if journal is not None:
+            journal.mark_done(directory, step)
+
+        if step.destination in plan.temp_names:
+            # First half of a cycle; the rename completes at the end of the chain
+            continue
+        logger.info("Renamed: %s -> %s", original, step.destination)
+        renamed_files.append((original, step.destination))
+
+    return renamed_files
+
+
+def execute_plan(plan: RenamePlan, logger: logging.Logger,
+                 filesystem: Optional[LocalFilesystem] = None, rename_workers: int = 1,
+                 journal=None, verify: Optional[bool] = None,
+                 stats=None) -> List[Tuple[str, str]]:
+    """
+    Run the rename steps of a plan.
+
+    Chains are independent of each other, so with ``rename_workers`` above 1
+    they run concurrently on a thread pool while the steps inside each chain
+    keep their order. This hides the round-trip time of network-mounted and
+    FUSE-backed stores. If the directory changed since the plan was made,
+    every step is re-checked on disk before it runs; otherwise the plan's
+    name index is trusted and no extra stat calls are made.
+
+    Args:
+        plan: Plan produced by plan_renames
+        logger: Logger instance for output
+        filesystem: Filesystem to apply the plan to (default: default_filesystem())
+        rename_workers: Number of chains renamed concurrently
+        journal: Optional RenameJournal; intents are recorded before the
+            first rename and completed steps as they finish
+        verify: Force (True) or skip (False) the per-step disk checks instead
+            of deciding from the directory modification time
+        stats: Optional RunStats; time spent renaming and per-rename
+            latencies are recorded
+
+    Returns:
+        List of tuples containing (old_filename, new_filename) for renamed
+        files, in plan order regardless of completion order
+    """
+    started = time.perf_counter()
+    filesystem = filesystem or default_filesystem()
+    if verify is None:
+        verify = plan.mtime_ns is not None and not _plan_is_current(plan)
+    if verify and plan.mtime_ns is not None:
+        logger.warning("Directory changed since planning, re-checking renames: %s", plan.directory)
+
+    if journal is not None:
+        journal.begin_plan(plan)
+
+    if rename_workers <= 1 or len(plan.chains) <= 1:
+        chain_results = [_execute_chain(plan, chain, filesystem, verify, logger, journal, stats)
+                         for chain in plan.chains]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(rename_workers, len(plan.chains))) as pool:
+            chain_results = list(pool.map(
+                lambda chain: _execute_chain(plan, chain, filesystem, verify, logger, journal, stats),
+                plan.chains))
+
+    renamed_files = []
+    for renamed in chain_results:
+        renamed_files.extend(renamed)
+    if stats is not None:
+        stats.add_time('rename', time.perf_counter() - started)
+    return renamed_files
+
+
+def _open_plan_file(plan_file: str, mode: str):
+    """
+    Open a plan file, transparently compressed when it ends in .gz.
+
+    Args:
+        plan_file: Path to the plan file
+        mode: 'r' or 'w'
+
+    Returns:
+        Text file object
+    """
+    if str(plan_file).endswith('.gz'):
+        import gzip
+        return gzip.open(plan_file, mode + 't', encoding='utf-8')
+    return open(plan_file, mode, encoding='utf-8')
+
+
+def save_plans(plans: Iterable[RenamePlan], plan_file: str) -> int:
+    """
+    Write plans as JSON Lines.
+
+    Each directory starts with a header object, followed by one compact
+    ``[chain, source, destination, inode]`` array per rename step.
+
+    Args:
+        plans: Plans to write
+        plan_file: Path of the plan file
+
+    Returns:
+        Number of logical renames written
+    """
+    import json
+    rename_count = 0
+    with _open_plan_file(plan_file, 'w') as f:
+        for plan in plans:
+            if not plan.chains:
+                continue
+            header = {'dir': plan.directory, 'mtime_ns': plan.mtime_ns, 'temp': plan.temp_names}
+            f.write(json.dumps(header, separators=(',', ':')) + '\n')
+            for chain_index, chain in enumerate(plan.chains):
+                for step in chain:
+                    f.write(json.dumps([chain_index, step.source, step.destination, step.inode],
+                                       separators=(',', ':')) + '\n')
+            rename_count += len(plan.renames)
+    return rename_count
+
+
+def load_plans(plan_file: str) -> Iterator[RenamePlan]:
+    """
+    Read plans written by save_plans, one directory at a time.
+
+    Args:
+        plan_file: Path of the plan file
+
+    Returns:
+        Iterator of RenamePlan objects
+
+    Raises:
+        ValueError: If the file is not a valid plan file
+    """
+    import json
+    plan = None
+    with _open_plan_file(plan_file, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict):
+                if plan is not None:
+                    yield plan
+                plan = RenamePlan([], [], {}, [], record.get('temp', {}),
+                                  directory=record['dir'], mtime_ns=record.get('mtime_ns'))
+                continue
+            if plan is None or not isinstance(record, list) or len(record) != 4:
+                raise ValueError(f"Invalid plan record on line {line_number} of {plan_file}")
+            chain_index, source, destination, inode = record
+            while len(plan.chains) <= chain_index:
+                plan.chains.append([])
+            plan.chains[chain_index].append(RenameStep(source, destination, inode))
+            if destination not in plan.temp_names:
+                plan.renames.append((plan.temp_names.get(source, source), destination))
+    if plan is not None:
+        yield plan
@@ -0,0 +1,421 @@
+"""
+Retitle Server
+
+Keeps one warm retitler process for editor hooks and other frequent callers:
+the date lookup table is built once, an optional state cache stays in
+memory, and requests arrive over a Unix domain socket from the thin client
+in client.py (see there for the protocol).
+
+Requests from concurrent clients go through a single queue. The batching
+thread takes everything that arrives within a short window, groups the
+targets by directory and processes each directory once: requests for whole
+directories run process_directory, requests for single notes run
+process_names on the union of the requested names, and every client is
+answered with just the renames it asked for.
+"""
+
+import os
+import json
+import time
+import errno
+import queue
+import socket
+import logging
+import threading
+import socketserver
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple, TYPE_CHECKING
+
+from .client import default_socket_path
+from .note_retitler import process_directory, process_names, _get_date_table
+
+if TYPE_CHECKING:
+    from .fs import LocalFilesystem
+    from .state_cache import StateCache
+    from .filters import NameFilter
+
+
+# Seconds the batching thread keeps collecting requests after the first one
+DEFAULT_BATCH_WINDOW = 0.05
+
+# Most requests processed in one batch
+MAX_BATCH_REQUESTS = 1000
+
+# Longest request line accepted, in bytes
+MAX_REQUEST_BYTES = 1 << 20
+
+# Seconds an idle client connection is kept open
+CONNECTION_TIMEOUT = 60.0
+
+
+class _Request:
+    """
+    One client request waiting for the batching thread.
+    """
+
+    def __init__(self, paths: List[str], recursive: bool):
+        self.paths = paths
+        self.recursive = recursive
+        self.reply = None
+        self.done = threading.Event()
+
+
+def _process_batch(requests: List[_Request], logger: logging.Logger,
+                   **process_options) -> List[dict]:
+    """
+    Retitle the targets of several requests, each directory once.
+
+    Args:
+        requests: Requests of the batch
+        logger: Logger instance for output
+        **process_options: filesystem, rename_workers, journal, state_cache, name_filter
+
+    Returns:
+        One reply per request, in order
+    """
+    trees = set()  # roots of recursive requests
+    whole = set()  # directories requested as a whole
+    names = {}  # directory -> single notes requested in it
+    request_targets = []  # per request: [(directory, name or None, recursive)]
+    request_errors = []
+
+    for request in requests:
+        targets = []
+        errors = []
+        for path in request.paths:
+            if not os.path.isabs(path):
+                errors.append(f"Path is not absolute: {path}")
+            elif os.path.isdir(path):
+                path = os.path.normpath(path)
+                (trees if request.recursive else whole).add(path)
+                targets.append((path, None, request.recursive))
+            elif os.path.lexists(path):
+                directory, name = os.path.split(os.path.normpath(path))
+                names.setdefault(directory, set()).add(name)
+                targets.append((directory, name, False))
+            else:
+                errors.append(f"No such file or directory: {path}")
+        request_targets.append(targets)
+        request_errors.append(errors)
+
+    results = {}  # directory -> renamed (old_filename, new_filename)
+    failures = {}  # directory -> error message
+    state_cache = process_options.pop('state_cache', None)
+
+    if trees:
+        from .walker import process_tree
+    for root in sorted(trees):
+        try:
+            renamed = process_tree(Path(root), logger, state_cache=state_cache, **process_options)
+        except OSError as e:
+            logger.error("Error processing %s: %s", root, e)
+            failures[root] = str(e)
+            continue
+        for old_path, new_path in renamed:
+            old_path = os.path.join(root, old_path)
+            results.setdefault(os.path.dirname(old_path), []).append(
+                (os.path.basename(old_path), os.path.basename(new_path)))
+
+    for directory in sorted(whole | set(names)):
+        try:
+            if directory in whole:
+                renamed = process_directory(Path(directory), logger, state_cache=state_cache,
+                                            **process_options)
+            else:
+                renamed = process_names(directory, sorted(names[directory]), logger,
+                                        **process_options)
+        except OSError as e:
+            logger.error("Error processing %s: %s", directory, e)
+            failures[directory] = str(e)
+            continue
+        results.setdefault(directory, []).extend(renamed)
+
+    replies = []
+    for targets, errors in zip(request_targets, request_errors):
+        renamed = {}
+        for directory, name, recursive in targets:
+            if directory in failures:
+                errors.append(f"{directory}: {failures[directory]}")
+                continue
+            if recursive:
+                prefix = directory.rstrip(os.sep) + os.sep
+                directories = [d for d in results if d == directory or d.startswith(prefix)]
+            else:
+                directories = [directory]
+            for result_directory in directories:
+                for old_name, new_name in results.get(result_directory, ()):
+                    if name is None or old_name == name:
+                        renamed[os.path.join(result_directory, old_name)] = \
+                            os.path.join(result_directory, new_name)
+        replies.append({'ok': True, 'renamed': sorted(renamed.items()), 'errors': errors})
+    return replies
+
+
+def retitle_paths(paths: List[str], logger: Optional[logging.Logger] = None,
+                  recursive: bool = False, **process_options) -> dict:
+    """
+    Retitle files and directories in this process, answering like the server.
+
+    Used by the client when no server is running.
+
+    Args:
+        paths: Absolute paths of note files and/or directories
+        logger: Logger instance for output (default: a silent one)
+        recursive: Also process subdirectories of the given directories
+        **process_options: filesystem, rename_workers, journal, state_cache, name_filter
+
+    Returns:
+        Reply object with 'renamed' and 'errors'
+    """
+    if logger is None:
+        logger = logging.getLogger('note_retitler.client')
+        logger.propagate = False
+        logger.addHandler(logging.NullHandler())
+    return _process_batch([_Request(paths, recursive)], logger, **process_options)[0]
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads request lines from one client connection and writes the replies.
+    """
+
+    timeout = CONNECTION_TIMEOUT
+
+    def handle(self):
+        retitle_server = self.server.retitle_server
+        try:
+            for line in iter(lambda: self.rfile.readline(MAX_REQUEST_BYTES + 1), b''):
+                reply = retitle_server.handle_line(line)
+                self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+                # Stop only once the client has its reply
+                if reply.get('stopping'):
+                    retitle_server.shutdown()
+                    return
+        except (socket.timeout, ConnectionError):
+            pass
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Idle connections must not keep the server from shutting down
+    daemon_threads = True
+    block_on_close = False
+
+
+class RetitleServer:
+    """
+    Retitler serving requests on a Unix domain socket.
+
+    Typical use is serve_forever(), which runs until a client sends
+    {"op": "shutdown"} or the process is interrupted. In-process callers can
+    use submit() directly.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, logger: Optional[logging.Logger] = None,
+                 batch_window: float = DEFAULT_BATCH_WINDOW,
+                 filesystem: 'Optional[LocalFilesystem]' = None, rename_workers: int = 1,
+                 journal=None, state_cache: 'Optional[StateCache]' = None,
+                 name_filter: 'Optional[NameFilter]' = None,
+                 on_batch: Optional[Callable[[List[Tuple[str, str]]], None]] = None):
+        """
+        Args:
+            socket_path: Socket to listen on (default: default_socket_path())
+            logger: Logger instance for output
+            batch_window: Seconds to keep collecting requests into a batch
+            filesystem: Filesystem the renames go through (default: local)
+            rename_workers: Number of independent renames run concurrently
+            journal: Optional RenameJournal recording intended and completed renames
+            state_cache: Optional StateCache used for whole-directory requests
+            name_filter: Names to consider (default: default_name_filter())
+            on_batch: Called with the (old_path, new_path) renames of every batch
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.logger = logger or logging.getLogger('note_retitler')
+        self.batch_window = batch_window
+        self.on_batch = on_batch
+        self._process_options = {'filesystem': filesystem, 'rename_workers': rename_workers,
+                                 'journal': journal, 'state_cache': state_cache,
+                                 'name_filter': name_filter}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stop = threading.Event()
+        self._server = None
+        self._threads = []
+        self.requests_served = 0
+        self.batches = 0
+
+    def __enter__(self) -> 'RetitleServer':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _bind(self) -> None:
+        """
+        Listen on the socket, replacing a stale socket file left by a dead server.
+        """
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.socket_path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    os.unlink(self.socket_path)
+                else:
+                    raise OSError(errno.EADDRINUSE,
+                                  f"A retitle server is already running at {self.socket_path}")
+        self._server = _UnixServer(self.socket_path, _RequestHandler)
+        os.chmod(self.socket_path, 0o600)
+        self._server.retitle_server = self
+
+    def start(self) -> None:
+        """
+        Warm the parser, bind the socket and start serving in the background.
+        """
+        _get_date_table()
+        self._bind()
+        self._threads = [threading.Thread(target=self._batch_loop, name='retitle-batcher', daemon=True),
+                         threading.Thread(target=self._server.serve_forever, name='retitle-server',
+                                          daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        self.logger.info("Serving retitle requests on %s", self.socket_path)
+
+    def serve_forever(self) -> None:
+        """
+        Serve until a shutdown request arrives or the process is interrupted.
+        """
+        if self._server is None:
+            self.start()
+        try:
+            while not self._stop.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def shutdown(self) -> None:
+        """
+        Ask serve_forever to return.
+        """
+        self._stop.set()
+
+    def close(self) -> None:
+        """
+        Stop accepting connections, answer every queued request and remove the socket.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+        for thread in self._threads:
+            if thread.name == 'retitle-batcher':
+                thread.join()
+        if self._server is not None:
+            self._server.server_close()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+        self.logger.info("Retitle server stopped after %d requests in %d batches",
+                         self.requests_served, self.batches)
+
+    def submit(self, paths: List[str], recursive: bool = False) -> dict:
+        """
+        Queue a retitle request and wait for its reply.
+
+        Args:
+            paths: Absolute paths of note files and/or directories
+            recursive: Also process subdirectories of the given directories
+
+        Returns:
+            Reply object with 'renamed' and 'errors'
+        """
+        request = _Request(paths, recursive)
+        with self._lock:
+            if self._closed:
+                return {'ok': False, 'error': "Server is shutting down"}
+            self._queue.put(request)
+        request.done.wait()
+        return request.reply
+
+    def handle_line(self, line: bytes) -> dict:
+        """
+        Answer one protocol line.
+        """
+        if len(line) > MAX_REQUEST_BYTES:
+            return {'ok': False, 'error': f"Request longer than {MAX_REQUEST_BYTES} bytes"}
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {'ok': False, 'error': f"Invalid request: {e}"}
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': "Invalid request: expected a JSON object"}
+
+        op = request.get('op', 'retitle')
+        if op == 'ping':
+            return {'ok': True, 'pid': os.getpid(), 'requests': self.requests_served,
+                    'batches': self.batches}
+        if op == 'shutdown':
+            return {'ok': True, 'stopping': True}
+        if op != 'retitle':
+            return {'ok': False, 'error': f"Unknown op: {op}"}
+
+        paths = request.get('paths')
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            return {'ok': False, 'error': "Invalid request: 'paths' must be a list of strings"}
+        return self.submit(paths, recursive=bool(request.get('recursive')))
+
+    def _batch_loop(self) -> None:
+        """
+        Collect queued requests into batches and process them until closed.
+        """
+        stopping = False
+        while not stopping:
+            request = self._queue.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < MAX_BATCH_REQUESTS:
+                remaining = deadline - time.monotonic()
+                try:
+                    request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[_Request]) -> None:
+        """
+        Process one batch and hand every request its reply.
+        """
+        try:
+            replies = _process_batch(batch, self.logger, **self._process_options)
+        except Exception as e:
+            self.logger.exception("Error processing a batch of %d requests", len(batch))
+            replies = [{'ok': False, 'error': f"Internal error: {e}"}] * len(batch)
+
+        renamed = {}
+        for reply in replies:
+            renamed.update(reply.get('renamed', ()))
+        self.requests_served += len(batch)
+        self.batches += 1
+        self.logger.info("Batch of %d requests: %d files renamed", len(batch), len(renamed))
+        if self.on_batch is not None and renamed:
+            self.on_batch(sorted(renamed.items()))
+
+        for request, reply in zip(batch, replies):
+            request.reply = reply
+            request.done.set()
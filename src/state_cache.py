@@ -0,0 +1,228 @@
+"""
+Incremental State Cache
+
+Remembers, per directory, what the last run saw: the directory modification
+time, a fingerprint of its set of names, and the files that needed no rename.
+A directory whose modification time is unchanged is skipped without being
+scanned; a changed directory is scanned, but only names not seen before are
+parsed again. Every entry also records a digest of the name filter it was
+made with, and a run with other filter options treats it as a miss.
+
+Modification times are only trusted once they are safely in the past when
+recorded (like git's "racily clean" index entries), so a directory changed
+within the same timestamp tick as the previous run is still rescanned.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+
+# Maximum number of directories remembered; least recently used ones are evicted
+DEFAULT_MAX_DIRECTORIES = 10000
+
+# Directories with more settled names than this only remember their mtime
+DEFAULT_MAX_NAMES = 200000
+
+# A modification time closer than this to the time it was recorded is not trusted
+RACY_WINDOW_NS = 2 * 1000 ** 3
+
+CACHE_VERSION = 2
+
+
+def default_cache_file() -> str:
+    """
+    Location of the state cache when none is given.
+
+    Returns:
+        Path under $XDG_CACHE_HOME (or ~/.cache)
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'note_retitler', 'state.json')
+
+
+def name_hash(name: str) -> int:
+    """
+    64-bit hash of a filename used for set fingerprints.
+
+    Args:
+        name: Filename
+
+    Returns:
+        Unsigned 64-bit integer
+    """
+    return int.from_bytes(hashlib.blake2b(name.encode('utf-8', 'surrogateescape'),
+                                          digest_size=8).digest(), 'big')
+
+
+def names_fingerprint(names: Iterable[str]) -> int:
+    """
+    Order-independent fingerprint of a set of names.
+
+    XOR of the name hashes, so it can be updated for a rename by XOR-ing
+    out the old name and XOR-ing in the new one.
+
+    Args:
+        names: Names in the directory
+
+    Returns:
+        Unsigned 64-bit fingerprint
+    """
+    fingerprint = 0
+    for name in names:
+        fingerprint ^= name_hash(name)
+    return fingerprint
+
+
+class DirectoryState:
+    """
+    What the last run recorded about one directory.
+
+    Attributes:
+        mtime_ns: Directory modification time after the last run
+        fingerprint: names_fingerprint of the directory's names
+        settled: Files that needed no rename (their names cannot parse
+            differently next time)
+        recorded_ns: Wall-clock time the state was recorded
+        options: NameFilter.digest of the run that recorded it
+    """
+
+    __slots__ = ('mtime_ns', 'fingerprint', 'settled', 'recorded_ns', 'options')
+
+    def __init__(self, mtime_ns: int, fingerprint: int, settled: Iterable[str],
+                 recorded_ns: Optional[int] = None, options: str = ''):
+        self.mtime_ns = mtime_ns
+        self.fingerprint = fingerprint
+        self.settled = settled if isinstance(settled, (set, frozenset)) else set(settled)
+        self.recorded_ns = recorded_ns if recorded_ns is not None else time.time_ns()
+        self.options = options
+
+    def is_current(self, mtime_ns: int) -> bool:
+        """
+        Check whether the directory is unchanged since this state was recorded.
+
+        Args:
+            mtime_ns: Current modification time of the directory
+
+        Returns:
+            True if the directory can be skipped without scanning
+        """
+        if mtime_ns != self.mtime_ns:
+            return False
+        # The mtime might not have ticked for a change made right after recording
+        return self.recorded_ns - self.mtime_ns > RACY_WINDOW_NS
+
+
+class StateCache:
+    """
+    Bounded, LRU-evicted map of directory path -> DirectoryState, stored as JSON.
+    """
+
+    def __init__(self, cache_file: Optional[str] = None,
+                 max_directories: int = DEFAULT_MAX_DIRECTORIES,
+                 max_names: int = DEFAULT_MAX_NAMES):
+        """
+        Args:
+            cache_file: Path of the cache file (default: default_cache_file())
+            max_directories: Maximum number of directories remembered
+            max_names: Maximum number of settled names remembered per directory
+        """
+        self.cache_file = cache_file or default_cache_file()
+        self.max_directories = max_directories
+        self.max_names = max_names
+        self._lock = threading.Lock()
+        self._states = OrderedDict()
+        self._dirty = False
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != CACHE_VERSION:
+            return
+        for directory, entry in data.get('directories', {}).items():
+            mtime_ns, fingerprint, recorded_ns, settled, options = entry
+            self._states[directory] = DirectoryState(mtime_ns, fingerprint, settled, recorded_ns, options)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def lookup(self, directory: str, options: str = '') -> Optional[DirectoryState]:
+        """
+        Get the recorded state of a directory and mark it as recently used.
+
+        Args:
+            directory: Absolute directory path
+            options: NameFilter.digest of the current run
+
+        Returns:
+            DirectoryState or None if the directory is not cached or was
+            recorded with other filter options
+        """
+        with self._lock:
+            state = self._states.get(directory)
+            if state is None or state.options != options:
+                return None
+            self._states.move_to_end(directory)
+            return state
+
+    def store(self, directory: str, mtime_ns: int, fingerprint: int, settled: List[str],
+              options: str = '') -> None:
+        """
+        Record the state of a directory after it was processed.
+
+        Args:
+            directory: Absolute directory path
+            mtime_ns: Directory modification time after processing
+            fingerprint: names_fingerprint of the directory's names
+            settled: Files that needed no rename
+            options: NameFilter.digest of the run
+        """
+        if len(settled) > self.max_names:
+            settled = []
+        with self._lock:
+            self._states[directory] = DirectoryState(mtime_ns, fingerprint, settled, options=options)
+            self._states.move_to_end(directory)
+            while len(self._states) > self.max_directories:
+                self._states.popitem(last=False)
+            self._dirty = True
+
+    def forget(self, directory: str) -> None:
+        """
+        Drop a directory from the cache.
+
+        Args:
+            directory: Absolute directory path
+        """
+        with self._lock:
+            if self._states.pop(directory, None) is not None:
+                self._dirty = True
+
+    def save(self) -> None:
+        """
+        Write the cache file atomically if anything changed.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                'version': CACHE_VERSION,
+                'directories': {
+                    directory: [state.mtime_ns, state.fingerprint, state.recorded_ns,
+                                sorted(state.settled), state.options]
+                    for directory, state in self._states.items()
+                },
+            }
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+            temp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temp_file, self.cache_file)
+            self._dirty = False
@@ -5,21 +5,80 @@ This module provides command-line interface using invoke for the note retitler f
 """
 
 from invoke import task
+import os
 from pathlib import Path
 from datetime import datetime
 import logging
 
-# Import our main functionality
-from .note_retitler import setup_logging, process_directory
+# The command-line implementation lives in cli.py, which does not need invoke;
+# retitle_cli is re-exported for installs still pointing at src.tasks
+from .cli import retitle_cli, _retitle_direct
+from .watcher import DEFAULT_DEBOUNCE
 
 
 @task(help={
     'path': 'Target directory path (default: current directory)',
     'log': 'Save log file (default: ask user)',
     'yes': 'Skip all confirmations and proceed automatically',
-    'force': 'Alias for --yes, skip all confirmations'
+    'force': 'Alias for --yes, skip all confirmations',
+    'recursive': 'Process all subdirectories as well',
+    'max-depth': 'Maximum subdirectory depth in recursive mode (default: unlimited)',
+    'follow-symlinks': 'Descend into symlinked directories in recursive mode',
+    'workers': 'Number of directories processed concurrently in recursive mode',
+    'plan': 'Write a rename plan to this file without renaming anything',
+    'apply': 'Apply a rename plan written earlier with --plan',
+    'rename-workers': 'Number of renames run concurrently (for network filesystems)',
+    'parse-workers': 'Worker processes parsing directories with more than 50000 files (-1: one per CPU)',
+    'max-ops-per-second': 'Throttle stat and rename calls to this rate (for shared storage)',
+    'max-in-flight': 'Maximum stat and rename calls running at the same time',
+    'target-latency': 'Back off the throttle limits while rename latency is above this many milliseconds',
+    'journal': 'Record every rename in this write-ahead journal file',
+    'resume': 'Finish an interrupted run from its journal file',
+    'undo': 'Revert the renames recorded in a journal file',
+    'verbosity': "Log detail: 'debug', 'info' (default) or 'summary'",
+    'log-format': "Log file format: 'text' (default) or 'jsonl'",
+    'incremental': 'Skip directories unchanged since the last incremental run',
+    'state-cache': 'State cache file for incremental runs (implies --incremental)',
+    'watch': 'Keep running and retitle new notes as they arrive',
+    'debounce': f'Seconds a directory must be quiet before new notes are retitled (default: {DEFAULT_DEBOUNCE})',
+    'watch-backend': "Change notification: 'auto' (default), 'inotify' or 'poll'",
+    'stats': 'Write run statistics (phase timers, counters, rename latencies) to this JSON file',
+    'prometheus': 'Write run statistics as a Prometheus textfile (node exporter textfile collector)',
+    'serve': 'Keep running and retitle paths sent by retitle-client over a Unix socket',
+    'socket': 'Socket of the server (default: $XDG_RUNTIME_DIR/note_retitler.sock)',
+    'batch-window': 'Seconds the server collects requests into one batch (default: 0.05)',
+    'jobs': 'Process every root listed in this JSON/TOML job manifest on one shared worker pool',
+    'report': 'Write the consolidated JSON report of a --jobs run to this file',
+    'include': 'Only retitle files matching these comma-separated globs',
+    'exclude': 'Leave files matching these comma-separated globs alone and skip such subdirectories',
+    'ext': 'Only retitle files with these comma-separated extensions',
+    'exclude-ext': 'Leave files with these comma-separated extensions alone',
+    'skip-normalized': 'Leave names already containing a YYYY-MM-DD date alone (default: on; --no-skip-normalized)',
+    'paths-from': "Retitle the files listed in this file ('-' for stdin, needs --yes) instead of scanning",
+    'null': 'Paths in --paths-from are NUL-delimited',
+    'bounded-memory': 'Keep memory use constant for huge directories (chunked renames, spilled rename record)',
+    'chunk-size': 'Renames planned together in bounded-memory mode (default: 10000)',
+    'spill-threshold': 'Records kept in memory before spilling to disk in bounded-memory mode (default: 10000)',
+    'rename-backend': 'How files are renamed: auto, renameat2 (never overwrites) or rename (default: auto)',
+    'update-links': 'Rewrite Markdown and wiki links to renamed notes',
+    'link-root': 'Vault whose links are rewritten (implies --update-links; default: the target directory)',
+    'link-index': 'Link index file kept between runs (implies --update-links)',
+    'archive': 'Retitle the members of this zip or tar archive (or of every archive in this directory)',
+    'coordinate': 'Share a recursive run with other nodes through work leases in this directory (new for every run)',
+    'node-id': 'Name of this node in a --coordinate run (default: hostname-pid)',
+    'lease-ttl': 'Seconds before another node takes over the directory of a stalled node (default: 30)'
 })
-def retitle(ctx, path=None, log=None, yes=False, force=False):
+def retitle(ctx, path=None, log=None, yes=False, force=False, recursive=False,
+            max_depth=None, follow_symlinks=False, workers=None, plan=None, apply=None,
+            rename_workers=None, journal=None, resume=None, undo=None, verbosity='info',
+            log_format='text', incremental=False, state_cache=None, update_links=False,
+            link_root=None, link_index=None, watch=False,
+            debounce=None, watch_backend='auto', stats=None, prometheus=None, serve=False,
+            socket=None, batch_window=None, jobs=None, report=None, include=None, exclude=None,
+            ext=None, exclude_ext=None, skip_normalized=True, bounded_memory=False,
+            chunk_size=None, spill_threshold=None, max_ops_per_second=None, max_in_flight=None,
+            target_latency=None, rename_backend='auto', parse_workers=None, paths_from=None,
+            null=False, archive=None, coordinate=None, node_id=None, lease_ttl=None):
     """
     Retitle note files by converting date formats to YYYY-MM-DD.
     
@@ -29,86 +88,23 @@ def retitle(ctx, path=None, log=None, yes=False, force=False):
     
     All dates are assumed to be from 2025.
     """
-    # Handle force flag (--force is alias for --yes)
-    skip_confirmations = yes or force
-    
-    # Determine target path
-    target_path = Path(path) if path else Path.cwd()
-    
-    if not target_path.exists():
-        print(f"Error: Directory does not exist: {target_path}")
-        return
-    
-    if not target_path.is_dir():
-        print(f"Error: Path is not a directory: {target_path}")
-        return
-    
-    # Get file count for confirmation
-    files = [f for f in target_path.iterdir() if f.is_file()]
-    file_count = len(files)
-    
-    # Show path and file count, ask for confirmation
-    print(f"Target directory: {target_path.absolute()}")
-    print(f"Found {file_count} files to process")
-    
-    if not skip_confirmations:
-        proceed = input(f"Proceed with processing {file_count} files in '{target_path}'? (y/n): ").lower().strip()
-        if proceed not in ['y', 'yes']:
-            print("Operation cancelled.")
-            return
-    
-    # Handle log file decision
-    log_filename = None
-    if log is None and not skip_confirmations:
-        # Ask user for confirmation
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        suggested_log = f"note_retitler_{timestamp}.log"
-        save_log = input(f"Save log file as '{suggested_log}'? (y/n): ").lower().strip()
-        if save_log in ['y', 'yes']:
-            log_filename = suggested_log
-    elif log or skip_confirmations:
-        # User explicitly requested log file or using force mode
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_filename = f"note_retitler_{timestamp}.log"
-    
-    # Setup logging
-    if log_filename:
-        logger = setup_logging(log_filename)
-        print(f"Log file will be saved as: {log_filename}")
-    else:
-        # Console-only logging
-        logger = logging.getLogger('note_retitler')
-        logger.setLevel(logging.INFO)
-        logger.handlers.clear()  # Clear any existing handlers
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-        if not skip_confirmations:
-            print("Proceeding with console output only.")
-    
-    logger.info("Starting Note Retitler Script")
-    logger.info(f"Target directory: {target_path.absolute()}")
-    logger.info(f"Found {file_count} files to process")
-    
-    # Process the directory
-    renamed_files = process_directory(target_path, logger)
-    
-    # Summary
-    print(f"\nProcessing complete. Renamed {len(renamed_files)} files.")
-    logger.info(f"Processing complete. Renamed {len(renamed_files)} files.")
-    
-    if renamed_files:
-        print("\nSummary of renamed files:")
-        logger.info("Summary of renamed files:")
-        for old_name, new_name in renamed_files:
-            print(f"  {old_name} -> {new_name}")
-            logger.info(f"  {old_name} -> {new_name}")
-    
-    if log_filename:
-        print(f"\nLog saved to: {log_filename}")
-        logger.info(f"Log saved to: {log_filename}")
+    # Share the implementation with the installed `retitle` command
+    _retitle_direct(path=path, log=log, yes=yes, force=force, recursive=recursive,
+                    max_depth=max_depth, follow_symlinks=follow_symlinks, workers=workers,
+                    plan=plan, apply=apply, rename_workers=rename_workers,
+                    journal=journal, resume=resume, undo=undo, verbosity=verbosity,
+                    log_format=log_format, incremental=incremental, state_cache=state_cache,
+                    update_links=update_links, link_root=link_root, link_index=link_index,
+                    watch=watch, debounce=debounce, watch_backend=watch_backend,
+                    stats=stats, prometheus=prometheus, serve=serve, socket=socket,
+                    batch_window=batch_window, jobs=jobs, report=report, include=include,
+                    exclude=exclude, ext=ext, exclude_ext=exclude_ext,
+                    skip_normalized=skip_normalized, bounded_memory=bounded_memory,
+                    chunk_size=chunk_size, spill_threshold=spill_threshold,
+                    max_ops_per_second=max_ops_per_second, max_in_flight=max_in_flight,
+                    target_latency=target_latency, rename_backend=rename_backend,
+                    parse_workers=parse_workers, paths_from=paths_from, null=null, archive=archive,
+                    coordinate=coordinate, node_id=node_id, lease_ttl=lease_ttl)
 
 
 @task
@@ -118,8 +114,24 @@ def test(ctx):
     """
     print("Running note retitler tests...")
     
+    import io
+    import sys
+    import json
+    import time
+    import tarfile
+    import zipfile
+    import tempfile
+    import threading
+    import subprocess
+    
+    # Expected warnings (duplicates, collisions) are not test output
+    quiet_logger = logging.getLogger('note_retitler.test')
+    quiet_logger.propagate = False
+    if not quiet_logger.handlers:
+        quiet_logger.addHandler(logging.NullHandler())
+    
     # Import test functions
-    from .note_retitler import parse_date_from_filename, generate_new_filename
+    from .note_retitler import parse_date_from_filename
     
     # Test cases for date parsing
     test_cases = [
@@ -172,6 +184,738 @@ def test(ctx):
                 print(f"✗ {filename} - expected ({expected_old}, {expected_new}), got {result}")
                 failed += 1
     
+    # The lookup table must agree with the reference parser for every input
+    from .note_retitler import verify_date_table
+    print("\nTesting date lookup table:")
+    try:
+        checked = verify_date_table()
+        print(f"✓ lookup table matches _parse_numeric_date for all {checked} inputs")
+        passed += 1
+    except AssertionError as e:
+        print(f"✗ {e}")
+        failed += 1
+    
+    # The batch API must agree with the per-name parser, also in worker processes
+    from .batch import parse_many, iter_parse_many
+    print("\nTesting batch parsing:")
+    batch_names = [filename for filename, _, _ in test_cases]
+    batch_names += ["project_x.md", "2024/714.txt", "٧١٤.txt", "1234567.txt", "7.txt"]
+    expected_results = [parse_date_from_filename(filename) for filename in batch_names]
+    batch = parse_many(batch_names)
+    streamed = [result for _, result in iter_parse_many(iter(batch_names), workers=2, chunk_size=4)]
+    batch_results = [(part, date) if part is not None else None for part, date in zip(*batch)]
+    if batch_results == expected_results and streamed == expected_results:
+        print(f"✓ parse_many and iter_parse_many match parse_date_from_filename for {len(batch_names)} names")
+        passed += 1
+    else:
+        print(f"✗ batch parsing returned {batch_results} / {streamed}")
+        failed += 1
+    
+    # Name filters: compiled rules, and a second run must not touch normalized names
+    from .note_retitler import process_directory
+    from .filters import NameFilter
+    print("\nTesting name filters:")
+    name_filter = NameFilter(include=['meet*'], extensions=['md'], exclude=['*draft*'],
+                             exclude_extensions=['png'])
+    filter_cases = [("meeting_714.txt", True), ("notes_714.MD", True), ("other_714.txt", False),
+                    ("meeting draft 714.md", False), ("meeting_714.png", False),
+                    ("meeting_2025-07-14.md", False)]
+    default_cases = [("note_714.txt", True), ("2025-07-14.txt", False), ("note_2025-07-2025-01-04.txt", False),
+                     ("note_retitler_20250714_101500.log", False), (".note_714.txt.retitle-0.tmp", False)]
+    mismatches = [name for name, expected in filter_cases if name_filter.accepts(name) != expected]
+    mismatches += [name for name, expected in default_cases if NameFilter().accepts(name) != expected]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        Path(temp_dir, "note_714.txt").touch()
+        first_run = process_directory(Path(temp_dir), quiet_logger)
+        second_run = process_directory(Path(temp_dir), quiet_logger)
+    # An incremental run without a filter must not reuse the state of a filtered run
+    from .state_cache import StateCache
+    with tempfile.TemporaryDirectory() as temp_dir:
+        notes = Path(temp_dir, "notes")
+        notes.mkdir()
+        Path(notes, "a_714.md").touch()
+        Path(notes, "b_714.txt").touch()
+        cache = StateCache(os.path.join(temp_dir, "state.json"))
+        process_directory(notes, quiet_logger, state_cache=cache, name_filter=NameFilter(extensions=['md']))
+        unfiltered_run = process_directory(notes, quiet_logger, state_cache=cache)
+    if (not mismatches and first_run == [("note_714.txt", "note_2025-07-14.txt")] and not second_run
+            and unfiltered_run == [("b_714.txt", "b_2025-07-14.txt")]):
+        print(f"✓ {len(filter_cases) + len(default_cases)} filter rules and a repeated run leave normalized names alone, "
+              f"incremental state is kept per filter")
+        passed += 1
+    else:
+        print(f"✗ filter mismatches {mismatches}, second run renamed {second_run}, "
+              f"unfiltered incremental run renamed {unfiltered_run}")
+        failed += 1
+
+    # An incremental run must skip a directory unchanged since a saved state,
+    # but not one changed within the racy window of the state it recorded
+    from .metrics import RunStats
+    print("\nTesting the incremental state cache:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        notes = Path(temp_dir, "notes")
+        notes.mkdir()
+        Path(notes, "readme.txt").touch()
+        settled_ns = time.time_ns() - 10 * 1000 ** 3
+        os.utime(notes, ns=(settled_ns, settled_ns))
+        cache_file = os.path.join(temp_dir, "state.json")
+
+        def incremental_run(cache):
+            run_stats = RunStats()
+            process_directory(notes, quiet_logger, state_cache=cache, stats=run_stats)
+            return run_stats.counters['directories_skipped'], run_stats.counters['entries_scanned']
+
+        cache = StateCache(cache_file)
+        cache_runs = [incremental_run(cache)]
+        cache.save()
+        cache_runs.append(incremental_run(StateCache(cache_file)))
+        # Changed just now: the state recorded next is racy and must not be trusted
+        Path(notes, "later.txt").touch()
+        cache_runs.append(incremental_run(cache))
+        cache_runs.append(incremental_run(cache))
+    if cache_runs == [(0, 1), (1, 0), (0, 2), (0, 2)]:
+        print("✓ skipped an unchanged directory from a saved cache, rescanned one changed within the racy window")
+        passed += 1
+    else:
+        print(f"✗ incremental runs (skipped, scanned): {cache_runs}")
+        failed += 1
+
+    # The background writer must flush every queued record on shutdown, and
+    # the verbosity must gate the per-file lines
+    from contextlib import redirect_stderr
+    from .note_retitler import setup_logging, shutdown_logging, SUMMARY
+    print("\nTesting queued logging:")
+    package_logger = logging.getLogger('note_retitler')
+    saved_logger_state = package_logger.level, list(package_logger.handlers)
+    logged = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for verbosity in ('debug', 'info', 'summary'):
+            notes = Path(temp_dir, verbosity)
+            notes.mkdir()
+            Path(notes, "note_714.txt").touch()
+            log_path = os.path.join(temp_dir, f"{verbosity}.log")
+            # The console handler binds stderr when it is created
+            with redirect_stderr(io.StringIO()):
+                run_logger = setup_logging(log_path, verbosity)
+            process_directory(notes, run_logger)
+            for line in range(2000):
+                run_logger.log(SUMMARY, "Queued line %d", line)
+            shutdown_logging()
+            with open(log_path, encoding='utf-8') as f:
+                log_text = f.read()
+            logged[verbosity] = ("Processing file: note_714.txt" in log_text,
+                                 "Renamed: note_714.txt" in log_text,
+                                 log_text.count("Queued line "))
+    package_logger.setLevel(saved_logger_state[0])
+    package_logger.handlers[:] = saved_logger_state[1]
+    if logged == {'debug': (True, True, 2000), 'info': (False, True, 2000), 'summary': (False, False, 2000)}:
+        print("✓ every queued record was written on shutdown; debug, info and summary gate per-file lines")
+        passed += 1
+    else:
+        print(f"✗ logged (per-file debug, renames, queued lines): {logged}")
+        failed += 1
+
+    # --stats JSON and the Prometheus textfile must carry the run's counters
+    # and rename latency histogram, each metric with HELP and TYPE lines
+    print("\nTesting stats output:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        notes = Path(temp_dir, "notes")
+        notes.mkdir()
+        for name in ("note_714.txt", "note_715.txt", "readme.txt"):
+            Path(notes, name).touch()
+        run_stats = RunStats()
+        process_directory(notes, quiet_logger, stats=run_stats)
+        run_stats.write_json(os.path.join(temp_dir, "stats.json"))
+        run_stats.write_prometheus(os.path.join(temp_dir, "retitle.prom"))
+        with open(os.path.join(temp_dir, "stats.json"), encoding='utf-8') as f:
+            stats_json = json.load(f)
+        with open(os.path.join(temp_dir, "retitle.prom"), encoding='utf-8') as f:
+            prom_lines = f.read().splitlines()
+    samples = {}
+    described = {'HELP': set(), 'TYPE': set()}
+    for line in prom_lines:
+        if line.startswith('# '):
+            kind, metric = line.split()[1:3]
+            described[kind].add(metric)
+        else:
+            sample, value = line.rsplit(' ', 1)
+            samples[sample] = float(value)
+    families = {sample.split('{')[0].replace('_bucket', '').replace('_count', '').replace('_sum', '')
+                for sample in samples}
+    histogram = 'note_retitler_rename_latency_seconds'
+    buckets = [value for sample, value in samples.items() if sample.startswith(histogram + '_bucket')]
+    json_ok = (stats_json['counters']['files_scanned'] == 3 and stats_json['counters']['parse_hits'] == 2
+               and stats_json['counters']['renames'] == 2 and stats_json['rename_latency_seconds']['count'] == 2
+               and {'scan', 'parse', 'plan', 'rename'} <= set(stats_json['phases_seconds']))
+    prom_ok = (samples.get('note_retitler_files_scanned') == 3 and samples.get('note_retitler_renames') == 2
+               and samples.get(f'{histogram}_count') == 2 and samples.get(f'{histogram}_bucket{{le="+Inf"}}') == 2
+               and buckets == sorted(buckets) and families <= described['HELP'] and families <= described['TYPE'])
+    if json_ok and prom_ok:
+        print(f"✓ JSON stats and {len(samples)} Prometheus samples match the run, "
+              f"every metric has HELP and TYPE")
+        passed += 1
+    else:
+        print(f"✗ stats JSON {stats_json}, Prometheus {prom_lines}")
+        failed += 1
+
+    # Concurrent renames against a slow filesystem must rename every file
+    # and report them in plan order
+    from .fs import LatencyFilesystem
+    print("\nTesting concurrent rename executor:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        expected = []
+        for day in range(10, 30):
+            filename = f"note_7{day}.txt"
+            Path(temp_dir, filename).touch()
+            expected.append((filename, f"note_2025-07-{day}.txt"))
+        renamed = process_directory(Path(temp_dir), quiet_logger,
+                                    filesystem=LatencyFilesystem(latency=0.01),
+                                    rename_workers=8)
+        if sorted(renamed) == sorted(expected) and all(Path(temp_dir, new).exists() for _, new in expected):
+            print(f"✓ renamed {len(renamed)} files with 8 workers on a 10ms-latency filesystem")
+            passed += 1
+        else:
+            print(f"✗ concurrent executor renamed {renamed}")
+            failed += 1
+
+    print("\nTesting the invoke-free entry point:")
+    package_root = str(Path(__file__).resolve().parent.parent)
+    loaded = subprocess.run(
+        [sys.executable, '-c', "import sys, src.cli; print(' '.join(sorted(m for m in "
+                               "('invoke', 'src.walker', 'src.journal', 'src.metrics') if m in sys.modules)))"],
+        cwd=package_root, capture_output=True, text=True).stdout.strip()
+    if not loaded:
+        print("✓ importing src.cli loads neither invoke nor the optional modules")
+        passed += 1
+    else:
+        print(f"✗ importing src.cli loaded: {loaded}")
+        failed += 1
+
+    # Concurrent clients must be answered from one batch, each with its own renames
+    from .server import RetitleServer
+    from .client import request_retitle, send_request
+    print("\nTesting server mode:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        notes_dir = os.path.join(temp_dir, 'notes')
+        os.mkdir(notes_dir)
+        for day in range(10, 16):
+            Path(notes_dir, f"note_7{day}.txt").touch()
+        socket_path = os.path.join(temp_dir, 'retitle.sock')
+        server = RetitleServer(socket_path, quiet_logger, batch_window=0.2)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server.start()
+        server_thread.start()
+        replies = {}
+
+        def ask(day):
+            replies[day] = request_retitle([os.path.join(notes_dir, f"note_7{day}.txt")], socket_path)
+
+        clients = [threading.Thread(target=ask, args=(day,)) for day in range(10, 16)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        batches = send_request({'op': 'ping'}, socket_path)['batches']
+        send_request({'op': 'shutdown'}, socket_path)
+        server_thread.join()
+        expected_replies = {day: [[os.path.join(notes_dir, f"note_7{day}.txt"),
+                                   os.path.join(notes_dir, f"note_2025-07-{day}.txt")]]
+                            for day in range(10, 16)}
+        if ({day: reply['renamed'] for day, reply in replies.items()} == expected_replies
+                and batches < len(clients) and not os.path.exists(socket_path)):
+            print(f"✓ {len(clients)} concurrent clients answered in {batches} batch(es)")
+            passed += 1
+        else:
+            print(f"✗ server replies {replies} in {batches} batches")
+            failed += 1
+
+    # Watch mode must rename a single arrival, debounce a burst into one batch
+    # and pick up the notes of a folder tree moved in
+    from .watcher import watch
+    print("\nTesting watch mode:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        notes_dir = os.path.join(temp_dir, 'notes')
+        incoming = os.path.join(temp_dir, 'incoming')
+        os.mkdir(notes_dir)
+        os.makedirs(os.path.join(incoming, 'sub'))
+        Path(incoming, "note_701.txt").touch()
+        Path(incoming, "sub", "note_702.txt").touch()
+        watch_batches = []
+        stop_watching = threading.Event()
+        watch_thread = threading.Thread(target=watch, args=(notes_dir, quiet_logger), kwargs={
+            'recursive': True, 'debounce': 0.3, 'backend': 'poll', 'poll_interval': 0.05,
+            'stop_event': stop_watching,
+            'on_batch': lambda directory, renamed: watch_batches.append((directory, sorted(renamed)))})
+        watch_thread.start()
+
+        def wait_for_batches(count):
+            deadline = time.monotonic() + 5
+            while len(watch_batches) < count and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+        time.sleep(0.2)
+        Path(notes_dir, "note_710.txt").touch()
+        wait_for_batches(1)
+        # Arrivals closer together than the debounce interval form one batch
+        for day in range(11, 16):
+            Path(notes_dir, f"note_7{day}.txt").touch()
+            time.sleep(0.1)
+        wait_for_batches(2)
+        os.rename(incoming, os.path.join(notes_dir, 'moved'))
+        wait_for_batches(4)
+        time.sleep(0.4)
+        stop_watching.set()
+        watch_thread.join()
+    expected_batches = [
+        (notes_dir, [("note_710.txt", "note_2025-07-10.txt")]),
+        (notes_dir, [(f"note_7{day}.txt", f"note_2025-07-{day}.txt") for day in range(11, 16)]),
+        (os.path.join(notes_dir, 'moved'), [("note_701.txt", "note_2025-07-01.txt")]),
+        (os.path.join(notes_dir, 'moved', 'sub'), [("note_702.txt", "note_2025-07-02.txt")]),
+    ]
+    if watch_batches[:2] + sorted(watch_batches[2:]) == expected_batches:
+        print("✓ renamed a single arrival, a debounced burst and a moved-in nested folder "
+              f"in {len(watch_batches)} batches")
+        passed += 1
+    else:
+        print(f"✗ watch batches {watch_batches}")
+        failed += 1
+
+    # A manifest job must process every root and not let a big root take all workers
+    from .jobs import load_manifest, run_jobs, JobRoot, _Scheduler
+    print("\nTesting job manifests:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for root_name, directory_count in (('big', 6), ('small', 1)):
+            for index in range(directory_count):
+                directory = Path(temp_dir, root_name, f"d{index}")
+                directory.mkdir(parents=True)
+                Path(directory, "note_714.txt").touch()
+        Path(temp_dir, "big", "d0", "inner").mkdir()
+        Path(temp_dir, "big", "d0", "inner", "note_716.txt").touch()
+        manifest_file = os.path.join(temp_dir, 'jobs.json')
+        with open(manifest_file, 'w') as f:
+            json.dump({'workers': 2, 'io_limit': 1, 'roots': ['big', {'path': 'small', 'priority': 2}]}, f)
+        report = run_jobs(load_manifest(manifest_file), quiet_logger)
+        scheduler = _Scheduler([JobRoot('big'), JobRoot('small')])
+        scheduler.add(0, [(f"big/d{index}", 100) for index in range(6)])
+        scheduler.add(1, [("small/d0", 1)])
+        first_picks = {scheduler.next()[0], scheduler.next()[0]}
+        renamed_counts = [len(result['renamed']) for result in report['roots']]
+        # Every directory is listed once: 14 entries in "big", 2 in "small"
+        if (renamed_counts == [7, 1] and report['totals']['errors'] == 0 and first_picks == {0, 1}
+                and report['totals']['directories'] == 10 and report['totals']['entries'] == 16):
+            print("✓ job renamed files in both roots and shared the workers between them")
+            passed += 1
+        else:
+            print(f"✗ job report totals {report['totals']}, first picks {first_picks}")
+            failed += 1
+
+    # Path lists are grouped by directory with bounded buffering and renamed
+    # like a directory scan would
+    from .pathlist import read_paths, group_by_directory, process_path_list
+    print("\nTesting path-list input:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        listed = []
+        for directory in ('a', 'b'):
+            Path(temp_dir, directory).mkdir()
+            for day in range(10, 14):
+                listed.append(os.path.join(temp_dir, directory, f"note_7{day}.txt"))
+                Path(listed[-1]).touch()
+        listed.append(os.path.join(temp_dir, 'a', 'missing_715.txt'))
+        stream = io.BytesIO(b'\0'.join(os.fsencode(path) for path in listed) + b'\0')
+        groups = list(group_by_directory(listed, group_size=3, max_buffered=4))
+        record = process_path_list(read_paths(stream, b'\0'), quiet_logger)
+        renamed = sorted(record)
+        record.close()
+        expected = sorted((path, path.replace(f"note_7{day}", f"note_2025-07-{day}"))
+                          for path in listed[:-1] for day in range(10, 14) if f"note_7{day}" in path)
+        if (renamed == expected and all(len(names) <= 3 for _, names in groups)
+                and sum(len(names) for _, names in groups) == len(listed)):
+            print(f"✓ renamed {len(renamed)} listed files from {len(groups)} bounded groups")
+            passed += 1
+        else:
+            print(f"✗ path list renamed {renamed}, groups {groups}")
+            failed += 1
+
+    # Sharded parsing must produce exactly the plan of an in-process run,
+    # including duplicate targets whose sources land in different shards
+    from . import note_retitler
+    from .note_retitler import plan_directory
+    print("\nTesting sharded parsing:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for day in range(10, 30):
+            Path(temp_dir, f"note_7{day}.txt").touch()
+            Path(temp_dir, f"note_07{day}.txt").touch()
+        Path(temp_dir, "undated.txt").touch()
+        shard_size = note_retitler.SHARD_SIZE
+        note_retitler.SHARD_SIZE = 3
+        try:
+            sharded = plan_directory(Path(temp_dir), quiet_logger, parse_workers=2)
+        finally:
+            note_retitler.SHARD_SIZE = shard_size
+        in_process = plan_directory(Path(temp_dir), quiet_logger)
+
+        def plan_outcome(plan):
+            return plan.renames, plan.chains, plan.duplicates, plan.collisions
+
+        if plan_outcome(sharded) == plan_outcome(in_process) and len(sharded.duplicates) == 20:
+            print(f"✓ 14 shards on 2 processes planned like one ({len(sharded.renames)} renames, "
+                  f"{len(sharded.duplicates)} duplicate targets)")
+            passed += 1
+        else:
+            print(f"✗ sharded plan {plan_outcome(sharded)} differs from {plan_outcome(in_process)}")
+            failed += 1
+
+    # A target created after planning must survive the rename, with
+    # renameat2 and with the lstat fallback alike
+    from .fs import NoReplaceFilesystem
+    from .note_retitler import plan_names
+    from .planner import execute_plan
+    print("\nTesting no-clobber renames:")
+    outcomes = []
+    for unsupported in (False, True):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            Path(temp_dir, "note_715.txt").write_text("planned")
+            Path(temp_dir, "note_716.txt").write_text("renamed")
+            plan = plan_names(temp_dir, ["note_715.txt", "note_716.txt"], quiet_logger)
+            Path(temp_dir, "note_2025-07-15.txt").write_text("created later")
+            filesystem = NoReplaceFilesystem()
+            # As after ENOSYS: every rename takes the fallback
+            filesystem._unsupported = unsupported
+            renamed = execute_plan(plan, quiet_logger, filesystem=filesystem)
+            filesystem.close()
+            outcomes.append((renamed, Path(temp_dir, "note_2025-07-15.txt").read_text(),
+                             Path(temp_dir, "note_715.txt").exists(), filesystem.fallbacks))
+    # A directory replaced at the same path must not be renamed in through its old descriptor
+    with tempfile.TemporaryDirectory() as temp_dir:
+        notes = os.path.join(temp_dir, "notes")
+        os.mkdir(notes)
+        Path(notes, "a").touch()
+        filesystem = NoReplaceFilesystem()
+        filesystem.rename(os.path.join(notes, "a"), os.path.join(notes, "b"))
+        os.rename(notes, notes + ".old")
+        os.mkdir(notes)
+        Path(notes, "c").touch()
+        filesystem.rename(os.path.join(notes, "c"), os.path.join(notes, "d"))
+        filesystem.close()
+        reopened = os.listdir(notes) == ["d"] and os.listdir(notes + ".old") == ["b"]
+    expected_renames = [("note_716.txt", "note_2025-07-16.txt")]
+    if all(renamed == expected_renames and kept == "created later" and source_left
+           for renamed, kept, source_left, _ in outcomes) and outcomes[1][3] == 2 and reopened:
+        print(f"✓ skipped a target created since planning "
+              f"({'renameat2' if outcomes[0][3] == 0 else 'fallback'} and fallback), "
+              f"reopened a replaced directory")
+        passed += 1
+    else:
+        print(f"✗ no-clobber outcomes {outcomes}, replaced directory reopened: {reopened}")
+        failed += 1
+
+    # The walker must stop at max_depth, leave symlinked directories alone by
+    # default, and visit each physical directory once when following them
+    from .walker import walk_tree
+    print("\nTesting the tree walker:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tree = os.path.join(temp_dir, "tree")
+        os.makedirs(os.path.join(tree, "a", "b"))
+        os.mkdir(os.path.join(temp_dir, "outside"))
+        os.symlink(os.path.join(temp_dir, "outside"), os.path.join(tree, "ext"))
+        os.symlink(os.path.join(tree, "a"), os.path.join(tree, "alias"))
+        # Loops back to the root
+        os.symlink(tree, os.path.join(tree, "a", "b", "up"))
+
+        def walked(**options):
+            directories = [directory for directory, _ in walk_tree(Path(tree), quiet_logger,
+                                                                   plan_directory, **options)]
+            return sorted(os.path.relpath(os.path.realpath(d), temp_dir) for d in directories)
+
+        walk_results = {'max_depth=1': walked(max_depth=1), 'default': walked(),
+                        'follow_symlinks': walked(follow_symlinks=True)}
+    expected_walks = {
+        'max_depth=1': ["tree", os.path.join("tree", "a")],
+        'default': ["tree", os.path.join("tree", "a"), os.path.join("tree", "a", "b")],
+        'follow_symlinks': ["outside", "tree", os.path.join("tree", "a"), os.path.join("tree", "a", "b")],
+    }
+    if walk_results == expected_walks:
+        print("✓ stopped at max_depth, skipped symlinked directories by default, "
+              "visited each directory once through symlinks and a loop")
+        passed += 1
+    else:
+        print(f"✗ walked {walk_results}")
+        failed += 1
+
+    # A saved plan must load back unchanged, and applying it must re-check a
+    # source replaced since planning instead of renaming the new file
+    from .planner import save_plans, load_plans
+    print("\nTesting saved plans:")
+    saved_results = []
+    for plan_name in ("plan.jsonl", "plan.jsonl.gz"):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            notes = Path(temp_dir, "notes")
+            notes.mkdir()
+            for day in (15, 16):
+                Path(notes, f"note_7{day}.txt").write_text("planned")
+            plan_file = os.path.join(temp_dir, plan_name)
+            saved = plan_directory(notes, quiet_logger)
+            save_plans([saved], plan_file)
+            loaded = list(load_plans(plan_file))
+            round_trip = [(plan.directory, plan.mtime_ns, plan.renames, plan.chains, plan.temp_names)
+                          for plan in loaded] == [(saved.directory, saved.mtime_ns, saved.renames,
+                                                    saved.chains, saved.temp_names)]
+            # Saved over the planned file, as editors do, so it gets a new inode
+            Path(temp_dir, "edited").write_text("written after planning")
+            os.replace(os.path.join(temp_dir, "edited"), notes / "note_715.txt")
+            applied = [renamed for plan in load_plans(plan_file)
+                       for renamed in execute_plan(plan, quiet_logger)]
+            saved_results.append((round_trip, applied, Path(notes, "note_715.txt").read_text()))
+    if all(round_trip and applied == [("note_716.txt", "note_2025-07-16.txt")]
+           and kept == "written after planning" for round_trip, applied, kept in saved_results):
+        print("✓ plans round-trip through JSON Lines (plain and gzip), "
+              "a source replaced since planning is skipped")
+        passed += 1
+    else:
+        print(f"✗ saved plan results {saved_results}")
+        failed += 1
+
+    # Links to renamed notes must follow them, and a second run must only
+    # read the notes that changed
+    from .links import update_links, LinkIndex
+    from .walker import process_tree
+    print("\nTesting link rewriting:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vault = Path(temp_dir, "vault")
+        (vault / "sub").mkdir(parents=True)
+        (vault / "index.md").write_text("[[project_1225|Project]] [m](sub/meeting%20715.md) "
+                                        "[[sub/meeting 715#Agenda]] [web](https://x.org/project_1225.md)\n")
+        (vault / "sub" / "meeting 715.md").write_text("Back to [[index]] and [p](../project_1225.md)\n")
+        (vault / "project_1225.md").touch()
+        # Replacing a symlinked or hard-linked note would cut the link
+        Path(temp_dir, "outside.md").write_text("[[project_1225]]\n")
+        (vault / "alias.md").symlink_to(Path(temp_dir, "outside.md"))
+        os.link(Path(temp_dir, "outside.md"), vault / "shared.md")
+        index_file = os.path.join(temp_dir, "links.json")
+        renamed = process_tree(vault, quiet_logger)
+        changed = update_links(str(vault), renamed, quiet_logger, index_file=index_file, workers=2)
+        index = LinkIndex(str(vault), index_file)
+        # Pretend the index was saved long after the notes were written
+        index.recorded_ns += 10 ** 10
+        index._dirty = True
+        index.save()
+        reread = LinkIndex(str(vault), index_file).refresh(quiet_logger)
+        expected_index = ("[[project_2025-12-25|Project]] [m](sub/meeting%202025-07-15.md) "
+                          "[[sub/meeting 2025-07-15#Agenda]] [web](https://x.org/project_1225.md)\n")
+        if (sorted(changed) == [("index.md", 3), (os.path.join("sub", "meeting 2025-07-15.md"), 1)]
+                and (vault / "index.md").read_text() == expected_index
+                and "../project_2025-12-25.md" in (vault / "sub" / "meeting 2025-07-15.md").read_text()
+                and reread == 0 and (vault / "alias.md").is_symlink()
+                and os.stat(vault / "shared.md").st_nlink == 2
+                and Path(temp_dir, "outside.md").read_text() == "[[project_1225]]\n"):
+            print("✓ rewrote 4 links in 2 notes, left symlinked and hard-linked notes alone; "
+                  "the index refresh read no unchanged note")
+            passed += 1
+        else:
+            print(f"✗ link rewriting changed {changed}, refresh read {reread} notes")
+            failed += 1
+
+    # Archive members must be renamed with their payloads left byte for byte
+    from .archives import retitle_archive
+    print("\nTesting archive mode:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        zip_path = os.path.join(temp_dir, "notes.zip")
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("notes/", "")
+            archive.writestr("notes/project_1225.md", "project " * 100)
+            archive.writestr("a_715.txt", "kept")
+            archive.writestr("a_2025-07-15.txt", "already there")
+        with zipfile.ZipFile(zip_path) as archive:
+            payloads = sorted((info.CRC, info.compress_size) for info in archive.infolist())
+        zip_renamed = retitle_archive(zip_path, quiet_logger)
+        with zipfile.ZipFile(zip_path) as archive:
+            zip_ok = (archive.testzip() is None
+                      and sorted((info.CRC, info.compress_size) for info in archive.infolist()) == payloads
+                      and archive.read("notes/project_2025-12-25.md") == b"project " * 100
+                      and "a_715.txt" in archive.namelist())
+
+        tar_path = os.path.join(temp_dir, "notes.tar.gz")
+        with tarfile.open(tar_path, 'w:gz') as archive:
+            member = tarfile.TarInfo("notes/meeting_801.md")
+            member.size = 5
+            archive.addfile(member, io.BytesIO(b"hello"))
+            link = tarfile.TarInfo("notes/latest.md")
+            link.type = tarfile.SYMTYPE
+            link.linkname = "meeting_801.md"
+            archive.addfile(link)
+        tar_renamed = retitle_archive(tar_path, quiet_logger)
+        with tarfile.open(tar_path) as archive:
+            tar_ok = (archive.extractfile("notes/meeting_2025-08-01.md").read() == b"hello"
+                      and archive.getmember("notes/latest.md").linkname == "meeting_2025-08-01.md")
+
+        if zip_renamed == [("notes/project_1225.md", "notes/project_2025-12-25.md")] and zip_ok and tar_ok:
+            print("✓ renamed zip members without recompressing and streamed a tar.gz, symlink updated")
+            passed += 1
+        else:
+            print(f"✗ archive mode renamed {zip_renamed} (zip ok: {zip_ok}), {tar_renamed} (tar ok: {tar_ok})")
+            failed += 1
+
+    # Chains must run back to front, cycles go through a temporary name, and
+    # no rename may overwrite a duplicate's winner or a file that stays
+    from .planner import plan_renames
+    print("\nTesting the rename planner:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        planner_names = ("A", "B", "P", "Q", "D1", "D2", "E", "X")
+        for name in planner_names:
+            Path(temp_dir, name).write_text(name)
+        planner_inodes = {name: os.lstat(os.path.join(temp_dir, name)).st_ino for name in planner_names}
+        planned = plan_renames(planner_names, [
+            (source, target, planner_inodes[source])
+            for source, target in (("A", "B"), ("B", "C"), ("P", "Q"), ("Q", "P"),
+                                   ("D1", "D"), ("D2", "D"), ("E", "X"))], temp_dir)
+        planned.directory = temp_dir
+        planned_steps = sorted([(step.source, step.destination) for step in chain] for chain in planned.chains)
+        execute_plan(planned, quiet_logger)
+        planner_contents = {name: Path(temp_dir, name).read_text() for name in os.listdir(temp_dir)}
+    expected_steps = [[("B", "C"), ("A", "B")], [("D1", "D")],
+                      [("P", ".P.retitle-0.tmp"), ("Q", "P"), (".P.retitle-0.tmp", "Q")]]
+    expected_contents = {"B": "A", "C": "B", "P": "Q", "Q": "P", "D": "D1", "D2": "D2", "E": "E", "X": "X"}
+    if (planned_steps == expected_steps and planned.duplicates == {"D": ["D1", "D2"]}
+            and planned.collisions == [("E", "X")] and planner_contents == expected_contents):
+        print("✓ ordered a chain, parked a cycle, kept the first of two duplicates "
+              "and skipped a target that stays")
+        passed += 1
+    else:
+        print(f"✗ planned {planned_steps}, duplicates {planned.duplicates}, "
+              f"collisions {planned.collisions}, left {planner_contents}")
+        failed += 1
+
+    # Names lists cover only part of a directory: the temporary name of a
+    # cycle must not be a file that exists on disk but not in the index
+    print("\nTesting temporary names against the disk:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in ("a_101.md", "a_2025-01-01.md", ".a_101.md.retitle-0.tmp"):
+            Path(temp_dir, name).touch()
+        cycle = plan_renames(["a_101.md", "a_2025-01-01.md"],
+                             [("a_101.md", "a_2025-01-01.md", 1), ("a_2025-01-01.md", "a_101.md", 2)],
+                             temp_dir)
+        temp_names = list(cycle.temp_names)
+    if temp_names == [".a_101.md.retitle-1.tmp"]:
+        print("✓ skipped a temporary name taken on disk")
+        passed += 1
+    else:
+        print(f"✗ cycle parked under {temp_names}")
+        failed += 1
+
+    # A run killed inside an A <-> B cycle, before any rename and after the
+    # first file was parked, must be finished by resume without losing a file
+    from .journal import RenameJournal, resume_journal
+    print("\nTesting journal resume of a cycle:")
+    cycle_results = []
+    for renames_before_crash in (0, 1):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name in ("A", "B"):
+                Path(temp_dir, name).write_text(name)
+            inodes = {name: os.lstat(os.path.join(temp_dir, name)).st_ino for name in ("A", "B")}
+            cycle = plan_renames(["A", "B"], [("A", "B", inodes["A"]), ("B", "A", inodes["B"])])
+            cycle.directory = temp_dir
+            journal_path = os.path.join(temp_dir, "run.journal")
+            with RenameJournal(journal_path) as journal:
+                journal.begin_plan(cycle)
+            for step in cycle.chains[0][:renames_before_crash]:
+                os.rename(os.path.join(temp_dir, step.source), os.path.join(temp_dir, step.destination))
+            resume_journal(journal_path, quiet_logger)
+            cycle_results.append((Path(temp_dir, "A").read_text(), Path(temp_dir, "B").read_text(),
+                                  sorted(os.listdir(temp_dir))))
+    if all(result == ("B", "A", ["A", "B", "run.journal"]) for result in cycle_results):
+        print("✓ resumed a cycle killed before and after parking its first file")
+        passed += 1
+    else:
+        print(f"✗ resumed cycle left {cycle_results}")
+        failed += 1
+
+    # Local processes stand in for nodes; the root starts out leased by a
+    # node that died, so its lease must be taken over
+    from .distributed import LeaseCoordinator, item_key
+    print("\nTesting distributed runs:")
+    node_code = ("import sys, json, logging; from pathlib import Path; logging.disable(logging.WARNING); "
+                 "from src.distributed import process_tree_distributed; "
+                 "print(json.dumps(process_tree_distributed(Path(sys.argv[1]), "
+                 "logging.getLogger('quiet'), sys.argv[2], node_id=sys.argv[3], lease_ttl=1, workers=2)))")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tree = os.path.join(temp_dir, "notes")
+        expected = set()
+        for folder in range(12):
+            for sub in ("", "archive"):
+                directory = os.path.join(tree, f"folder{folder}", sub)
+                os.makedirs(directory, exist_ok=True)
+                for day in range(10, 20):
+                    Path(directory, f"note_{folder + 1}{day}.md").touch()
+                    expected.add(os.path.join(f"folder{folder}", sub, f"note_{folder + 1}{day}.md"))
+        coordination = os.path.join(temp_dir, "coordination")
+        dead_node = LeaseCoordinator(coordination, "dead-node", lease_ttl=1)
+        dead_node.publish(os.curdir, 0)
+        dead_node.claim(item_key(os.curdir))
+        os.utime(os.path.join(coordination, "leases", item_key(os.curdir)), (0, 0))
+        # It died while queueing a subdirectory, too
+        Path(coordination, "items", item_key("folder0")).touch()
+        nodes = [subprocess.Popen([sys.executable, '-c', node_code, tree, coordination, f"node{n}"],
+                                  cwd=package_root, stdout=subprocess.PIPE, text=True)
+                 for n in range(3)]
+        renamed = [tuple(pair) for node in nodes for pair in json.loads(node.communicate()[0])]
+        done = os.listdir(os.path.join(coordination, "done"))
+        leases = os.listdir(os.path.join(coordination, "leases"))
+        if (len(renamed) == len(expected) and {old for old, _ in renamed} == expected
+                and len(done) == 25 and not leases):
+            print(f"✓ 3 node processes renamed {len(renamed)} files exactly once, "
+                  f"dead node's lease and half-written entry taken over")
+            passed += 1
+        else:
+            print(f"✗ distributed run renamed {len(renamed)} of {len(expected)} files, "
+                  f"{len(done)} directories done, leases left: {leases}")
+            failed += 1
+
+    # The throttle must back off while the simulated storage is slow and
+    # recover once it is fast again
+    from .fs import ThrottledFilesystem
+    print("\nTesting throttled I/O:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for day in range(10, 30):
+            for month in range(1, 6):
+                Path(temp_dir, f"note_{month}{day}.txt").touch()
+        slow_phase = LatencyFilesystem(schedule=lambda operation: 0.02 if 10 <= operation < 30 else 0.0)
+        throttle = ThrottledFilesystem(slow_phase, max_in_flight=8, target_latency=0.01)
+        renamed = process_directory(Path(temp_dir), quiet_logger, filesystem=throttle, rename_workers=8)
+        rate_limited = ThrottledFilesystem(LatencyFilesystem(latency=0), rate=200)
+        started = time.perf_counter()
+        for _ in range(41):
+            rate_limited.lexists(temp_dir)
+        rate_elapsed = time.perf_counter() - started
+        # Three halvings take the limit from 8 down to 1
+        if (len(renamed) == 100 and throttle.backoffs >= 3 and throttle.limit == 8
+                and 0.15 <= rate_elapsed < 0.5):
+            print(f"✓ backed off {throttle.backoffs} times on slow storage and recovered; "
+                  f"41 ops at 200/s took {rate_elapsed:.2f}s")
+            passed += 1
+        else:
+            print(f"✗ throttle renamed {len(renamed)}, limit {throttle.limit}, "
+                  f"backoffs {throttle.backoffs}, rate test {rate_elapsed:.2f}s")
+            failed += 1
+
+    # Chunked renames with a spilled record must match the in-memory mode
+    from .bounded import process_directory_bounded
+    print("\nTesting bounded-memory mode:")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for day in range(10, 30):
+            Path(temp_dir, f"note_7{day}.txt").touch()
+        Path(temp_dir, "note_2025-07-12.txt").touch()
+        record = process_directory_bounded(Path(temp_dir), quiet_logger, chunk_size=3, spill_threshold=4)
+        renamed = sorted(record)
+        spilled = record.spilled
+        record.close()
+        expected = [(f"note_7{day}.txt", f"note_2025-07-{day}.txt") for day in range(10, 30) if day != 12]
+        if renamed == expected and spilled and Path(temp_dir, "note_712.txt").exists():
+            print(f"✓ renamed {len(renamed)} files in chunks of 3 from a spilled rename record")
+            passed += 1
+        else:
+            print(f"✗ bounded-memory mode renamed {renamed} (spilled: {spilled})")
+            failed += 1
+
     print(f"\nTest Results: {passed} passed, {failed} failed")
     
     # Save test results to file
@@ -211,6 +955,73 @@ def test(ctx):
         print("Some tests failed. Please review the implementation.")
 
 
+@task(help={'files': 'Number of synthetic filenames to process (default: 200000)'})
+def bench_logging(ctx, files=200000):
+    """
+    Measure the per-file cost of logging in the processing loop.
+    """
+    from .bench import bench_logging as run_bench_logging
+    run_bench_logging(files=int(files))
+
+
+@task(help={
+    'files': 'Corpus size: names parsed, files scanned, planned or renamed (default: 100000)',
+    'scenarios': "Comma-separated scenarios (default: parse,parse-many,scan,plan,rename)",
+    'files-per-directory': 'Files per directory of the generated corpus (default: 1000)',
+    'repeat': 'Runs per scenario, the fastest is reported (default: 3)',
+    'corpus-root': 'Where corpora are generated (default: /dev/shm if available)',
+    'output': 'Write the results to this JSON file',
+    'baseline': 'Compare against results saved earlier and fail on regressions',
+    'tolerance': 'Allowed slowdown or memory growth over the baseline (default: 0.25)'
+})
+def bench(ctx, files=100000, scenarios=None, files_per_directory=1000, repeat=3,
+          corpus_root=None, output=None, baseline=None, tolerance=0.25):
+    """
+    Time parsing, scanning, planning and renaming on a synthetic note corpus.
+    """
+    from invoke.exceptions import Exit
+    from .bench import (run_suite, print_results, save_results, load_results,
+                        compare_results, BENCH_SCENARIOS)
+    
+    selected = scenarios.split(',') if scenarios else BENCH_SCENARIOS
+    results = run_suite(files=int(files), scenarios=selected,
+                        files_per_directory=int(files_per_directory), repeat=int(repeat),
+                        corpus_root=corpus_root)
+    print_results(results)
+    
+    if output:
+        save_results(results, output)
+        print(f"Results saved to: {output}")
+    
+    if baseline:
+        regressions = compare_results(results, load_results(baseline), float(tolerance))
+        if regressions:
+            print(f"\nRegressions against {baseline}:")
+            for regression in regressions:
+                print(f"  ✗ {regression}")
+            raise Exit(code=1)
+        print(f"\nNo regressions against {baseline} ✓")
+
+
+@task(help={
+    'runs': 'Number of timed runs (default: 20)',
+    'budget': 'Allowed startup overhead in milliseconds (default: 100)'
+})
+def bench_startup(ctx, runs=20, budget=None):
+    """
+    Check that the `retitle` command starts within its time budget.
+    """
+    from invoke.exceptions import Exit
+    from .bench import bench_startup as run_bench_startup, STARTUP_BUDGET_MS
+    
+    budget = float(budget) if budget is not None else STARTUP_BUDGET_MS
+    result = run_bench_startup(runs=int(runs), budget_ms=budget)
+    if result['overhead_ms'] > budget or result.get('unexpected_modules'):
+        print("✗ Startup budget exceeded")
+        raise Exit(code=1)
+    print("✓ Startup within budget")
+
+
 @task
 def help_formats(ctx):
     """
@@ -248,129 +1059,7 @@ def help_formats(ctx):
     print("  invoke retitle --path /some/path  # Process specific directory")
     print("  invoke retitle --log              # Force log file creation")
     print("  invoke test                       # Run tests")
+    print("  invoke bench                      # Benchmark parse/scan/plan/rename")
+    print("  invoke bench-logging              # Measure logging overhead per file")
+    print("  invoke bench-startup              # Check the retitle startup budget")
     print("  invoke help-formats               # Show this help")
-
-
-def retitle_cli():
-    """
-    CLI entry point for system-wide installation.
-    This allows the script to be called as 'retitle' from anywhere.
-    """
-    import sys
-    import argparse
-    
-    parser = argparse.ArgumentParser(
-        description="Retitle note files by converting date formats to YYYY-MM-DD"
-    )
-    parser.add_argument(
-        "path", 
-        nargs="?", 
-        default=".", 
-        help="Target directory path (default: current directory)"
-    )
-    parser.add_argument(
-        "-y", "--yes", 
-        action="store_true", 
-        help="Skip all confirmations and proceed automatically"
-    )
-    parser.add_argument(
-        "-f", "--force", 
-        action="store_true", 
-        help="Alias for --yes, skip all confirmations"
-    )
-    parser.add_argument(
-        "--log", 
-        action="store_true", 
-        help="Save log file"
-    )
-    
-    args = parser.parse_args()
-    
-    # Call the retitle logic directly without invoke
-    _retitle_direct(path=args.path, log=args.log, yes=args.yes, force=args.force)
-
-
-def _retitle_direct(path=None, log=None, yes=False, force=False):
-    """
-    Direct retitle function without invoke dependency.
-    """
-    # Handle force flag (--force is alias for --yes)
-    skip_confirmations = yes or force
-    
-    # Determine target path
-    target_path = Path(path) if path else Path.cwd()
-    
-    if not target_path.exists():
-        print(f"Error: Directory does not exist: {target_path}")
-        return
-    
-    if not target_path.is_dir():
-        print(f"Error: Path is not a directory: {target_path}")
-        return
-    
-    # Get file count for confirmation
-    files = [f for f in target_path.iterdir() if f.is_file()]
-    file_count = len(files)
-    
-    # Show path and file count, ask for confirmation
-    print(f"Target directory: {target_path.absolute()}")
-    print(f"Found {file_count} files to process")
-    
-    if not skip_confirmations:
-        proceed = input(f"Proceed with processing {file_count} files in '{target_path}'? (y/n): ").lower().strip()
-        if proceed not in ['y', 'yes']:
-            print("Operation cancelled.")
-            return
-    
-    # Handle log file decision
-    log_filename = None
-    if log is None and not skip_confirmations:
-        # Ask user for confirmation
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        suggested_log = f"note_retitler_{timestamp}.log"
-        save_log = input(f"Save log file as '{suggested_log}'? (y/n): ").lower().strip()
-        if save_log in ['y', 'yes']:
-            log_filename = suggested_log
-    elif log or skip_confirmations:
-        # User explicitly requested log file or using force mode
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_filename = f"note_retitler_{timestamp}.log"
-    
-    # Setup logging
-    if log_filename:
-        logger = setup_logging(log_filename)
-        print(f"Log file will be saved as: {log_filename}")
-    else:
-        # Console-only logging
-        logger = logging.getLogger('note_retitler')
-        logger.setLevel(logging.INFO)
-        logger.handlers.clear()  # Clear any existing handlers
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-        if not skip_confirmations:
-            print("Proceeding with console output only.")
-    
-    logger.info("Starting Note Retitler Script")
-    logger.info(f"Target directory: {target_path.absolute()}")
-    logger.info(f"Found {file_count} files to process")
-    
-    # Process the directory
-    renamed_files = process_directory(target_path, logger)
-    
-    # Summary
-    print(f"\nProcessing complete. Renamed {len(renamed_files)} files.")
-    logger.info(f"Processing complete. Renamed {len(renamed_files)} files.")
-    
-    if renamed_files:
-        print("\nSummary of renamed files:")
-        logger.info("Summary of renamed files:")
-        for old_name, new_name in renamed_files:
-            print(f"  {old_name} -> {new_name}")
-            logger.info(f"  {old_name} -> {new_name}")
-    
-    if log_filename:
-        print(f"\nLog saved to: {log_filename}")
-        logger.info(f"Log saved to: {log_filename}")
\ No newline at end of file
@@ -0,0 +1,226 @@
+"""
+Recursive Directory Walker
+
+Processes a whole directory tree by running process_directory (or
+plan_directory) on every directory concurrently with a bounded thread pool.
+Subdirectories are discovered during the same os.scandir pass that feeds the
+entries into the handler, so each directory is listed exactly once.
+Subdirectories pruned by the name filter (see filters.py) are not entered.
+"""
+
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .filters import default_name_filter
+from .note_retitler import process_directory, plan_directory
+from .planner import RenamePlan
+
+
+def default_worker_count() -> int:
+    """
+    Default size of the directory worker pool.
+
+    Directory processing is dominated by filesystem latency, so this follows
+    the ThreadPoolExecutor default of a few threads more than the CPU count.
+
+    Returns:
+        Number of worker threads
+    """
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def _walk_tree_node(directory: str, depth: int, handler: Callable, logger: logging.Logger,
+                    follow_symlinks: bool, handler_options: Dict[str, Any]) -> Tuple[str, int, Any, List[str]]:
+    """
+    Run the handler on one directory of the tree and collect its subdirectories.
+
+    Args:
+        directory: Directory to process
+        depth: Depth of the directory below the root (root is 0)
+        handler: process_directory or plan_directory
+        logger: Logger instance for output
+        follow_symlinks: Whether symlinked directories are descended into
+        handler_options: Extra keyword arguments for the handler
+
+    Returns:
+        Tuple of (directory, depth, handler_result, subdirectories)
+    """
+    subdirs = []
+    prunes = (handler_options.get('name_filter') or default_name_filter()).prunes
+
+    def split_entries() -> Iterator[os.DirEntry]:
+        # Every entry goes to the handler, directories are also kept for the walker
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=follow_symlinks) and not prunes(entry.name):
+                        subdirs.append(entry.path)
+                except OSError:
+                    pass
+                yield entry
+
+    entries = split_entries()
+    try:
+        result = handler(Path(directory), logger, entries=entries, **handler_options)
+        # Handlers may skip an unchanged directory without reading its
+        # entries; the walker still needs its subdirectories
+        for _ in entries:
+            pass
+    except OSError as e:
+        logger.error("Failed to process directory %s: %s", directory, e)
+        result = None
+
+    return directory, depth, result, subdirs
+
+
+def walk_tree(root_path: Path, logger: logging.Logger, handler: Callable,
+              max_depth: Optional[int] = None, follow_symlinks: bool = False,
+              workers: Optional[int] = None, **handler_options) -> Iterator[Tuple[str, Any]]:
+    """
+    Run a per-directory handler over a directory tree concurrently.
+
+    Args:
+        root_path: Root of the directory tree to process
+        logger: Logger instance for output
+        handler: Callable taking (directory_path, logger, entries=...) such as
+            process_directory or plan_directory
+        max_depth: Maximum depth to descend below the root (None for unlimited,
+            0 processes only the root directory)
+        follow_symlinks: Descend into symlinked directories; each physical
+            directory is still processed only once
+        workers: Maximum number of directories processed at the same time
+        **handler_options: Extra keyword arguments passed to the handler
+
+    Returns:
+        Iterator of (directory, handler_result) in completion order
+    """
+    if not root_path.exists():
+        logger.error("Directory does not exist: %s", root_path)
+        return
+
+    if not root_path.is_dir():
+        logger.error("Path is not a directory: %s", root_path)
+        return
+
+    root = str(root_path)
+    workers = workers or default_worker_count()
+
+    # Physical directories already queued, to break symlink cycles
+    visited = set()
+
+    def should_visit(directory: str, depth: int) -> bool:
+        if max_depth is not None and depth > max_depth:
+            return False
+        try:
+            st = os.stat(directory)
+        except OSError as e:
+            logger.error("Cannot access directory %s: %s", directory, e)
+            return False
+        key = (st.st_dev, st.st_ino)
+        if key in visited:
+            return False
+        visited.add(key)
+        return True
+
+    directory_count = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        if should_visit(root, 0):
+            pending.add(pool.submit(_walk_tree_node, root, 0, handler, logger,
+                                    follow_symlinks, handler_options))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory, depth, result, subdirs = future.result()
+                directory_count += 1
+
+                # Queue subdirectories as soon as they are discovered
+                for subdir in subdirs:
+                    if should_visit(subdir, depth + 1):
+                        pending.add(pool.submit(_walk_tree_node, subdir, depth + 1,
+                                                handler, logger, follow_symlinks, handler_options))
+
+                yield directory, result
+
+    logger.info("Processed %d directories under %s", directory_count, root_path)
+
+
+def process_tree(root_path: Path, logger: logging.Logger, max_depth: Optional[int] = None,
+                 follow_symlinks: bool = False, workers: Optional[int] = None,
+                 **process_options) -> List[Tuple[str, str]]:
+    """
+    Process a directory and all of its subdirectories concurrently.
+
+    Args:
+        root_path: Root of the directory tree to process
+        logger: Logger instance for output
+        max_depth: Maximum depth to descend below the root (None for unlimited)
+        follow_symlinks: Descend into symlinked directories
+        workers: Maximum number of directories processed at the same time
+        **process_options: Extra keyword arguments for process_directory
+
+    Returns:
+        List of tuples containing (old_path, new_path) relative to the root,
+        sorted by path
+    """
+    renamed_files = []
+    root = str(root_path)
+
+    for directory, renamed in walk_tree(root_path, logger, process_directory, max_depth=max_depth,
+                                        follow_symlinks=follow_symlinks, workers=workers,
+                                        **process_options):
+        # Merge this directory's results as paths relative to the root
+        renamed_files.extend(relative_renames(root, directory, renamed or []))
+
+    renamed_files.sort()
+    return renamed_files
+
+
+def plan_tree(root_path: Path, logger: logging.Logger, max_depth: Optional[int] = None,
+              follow_symlinks: bool = False, workers: Optional[int] = None,
+              **plan_options) -> List[RenamePlan]:
+    """
+    Plan the renames of a whole directory tree without touching any file.
+
+    Args:
+        root_path: Root of the directory tree to plan
+        logger: Logger instance for output
+        max_depth: Maximum depth to descend below the root (None for unlimited)
+        follow_symlinks: Descend into symlinked directories
+        workers: Maximum number of directories planned at the same time
+        **plan_options: Extra keyword arguments for plan_directory
+
+    Returns:
+        List of RenamePlan objects sorted by directory
+    """
+    plans = [plan for _, plan in walk_tree(root_path, logger, plan_directory, max_depth=max_depth,
+                                           follow_symlinks=follow_symlinks, workers=workers,
+                                           **plan_options)
+             if plan is not None]
+    plans.sort(key=lambda plan: plan.directory)
+    return plans
+
+
+def relative_renames(root: str, directory: str,
+                     renamed: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    Express one directory's renames as paths relative to a tree root.
+
+    Args:
+        root: Root of the tree
+        directory: Directory the renames happened in
+        renamed: (old_filename, new_filename) pairs
+
+    Returns:
+        List of (old_path, new_path) relative to the root
+    """
+    relative_dir = os.path.relpath(directory, root)
+    if relative_dir == os.curdir:
+        return list(renamed)
+    return [(os.path.join(relative_dir, old_name), os.path.join(relative_dir, new_name))
+            for old_name, new_name in renamed]
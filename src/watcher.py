@@ -0,0 +1,371 @@
+"""
+Watch Mode
+
+Keeps running and retitles notes as they arrive. On Linux the kernel's
+inotify interface (through ctypes, no extra dependency) reports the names of
+files that were written, created or moved into a watched directory; other
+systems fall back to polling directory modification times.
+
+Events are debounced and coalesced per directory: a burst of saves into one
+folder becomes a single batch once the folder has been quiet for the
+debounce interval, and only the reported names are planned and renamed, so a
+directory is never rescanned because one file changed.
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .fs import LocalFilesystem
+from .filters import NameFilter, default_name_filter
+from .note_retitler import process_names
+
+
+# inotify event masks (from <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# Seconds a directory must be quiet before its pending names are processed
+DEFAULT_DEBOUNCE = 0.5
+
+# Seconds between two checks of the watched directories by the polling backend
+DEFAULT_POLL_INTERVAL = 1.0
+
+WATCH_BACKENDS = ('auto', 'inotify', 'poll')
+
+# A watch event: (directory, name, is_directory). A name of None means the
+# backend lost track of the directory's changes and it must be rescanned.
+WatchEvent = Tuple[str, Optional[str], bool]
+
+
+class InotifyWatcher:
+    """
+    Directory watcher backed by Linux inotify.
+    """
+
+    def __init__(self):
+        # Loaded here so importing watch mode costs nothing until it is used
+        import ctypes
+        import ctypes.util
+        self._ctypes = ctypes
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._directories = {}
+
+    def add_directory(self, directory: str) -> None:
+        """
+        Start watching a directory (not its subdirectories).
+
+        Args:
+            directory: Absolute directory path
+        """
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = self._ctypes.get_errno()
+            raise OSError(err, os.strerror(err), directory)
+        self._directories[wd] = directory
+
+    def read_events(self, timeout: float) -> List[WatchEvent]:
+        """
+        Wait up to timeout seconds and return the events that arrived.
+
+        Args:
+            timeout: Maximum wait in seconds
+
+        Returns:
+            List of (directory, name, is_directory) events
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buffer):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped; every watched directory may have news
+                events.extend((directory, None, True) for directory in self._directories.values())
+                continue
+            directory = self._directories.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                self._directories.pop(wd, None)
+                continue
+            if name:
+                events.append((directory, os.fsdecode(name), bool(mask & IN_ISDIR)))
+        return events
+
+    def close(self) -> None:
+        """
+        Stop watching and release the inotify descriptor.
+        """
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """
+    Portable directory watcher that polls modification times.
+
+    A directory is only listed when its modification time changed since the
+    last poll, and only names not seen before are reported.
+    """
+
+    def __init__(self, interval: float = DEFAULT_POLL_INTERVAL):
+        """
+        Args:
+            interval: Seconds between two checks of the watched directories
+        """
+        self.interval = interval
+        self._directories = {}
+        self._next_poll = time.monotonic() + interval
+
+    def _snapshot(self, directory: str) -> Tuple[int, Set[str]]:
+        mtime_ns = os.stat(directory).st_mtime_ns
+        with os.scandir(directory) as it:
+            names = {entry.name for entry in it}
+        return mtime_ns, names
+
+    def add_directory(self, directory: str) -> None:
+        """
+        Start watching a directory (not its subdirectories).
+
+        Args:
+            directory: Absolute directory path
+        """
+        self._directories[directory] = self._snapshot(directory)
+
+    def read_events(self, timeout: float) -> List[WatchEvent]:
+        """
+        Wait up to timeout seconds and return the changes found by the next poll.
+
+        Args:
+            timeout: Maximum wait in seconds
+
+        Returns:
+            List of (directory, name, is_directory) events
+        """
+        wait = self._next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(max(0.0, timeout))
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        self._next_poll = time.monotonic() + self.interval
+
+        events = []
+        for directory, (mtime_ns, names) in list(self._directories.items()):
+            try:
+                current_mtime = os.stat(directory).st_mtime_ns
+                if current_mtime == mtime_ns:
+                    continue
+                current_mtime, current_names = self._snapshot(directory)
+            except OSError:
+                del self._directories[directory]
+                continue
+            self._directories[directory] = (current_mtime, current_names)
+            for name in current_names - names:
+                is_directory = os.path.isdir(os.path.join(directory, name))
+                events.append((directory, name, is_directory))
+        return events
+
+    def close(self) -> None:
+        """
+        Stop watching.
+        """
+        self._directories.clear()
+
+
+def create_watcher(backend: str = 'auto', logger: Optional[logging.Logger] = None,
+                   poll_interval: float = DEFAULT_POLL_INTERVAL):
+    """
+    Create the directory watcher for a backend name.
+
+    Args:
+        backend: 'inotify', 'poll', or 'auto' (inotify where available)
+        logger: Logger used to report the fallback to polling
+        poll_interval: Seconds between two checks when polling
+
+    Returns:
+        InotifyWatcher or PollingWatcher
+    """
+    if backend not in WATCH_BACKENDS:
+        raise ValueError(f"Unknown watch backend: {backend}")
+    if backend == 'poll':
+        return PollingWatcher(poll_interval)
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError) as e:
+        if backend == 'inotify':
+            raise
+        if logger is not None:
+            logger.info("inotify unavailable (%s), polling for changes", e)
+        return PollingWatcher(poll_interval)
+
+
+def _watch_tree(watcher, directory: str, depth: int, max_depth: Optional[int],
+                depths: Dict[str, int], logger: logging.Logger, name_filter: NameFilter) -> List[str]:
+    """
+    Add a directory and, up to max_depth, its subdirectories to a watcher.
+
+    Returns:
+        The directories that are now watched
+    """
+    try:
+        watcher.add_directory(directory)
+    except OSError as e:
+        logger.warning("Cannot watch %s: %s", directory, e)
+        return []
+    depths[directory] = depth
+    watched = [directory]
+    if max_depth is not None and depth >= max_depth:
+        return watched
+    try:
+        with os.scandir(directory) as it:
+            subdirectories = [entry.path for entry in it
+                              if entry.is_dir(follow_symlinks=False) and not name_filter.prunes(entry.name)]
+    except OSError:
+        return watched
+    for subdirectory in subdirectories:
+        watched.extend(_watch_tree(watcher, subdirectory, depth + 1, max_depth, depths, logger, name_filter))
+    return watched
+
+
+def watch(root_path: str, logger: logging.Logger, recursive: bool = False,
+          max_depth: Optional[int] = None, debounce: float = DEFAULT_DEBOUNCE,
+          backend: str = 'auto', filesystem: Optional[LocalFilesystem] = None,
+          rename_workers: int = 1, journal=None,
+          stop_event: Optional[threading.Event] = None,
+          on_batch: Optional[Callable[[str, List[Tuple[str, str]]], None]] = None,
+          name_filter: Optional[NameFilter] = None,
+          poll_interval: float = DEFAULT_POLL_INTERVAL) -> int:
+    """
+    Retitle notes as they arrive until stopped.
+
+    Files already in the directory when watching starts are left alone.
+
+    Args:
+        root_path: Directory to watch
+        logger: Logger instance for output
+        recursive: Also watch subdirectories, including ones created later
+        max_depth: Maximum subdirectory depth watched in recursive mode
+        debounce: Seconds a directory must be quiet before it is processed
+        backend: 'inotify', 'poll', or 'auto'
+        filesystem: Filesystem the renames go through (default: local)
+        rename_workers: Number of independent renames run concurrently
+        journal: Optional RenameJournal recording intended and completed renames
+        stop_event: Event that ends the watch when set (default: run until interrupted)
+        on_batch: Called with (directory, renamed) after every processed batch
+        name_filter: NameFilter of the names to consider (default: default_name_filter())
+        poll_interval: Seconds between two checks by the polling backend
+
+    Returns:
+        Total number of files renamed
+    """
+    root = os.path.abspath(root_path)
+    stop_event = stop_event or threading.Event()
+    if not recursive:
+        max_depth = 0
+    watcher = create_watcher(backend, logger, poll_interval)
+    depths = {}
+    name_filter = name_filter or default_name_filter()
+    _watch_tree(watcher, root, 0, max_depth, depths, logger, name_filter)
+
+    pending = {}  # directory -> names waiting for the directory to settle
+    last_event = {}  # directory -> monotonic time of its latest event
+    produced = {}  # directory -> names created by our own renames
+    total = 0
+    logger.info("Watching %s (%s)", root, type(watcher).__name__)
+
+    try:
+        while not stop_event.is_set():
+            timeout = debounce if pending else min(debounce * 4, 1.0)
+            for directory, name, is_directory in watcher.read_events(timeout):
+                if name is None:
+                    _queue_directory(directory, pending, last_event, logger)
+                    continue
+                if is_directory:
+                    depth = depths.get(directory, 0) + 1
+                    if (max_depth is None or depth <= max_depth) and not name_filter.prunes(name):
+                        subdirectory = os.path.join(directory, name)
+                        # Notes moved in together with their folders produced no file events
+                        for watched in _watch_tree(watcher, subdirectory, depth, max_depth,
+                                                   depths, logger, name_filter):
+                            _queue_directory(watched, pending, last_event, logger)
+                    continue
+                # Ignore the event caused by our own rename
+                ours = produced.get(directory)
+                if ours and name in ours:
+                    ours.discard(name)
+                    continue
+                pending.setdefault(directory, set()).add(name)
+                last_event[directory] = time.monotonic()
+
+            now = time.monotonic()
+            for directory in [d for d, t in last_event.items() if now - t >= debounce]:
+                names = pending.pop(directory)
+                del last_event[directory]
+                renamed = process_names(directory, sorted(names), logger, filesystem=filesystem,
+                                        rename_workers=rename_workers, journal=journal,
+                                        name_filter=name_filter)
+                if renamed:
+                    produced.setdefault(directory, set()).update(new for _, new in renamed)
+                    total += len(renamed)
+                if on_batch is not None:
+                    on_batch(directory, renamed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+    return total
+
+
+def _queue_directory(directory: str, pending: Dict[str, Set[str]], last_event: Dict[str, float],
+                     logger: logging.Logger) -> None:
+    """
+    Queue every file of a directory the watcher has no individual events for.
+    """
+    try:
+        with os.scandir(directory) as it:
+            names = [entry.name for entry in it if not entry.is_dir(follow_symlinks=False)]
+    except OSError as e:
+        logger.warning("Cannot read %s: %s", directory, e)
+        return
+    pending.setdefault(directory, set()).update(names)
+    last_event[directory] = time.monotonic()